@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "dance_studio.settings")
+# Serve the async versions of the busiest views (see studio.async_views)
+os.environ.setdefault("STUDIO_ASYNC_VIEWS", "1")
 
 application = get_asgi_application()
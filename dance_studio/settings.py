@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+import django
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -27,6 +30,9 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+# Addresses allowed to scrape /metrics without logging in
+INTERNAL_IPS = ["127.0.0.1"]
+
 
 # Application definition
 
@@ -41,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "studio.middleware.StaticFilesMiddleware",  # Collected static files, when STUDIO_STATIC_PIPELINE is on
+    "studio.middleware.PerformanceMiddleware",  # Per-view latency and query metrics, see /metrics
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -78,7 +86,39 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Keep connections open between requests (seconds; 0 closes after each request)
+        "CONN_MAX_AGE": int(os.environ.get("STUDIO_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {},
+    }
+}
+
+if django.VERSION >= (5, 1):
+    # Take the write lock when a transaction starts, so check-ins queue on busy_timeout instead of
+    # failing when a read transaction tries to upgrade to a write
+    DATABASES["default"]["OPTIONS"]["transaction_mode"] = "IMMEDIATE"
+
+# Read replica: set STUDIO_READ_REPLICA to a database file to send the read-only views (index,
+# attendance history, export, reports) there. "manage.py sync_replica" keeps a local copy of the
+# primary at that path, standing in for a real replica.
+if os.environ.get("STUDIO_READ_REPLICA"):
+    DATABASES["replica"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ["STUDIO_READ_REPLICA"],
+        "CONN_MAX_AGE": DATABASES["default"]["CONN_MAX_AGE"],
+        "CONN_HEALTH_CHECKS": True,
+        "TEST": {"MIRROR": "default"},
     }
+
+DATABASE_ROUTERS = ["studio.db.ReadReplicaRouter"]
+
+# Pragmas applied to every new SQLite connection (see studio.db.configure_connection)
+STUDIO_SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",  # Readers no longer block the writer, and vice versa
+    "synchronous": "NORMAL",  # Safe with WAL, and far fewer fsyncs than FULL
+    "busy_timeout": 5000,  # Milliseconds to wait for a lock before "database is locked"
+    "mmap_size": 268435456,  # Read the database through a 256 MB memory map
+    "cache_size": -20000,  # About 20 MB of page cache per connection
 }
 
 
@@ -118,8 +158,107 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 STATICFILES_DIRS = [BASE_DIR / "static"]  # Add this line for custom static files
+STATIC_ROOT = BASE_DIR / "staticfiles"  # Where "manage.py collectstatic" puts them for serving
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Studio settings
+
+# Number of students shown per page on the index page (overridable with ?page_size=, up to the maximum)
+STUDIO_PAGE_SIZE = 50
+STUDIO_MAX_PAGE_SIZE = 200
+
+# Check-in timetable: how many minutes before and after a scheduled class a check-in still counts
+# for it, how long a class lasts when its schedule gives no end time, and how many seconds the
+# in-memory timetable is trusted before it is rebuilt (saving a DanceClass also rebuilds it)
+STUDIO_CHECKIN_GRACE_BEFORE = 15
+STUDIO_CHECKIN_GRACE_AFTER = 15
+STUDIO_DEFAULT_CLASS_MINUTES = 60
+STUDIO_SCHEDULE_TTL = 300
+
+# Door scanner batch check-in API: the shared token scanners send in the X-Scanner-Token header
+# (unset disables token access), the largest batch accepted, and how far in seconds a scanner's
+# timestamp may be from the server clock
+STUDIO_SCANNER_TOKEN = os.environ.get("STUDIO_SCANNER_TOKEN")
+STUDIO_BATCH_CHECKIN_MAX = 500
+STUDIO_BATCH_CLOCK_SKEW = 24 * 60 * 60
+
+# Performance instrumentation: send a Server-Timing header with SQL and total time on every
+# response, and how many runs of the same SQL statement in one request count as an N+1 loop
+STUDIO_SERVER_TIMING = DEBUG
+STUDIO_N_PLUS_ONE_THRESHOLD = 10
+
+# Write-behind check-in: when enabled, check_in only appends to this journal file and
+# "manage.py drain_checkins" applies the queued check-ins to the database in batches.
+# When it is disabled, a check-in that finds the database locked is refused and the desk asked to retry.
+STUDIO_CHECKIN_WRITE_BEHIND = False
+STUDIO_CHECKIN_JOURNAL = BASE_DIR / "checkin-journal.jsonl"
+
+# Type-ahead search: how many suggestions to return, how many seconds the in-memory index is
+# trusted before it is rebuilt (saving a Student updates it straight away), and the largest
+# roster kept in memory (roughly 30 MB per 50,000 students); beyond that, suggestions come from
+# the database search instead
+STUDIO_AUTOCOMPLETE_LIMIT = 10
+STUDIO_AUTOCOMPLETE_TTL = 300
+STUDIO_AUTOCOMPLETE_MAX_STUDENTS = 50000
+
+# Background exports: where finished export files are kept, how many exports run at once, and
+# after how many seconds without progress an unfinished export is presumed dead and restarted
+STUDIO_EXPORT_DIR = BASE_DIR / "exports"
+STUDIO_EXPORT_WORKERS = 2
+STUDIO_EXPORT_STALE_AFTER = 60 * 60
+
+# Attendance archival: "manage.py archive_attendance" moves attendance older than this many days
+# out of the Attendance table into the archive (history pages and exports still include it)
+STUDIO_ARCHIVE_AFTER_DAYS = 2 * 365
+
+# Admin: above this many rows the changelists stop counting exactly and show an estimate
+STUDIO_ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Async views: serve the index, check-in and attendance history from studio.async_views and
+# enable the live occupancy stream. On by default under ASGI (dance_studio/asgi.py sets the
+# variable); async views need Django 5.1+ for @login_required
+STUDIO_ASYNC_VIEWS = os.environ.get("STUDIO_ASYNC_VIEWS") == "1" and django.VERSION >= (5, 1)
+
+# Live occupancy events: the pub/sub broker desk screens listen through (replace it with one
+# backed by a shared service to run several ASGI workers), how many unread events a screen may
+# fall behind by before the oldest are dropped, and the seconds between keep-alive comments
+STUDIO_EVENT_BACKEND = "studio.events.InProcessBroker"
+STUDIO_EVENT_QUEUE_SIZE = 100
+STUDIO_EVENT_KEEPALIVE = 15
+
+# Fragment cache for the index table's student rows and the export form's class list (see
+# studio.fragments). Entries are keyed by version, so each worker can keep its own: "locmem" (the
+# default) is a bounded LRU cache in process memory, "file" shares one on disk between the workers
+# of a machine, and a redis:// URL shares one between machines (needs the redis package)
+STUDIO_FRAGMENT_CACHE = os.environ.get("STUDIO_FRAGMENT_CACHE", "locmem")
+# Old versions are never asked for again, so entries only need to live long enough to be reused
+FRAGMENT_CACHE = {"TIMEOUT": 24 * 60 * 60}
+if STUDIO_FRAGMENT_CACHE.startswith("redis://"):
+    FRAGMENT_CACHE.update(BACKEND="django.core.cache.backends.redis.RedisCache", LOCATION=STUDIO_FRAGMENT_CACHE)
+else:
+    if STUDIO_FRAGMENT_CACHE == "file":
+        FRAGMENT_CACHE.update(BACKEND="django.core.cache.backends.filebased.FileBasedCache", LOCATION=BASE_DIR / "fragment-cache")
+    else:
+        FRAGMENT_CACHE.update(BACKEND="django.core.cache.backends.locmem.LocMemCache", LOCATION="studio-fragments")
+    # Keep at most this many fragments, culling a tenth of them (least recently used, in memory) when full
+    FRAGMENT_CACHE["OPTIONS"] = {"MAX_ENTRIES": 20000, "CULL_FREQUENCY": 10}
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "fragments": FRAGMENT_CACHE,
+}
+
+# Static file pipeline (see studio.staticfiles): collectstatic writes content-hashed names with
+# gzip and brotli copies (brotli needs the brotli package), and StaticFilesMiddleware serves them
+# from memory with far-future cache headers. Needs "manage.py collectstatic" after every deploy,
+# so it is off unless STUDIO_STATIC_PIPELINE=1 is set
+STUDIO_STATIC_PIPELINE = os.environ.get("STUDIO_STATIC_PIPELINE") == "1"
+if STUDIO_STATIC_PIPELINE:
+    STORAGES = {
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {"BACKEND": "studio.staticfiles.CompressedManifestStaticFilesStorage"},
+    }
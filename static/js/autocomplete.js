@@ -0,0 +1,62 @@
+// Type-ahead suggestions for the student search box on the index page.
+// As the user types, ask the autocomplete endpoint for matching students and list them under
+// the box, each with a link to their attendance and a Check In button.
+(function () {
+    var input = document.querySelector('[data-autocomplete-url]');
+    if (!input) {
+        return;
+    }
+    var list = document.getElementById(input.getAttribute('aria-controls'));
+    var timer = null;
+    var latest = 0;
+
+    function link(href, text, className) {
+        var element = document.createElement('a');
+        element.href = href;
+        element.textContent = text;
+        element.className = className;
+        return element;
+    }
+
+    function show(results) {
+        list.innerHTML = '';
+        results.forEach(function (student) {
+            var item = document.createElement('li');
+            item.className = 'list-group-item d-flex justify-content-between align-items-center';
+            var historyUrl = input.dataset.historyUrl.replace('/0/', '/' + student.id + '/');
+            var checkInUrl = input.dataset.checkInUrl.replace('/0/', '/' + student.id + '/');
+            item.appendChild(link(historyUrl, student.name + ' · ' + student.phone + ' · ' + student.membership_number, 'text-decoration-none'));
+            item.appendChild(link(checkInUrl, 'Check In', 'btn btn-primary btn-sm'));
+            list.appendChild(item);
+        });
+        list.hidden = results.length === 0;
+    }
+
+    function suggest() {
+        var query = input.value.trim();
+        var request = ++latest;
+        if (!query) {
+            show([]);
+            return;
+        }
+        fetch(input.dataset.autocompleteUrl + '?q=' + encodeURIComponent(query), {headers: {'Accept': 'application/json'}})
+            .then(function (response) { return response.ok ? response.json() : {results: []}; })
+            .then(function (data) {
+                // Answers can arrive out of order; only show the one for the latest keystroke
+                if (request === latest) {
+                    show(data.results);
+                }
+            })
+            .catch(function () { show([]); });
+    }
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        timer = setTimeout(suggest, 120);
+    });
+    input.addEventListener('keydown', function (event) {
+        if (event.key === 'Escape') {
+            show([]);
+        }
+    });
+})();
@@ -0,0 +1,41 @@
+// Live class head counts for the desk screens on the index page.
+// Listens to the occupancy event stream and updates the badges as members check in, so the
+// screen never has to reload or poll. The browser reconnects by itself if the stream drops.
+(function () {
+    var container = document.querySelector('[data-events-url]');
+    if (!container || !window.EventSource) {
+        return;
+    }
+    var latest = document.getElementById('latest-check-in');
+    var today = null;
+
+    function badgeFor(classId) {
+        var badge = container.querySelector('[data-class-id="' + classId + '"]');
+        if (!badge) {
+            badge = document.createElement('span');
+            badge.dataset.classId = classId;
+            container.insertBefore(badge, latest);
+        }
+        return badge;
+    }
+
+    var source = new EventSource(container.dataset.eventsUrl);
+    source.addEventListener('snapshot', function (event) {
+        today = JSON.parse(event.data).date;
+    });
+    source.addEventListener('occupancy', function (event) {
+        var data = JSON.parse(event.data);
+        if (data.date !== today) {
+            return;  // A late scanner upload for another day
+        }
+        var badge = badgeFor(data.dance_class_id);
+        badge.className = 'badge ' + (data.checked_in >= data.max_students ? 'bg-danger' : 'bg-secondary');
+        badge.textContent = data.dance_class + ': ' + data.checked_in + '/' + data.max_students;
+    });
+    source.addEventListener('check_in', function (event) {
+        var data = JSON.parse(event.data);
+        if (data.date === today) {
+            latest.textContent = data.student + ' checked in to ' + data.dance_class + ' at ' + data.time.slice(0, 5);
+        }
+    });
+})();
@@ -1,15 +1,216 @@
 # Register your models with the Django admin site
-from django.contrib import admin
-from .models import Student, DanceClass, Attendance
+import datetime
 
-@admin.register(Student) 
-class StudentAdmin(admin.ModelAdmin):
-    list_display = ('name', 'phone', 'membership_number', 'classes_left')
+from django.conf import settings
+from django import forms
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db.models import Max, Min
+from django.http import HttpResponseRedirect
+from django.utils import timezone
+from django.utils.functional import cached_property
 
-@admin.register(DanceClass) 
+from .changes import STUDENTS, student_scope, touch
+from .credits import LedgerContention, append_credit, ledger_heads, with_balance
+from .db import estimated_row_count
+from .models import Student, DanceClass, Attendance, ArchivedAttendance, ClassOccupancy, ExportJob, CreditEntry
+from .search import filter_students
+
+# The attendance tables reach millions of rows, so their changelists are tuned to open in
+# constant time: foreign keys are joined instead of fetched per row, the paginator estimates
+# big counts instead of running COUNT(*) over the whole table, date filtering goes through the
+# date indexes, and student searches go through the full-text index (see studio.search).
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A paginator that counts rows exactly only up to STUDIO_ADMIN_EXACT_COUNT_LIMIT.
+    Past that, an unfiltered list reports the table's estimated size, and a filtered one stops
+    at the limit (narrow the filters to reach rows further in).
+    """
+    @cached_property
+    def count(self):
+        limit = getattr(settings, 'STUDIO_ADMIN_EXACT_COUNT_LIMIT', 10000)
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        # COUNT(*) over a LIMIT subquery stops reading after limit + 1 rows
+        return queryset.order_by()[:limit + 1].count()
+
+
+class RecentDateFilter(admin.SimpleListFilter):
+    """
+    Filter by date range: recent periods, then each year that has rows. The years come from the
+    first and last dates on the date index rather than a DISTINCT over every row, as Django's
+    date_hierarchy would do.
+    """
+    title = 'date'
+    parameter_name = 'period'
+
+    def lookups(self, request, model_admin):
+        choices = [('today', 'Today'), ('7d', 'Past 7 days'), ('month', 'This month'), ('year', 'This year')]
+        # Two separate aggregates, since SQLite only reads MIN or MAX off an index when it is alone in the query
+        queryset = model_admin.get_queryset(request)
+        first, last = queryset.aggregate(value=Min('date'))['value'], queryset.aggregate(value=Max('date'))['value']
+        if first:
+            choices += [(str(year), str(year)) for year in range(last.year, first.year - 1, -1)]
+        return choices
+
+    def queryset(self, request, queryset):
+        today = timezone.localdate()
+        value = self.value()
+        if value == 'today':
+            return queryset.filter(date=today)
+        if value == '7d':
+            return queryset.filter(date__gt=today - datetime.timedelta(days=7))
+        if value == 'month':
+            return queryset.filter(date__gte=today.replace(day=1))
+        if value == 'year':
+            return queryset.filter(date__gte=today.replace(month=1, day=1))
+        if value and value.isdigit():
+            # A plain range on the column can always use the index
+            year = int(value)
+            return queryset.filter(date__gte=datetime.date(year, 1, 1), date__lt=datetime.date(year + 1, 1, 1))
+        return queryset
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables too big to count or scan on every page view."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # Skip the second, unfiltered COUNT(*) on filtered pages
+
+
+class StudentSearchMixin:
+    """Search a model by its student's name, phone or membership number through the full-text index."""
+    search_fields = ('student__name',)
+    search_help_text = "Search by student name, phone or membership number."
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(student__in=filter_students(Student.objects.all(), search_term).values('pk')), False
+
+@admin.register(Student)
+class StudentAdmin(LargeTableAdmin):
+    list_display = ('name', 'phone', 'membership_number', 'balance')
+    search_fields = ('name', 'phone', 'membership_number')  # Also used by the autocomplete widgets
+    search_help_text = "Search by name, phone or membership number."
+    ordering = ('name', 'id')  # Matches the (name, id) index
+    # Classes are bought and adjusted through the credit ledger (see CreditEntryAdmin), never edited here
+    readonly_fields = ('classes_left', 'credits_seq')
+
+    def get_queryset(self, request):
+        return with_balance(super().get_queryset(request))
+
+    @admin.display(description='Classes left')
+    def balance(self, student):
+        return student.balance
+
+    def get_deleted_objects(self, objs, request):
+        # Credit entries can't be deleted on their own, but they go with their student
+        deleted_objects, model_count, perms_needed, protected = super().get_deleted_objects(objs, request)
+        perms_needed.discard(CreditEntry._meta.verbose_name)
+        return deleted_objects, model_count, perms_needed, protected
+
+    def get_search_results(self, request, queryset, search_term):
+        # The full-text index finds substrings without scanning the table (see studio.search)
+        return filter_students(queryset, search_term), False
+
+@admin.register(DanceClass)
 class DanceClassAdmin(admin.ModelAdmin):
     list_display = ('name', 'style', 'level', 'schedule', 'max_students')
+    search_fields = ('name', 'style', 'level')
+    ordering = ('name',)
+
+@admin.register(Attendance)
+class AttendanceAdmin(StudentSearchMixin, LargeTableAdmin):
+    list_display = ('student', 'dance_class', 'date', 'time')
+    list_select_related = ('student', 'dance_class')
+    list_filter = (RecentDateFilter,)
+    ordering = ('-date', '-id')  # Read straight off the date index
+    # Search boxes instead of select boxes holding every student and class
+    autocomplete_fields = ('student', 'dance_class')
+
+@admin.register(ArchivedAttendance)
+class ArchivedAttendanceAdmin(StudentSearchMixin, LargeTableAdmin):
+    list_display = ('student', 'dance_class', 'date', 'time')
+    list_select_related = ('student', 'dance_class')
+    list_filter = (RecentDateFilter,)
+    ordering = ('-date', '-id')
+    autocomplete_fields = ('student', 'dance_class')
+
+@admin.register(ClassOccupancy)
+class ClassOccupancyAdmin(LargeTableAdmin):
+    list_display = ('dance_class', 'date', 'checked_in')
+    list_select_related = ('dance_class',)
+    list_filter = (RecentDateFilter,)
+    autocomplete_fields = ('dance_class',)
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'format', 'status', 'rows_written', 'total_rows', 'requested_by', 'created_at', 'finished_at')
+    list_select_related = ('requested_by',)
+    list_filter = ('status', 'format')
+
+class CreditEntryForm(forms.ModelForm):
+    """A purchase or adjustment added by staff; check-ins and openings are written by the studio itself."""
+    kind = forms.ChoiceField(choices=[
+        (kind, label) for kind, label in CreditEntry.KIND_CHOICES if kind in (CreditEntry.PURCHASE, CreditEntry.ADJUSTMENT)
+    ])
+
+    class Meta:
+        model = CreditEntry
+        fields = ['student', 'kind', 'delta', 'note']
+
+    def clean(self):
+        cleaned_data = super().clean()
+        student, delta = cleaned_data.get('student'), cleaned_data.get('delta')
+        if student and delta is not None:
+            seq, balance = ledger_heads([student.pk])[student.pk]
+            if balance + delta < 0:
+                raise forms.ValidationError(f"{student.name} only has {balance} classes left.")
+        return cleaned_data
+
+@admin.register(CreditEntry)
+class CreditEntryAdmin(StudentSearchMixin, LargeTableAdmin):
+    """The credit ledger is append-only: entries can be added, never changed or deleted."""
+    form = CreditEntryForm
+    list_display = ('student', 'seq', 'kind', 'delta', 'balance', 'dance_class', 'note', 'created_at')
+    list_select_related = ('student', 'dance_class')
+    list_filter = ('kind',)
+    ordering = ('-id',)
+    autocomplete_fields = ('student',)
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        # Deleting a student still removes their entries (see StudentAdmin.get_deleted_objects)
+        return False
+
+    def save_model(self, request, obj, form, change):
+        # Numbered and balanced by the database, the same way as a check-in's entry.
+        # If it is refused, obj keeps no pk and response_add sends staff back to the form
+        try:
+            appended = append_credit(obj.student_id, obj.kind, obj.delta, note=obj.note)
+        except LedgerContention:
+            messages.error(request, f"{obj.student.name}'s classes are being changed at another desk; nothing was recorded. Please try again.")
+            return
+        if not appended:
+            messages.error(request, f"{obj.student.name} no longer has enough classes left; nothing was recorded.")
+            return
+        touch(STUDENTS, student_scope(obj.student_id))
+        entry = CreditEntry.objects.filter(student_id=obj.student_id).order_by('-seq').first()
+        obj.pk, obj.seq, obj.balance, obj.created_at = entry.pk, entry.seq, entry.balance, entry.created_at
+
+    def log_addition(self, request, obj, message):
+        if obj.pk is not None:  # Nothing to log for an entry save_model refused
+            return super().log_addition(request, obj, message)
 
-@admin.register(Attendance) 
-class AttendanceAdmin(admin.ModelAdmin):
-    list_display = ('student', 'dance_class', 'date', 'time')
\ No newline at end of file
+    def response_add(self, request, obj, post_url_continue=None):
+        if obj.pk is None:
+            # Refused by save_model, which said why: back to an empty form rather than "added successfully"
+            return HttpResponseRedirect(request.path)
+        return super().response_add(request, obj, post_url_continue)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class StudioConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "studio"
+
+    def ready(self):
+        # Connect the signal receivers that keep in-memory caches up to date
+        from . import signals  # noqa: F401
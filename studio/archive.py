@@ -0,0 +1,85 @@
+import datetime
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Attendance, ArchivedAttendance
+
+# This module moves old attendance out of the hot Attendance table into ArchivedAttendance.
+# Check-ins, the duplicate check and the admin only ever touch recent rows, so keeping just the
+# recent past in Attendance keeps that table (and its indexes) small enough to stay cached.
+#
+# Rows are moved with raw SQL, so no post_delete signals fire: the rollup tables keep counting
+# archived visits, and the reports and capacity counters are unchanged by archiving.
+# The attendance history and the exports read both tables when the dates asked for reach back
+# past the newest archived row (see needs_archive).
+
+
+def default_cutoff():
+    """The date before which attendance is archived by default (STUDIO_ARCHIVE_AFTER_DAYS ago)."""
+    return timezone.localdate() - datetime.timedelta(days=getattr(settings, 'STUDIO_ARCHIVE_AFTER_DAYS', 730))
+
+
+def latest_cutoff():
+    """
+    The latest cut-off allowed: scanners may send check-ins up to STUDIO_BATCH_CLOCK_SKEW old,
+    and their duplicate check only looks at Attendance, so those days must stay live.
+    """
+    skew = datetime.timedelta(seconds=getattr(settings, 'STUDIO_BATCH_CLOCK_SKEW', 24 * 60 * 60))
+    return timezone.localdate() - skew - datetime.timedelta(days=1)
+
+
+def archive_horizon(using='default'):
+    """The date of the newest archived attendance, or None if nothing has been archived."""
+    return ArchivedAttendance.objects.using(using).aggregate(latest=Max('date'))['latest']
+
+
+def needs_archive(start=None, using='default'):
+    """True if a date range beginning at `start` (None for "from the beginning") includes archived rows."""
+    horizon = archive_horizon(using)
+    return horizon is not None and (start is None or start <= horizon)
+
+
+def attendance_sources(form, using=None):
+    """
+    The attendance querysets an export reads, filtered by a valid AttendanceExportForm, in order:
+    archived attendance first, being the oldest, but only if the date range reaches back to it.
+    They are pinned to one database (the router's choice for reads, unless `using` is given).
+    """
+    using = using or Attendance.objects.all().db
+    sources = [form.filter_queryset(Attendance.objects.using(using))]
+    if needs_archive(form.cleaned_data.get('start'), using=using):
+        sources.insert(0, form.filter_queryset(ArchivedAttendance.objects.using(using)))
+    return sources
+
+
+def archive_attendance(before, batch_size=5000, log=None):
+    """
+    Move attendance dated before `before` into the archive, `batch_size` rows per transaction
+    so check-ins can carry on in between. Returns the number of rows moved.
+    """
+    connection = connections['default']
+    live, archive = Attendance._meta.db_table, ArchivedAttendance._meta.db_table
+    cutoff = connection.ops.adapt_datefield_value(before)
+    moved = 0
+    while True:
+        with transaction.atomic():
+            # The ids of the next batch form a contiguous run among the rows being archived,
+            # so the batch can be addressed by its first and last id
+            ids = list(Attendance.objects.filter(date__lt=before).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {archive} (id, student_id, dance_class_id, date, time) "
+                    f"SELECT id, student_id, dance_class_id, date, time FROM {live} "
+                    f"WHERE date < %s AND id BETWEEN %s AND %s",
+                    [cutoff, ids[0], ids[-1]],
+                )
+                cursor.execute(f"DELETE FROM {live} WHERE date < %s AND id BETWEEN %s AND %s", [cutoff, ids[0], ids[-1]])
+        moved += len(ids)
+        if log:
+            log(f"Archived {moved} attendance records")
+    return moved
@@ -0,0 +1,108 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, render
+from django.utils import timezone
+
+from .changes import STUDENTS, CLASSES, conditional_on_changes, student_scope
+from .credits import with_balance
+from .db import read_only_view
+from .events import OCCUPANCY, get_broker, occupancy_event
+from .models import Student
+from .pagination import akeyset_paginate
+from .search import filter_students
+from .views import (
+    HISTORY_ORDERING, check_in_response, history_context, history_sources, history_summary_queries,
+    index_context, today_occupancy,
+)
+
+# Async versions of the busiest views, used instead of the ones in studio.views when
+# STUDIO_ASYNC_VIEWS is on (see studio.urls), plus the live event stream for desk screens.
+# Under an ASGI server they wait on the database without holding a request thread, so one worker
+# can keep hundreds of desk screens connected.
+#
+# Reads go through the async ORM. Writes and template rendering are synchronous in Django, so the
+# check-in (a transaction, see studio.checkin) and render() run on a worker thread via sync_to_async.
+
+
+def render_async(request, template_name, context):
+    """render() on a worker thread: the templates read request.user and the session, which are synchronous."""
+    return sync_to_async(render)(request, template_name, context)
+
+
+@read_only_view
+@conditional_on_changes(lambda request: [STUDENTS, CLASSES])
+async def index(request):
+    """Display the index page with a list of students and a search query."""
+    query = request.GET.get('query', '')
+    # filter_students() looks up once whether the database has the full-text index, synchronously
+    students = await sync_to_async(filter_students)(with_balance(Student.objects.all()), query)
+    page = await akeyset_paginate(students, ['name', 'id'], request)
+    occupancy = [entry async for entry in today_occupancy()]
+    # The context reads the fragment cache and builds the export form, both synchronous
+    context = await sync_to_async(index_context)(request, query, page, occupancy)
+    return await render_async(request, 'index.html', context)
+
+
+@login_required
+async def check_in(request, student_id):
+    """Check in a student, decrement their classes left, and log attendance."""
+    return await sync_to_async(check_in_response)(request, student_id)
+
+
+@login_required
+@read_only_view
+@conditional_on_changes(lambda request, student_id: [student_scope(student_id), CLASSES])
+async def student_attendance_history(request, student_id):
+    """Display the attendance history for a specific student."""
+    student = await aget_object_or_404(Student, id=student_id)
+    page = await akeyset_paginate(history_sources(student), HISTORY_ORDERING, request)
+    summary_rows = [row for queryset in history_summary_queries(student) async for row in queryset]
+    return await render_async(request, 'student_attendance_history.html', history_context(request, student, page, summary_rows))
+
+
+def _event(event_type, data):
+    """One server-sent event."""
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+@login_required
+async def occupancy_events(request):
+    """
+    Stream check-ins and today's class head counts to a desk screen as server-sent events:
+    the current head counts first, then each 'check_in' and 'occupancy' event as it happens.
+    """
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI the stream would hold a request thread for as long as the screen stays open
+        return HttpResponse("Live updates need the studio to run under an ASGI server.", status=501)
+
+    keepalive = getattr(settings, 'STUDIO_EVENT_KEEPALIVE', 15)
+
+    async def stream():
+        # Subscribe before reading the head counts, so no check-in falls between the two
+        subscription = get_broker().subscribe()
+        try:
+            snapshot = [occupancy_event(entry) async for entry in today_occupancy()]
+            # A screen stays connected for hours, so don't keep a database connection open for it
+            await sync_to_async(connections.close_all)()
+            # Reconnect after 5 seconds if the connection drops
+            yield f"retry: 5000\nevent: snapshot\ndata: {json.dumps({'date': timezone.localdate().isoformat()})}\n\n"
+            for data in snapshot:
+                yield _event(OCCUPANCY, data)
+            while True:
+                event = await subscription.get(timeout=keepalive)
+                # A comment line now and then stops proxies from closing an idle connection
+                yield _event(event['type'], event) if event else ": keepalive\n\n"
+        finally:
+            # Runs when the screen disconnects, as the server cancels the stream
+            subscription.close()
+
+    return StreamingHttpResponse(stream(), content_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Tell nginx not to buffer the stream
+    })
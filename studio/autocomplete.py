@@ -0,0 +1,193 @@
+import array
+import bisect
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import Student
+
+# This module keeps an in-memory prefix index of the students for the type-ahead search box,
+# so suggestions come back without a database query while the front desk is typing.
+#
+# The index is a sorted list of terms with the matching student ids alongside. Each student is filed under their
+# full name, every later word of their name (so "kim" finds "Ava Kim"), the digits of their
+# phone number and their membership number. A lookup is a binary search to the first term
+# starting with the prefix, then a short walk along the list.
+#
+# The index is built lazily on the first lookup and updated in place when a Student is saved or
+# deleted in this process (see studio.signals). Bulk imports and other processes don't send us
+# signals, so the index is also rebuilt after STUDIO_AUTOCOMPLETE_TTL seconds. Builds always read
+# the primary database, never a replica that may lag behind, and changes signalled while a build
+# is reading are replayed onto the new index before it is used. To bound memory,
+# no index is kept if there are more than STUDIO_AUTOCOMPLETE_MAX_STUDENTS students; lookups
+# then go to the database search instead.
+
+DEFAULT_LIMIT = 10
+
+
+def normalize(text):
+    """Lower-case and collapse spaces, so 'Ava  KIM' and 'ava kim' file under the same term."""
+    return ' '.join(text.lower().split())
+
+
+def digits(text):
+    return re.sub(r'\D', '', text)
+
+
+def terms_for(name, phone, membership_number):
+    """Every term a student can be found by."""
+    words = normalize(name).split(' ')
+    terms = {' '.join(words[start:]) for start in range(len(words))}
+    terms.add(digits(phone) or normalize(phone))
+    terms.add(normalize(membership_number))
+    terms.discard('')
+    return terms
+
+
+def query_terms(query):
+    """The prefixes to look up for what the user typed: as typed, and as bare digits for phones."""
+    prefixes = [normalize(query)]
+    if re.fullmatch(r'[\d\s()+.-]+', query) and digits(query) not in prefixes:
+        prefixes.append(digits(query))
+    return [prefix for prefix in prefixes if prefix]
+
+
+class PrefixIndex:
+    """Sorted terms over the students' names, phones and membership numbers, with the id filed under each."""
+    def __init__(self, students=()):
+        # `students` is an iterable of (id, name, phone, membership_number) tuples
+        self._students = {}
+        entries = []
+        for pk, name, phone, membership_number in students:
+            self._students[pk] = (name, phone, membership_number)
+            entries.extend((term, pk) for term in terms_for(name, phone, membership_number))
+        entries.sort()
+        # Two parallel arrays take far less memory than a list of (term, id) tuples
+        self._terms = [term for term, pk in entries]
+        self._ids = array.array('q', (pk for term, pk in entries))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._students)
+
+    def add(self, pk, name, phone, membership_number):
+        """File a new student, or re-file one whose details changed."""
+        with self._lock:
+            self._remove(pk)
+            self._students[pk] = (name, phone, membership_number)
+            for term in terms_for(name, phone, membership_number):
+                position = bisect.bisect_right(self._terms, term)
+                self._terms.insert(position, term)
+                self._ids.insert(position, pk)
+
+    def remove(self, pk):
+        with self._lock:
+            self._remove(pk)
+
+    def _remove(self, pk):
+        details = self._students.pop(pk, None)
+        if details is None:
+            return
+        for term in terms_for(*details):
+            position = bisect.bisect_left(self._terms, term)
+            while position < len(self._terms) and self._terms[position] == term:
+                if self._ids[position] == pk:
+                    del self._terms[position]
+                    del self._ids[position]
+                    break
+                position += 1
+
+    def lookup(self, query, limit=DEFAULT_LIMIT):
+        """Return up to `limit` (id, name, phone, membership_number) tuples with a term starting with `query`."""
+        found = {}
+        with self._lock:
+            for prefix in query_terms(query):
+                position = bisect.bisect_left(self._terms, prefix)
+                while len(found) < limit and position < len(self._terms) and self._terms[position].startswith(prefix):
+                    pk = self._ids[position]
+                    found.setdefault(pk, self._students[pk])
+                    position += 1
+        return [(pk,) + details for pk, details in found.items()]
+
+
+# The index for this process; None means "not built yet" or "too many students to keep one"
+_index = None
+_built_at = None
+_lock = threading.Lock()
+# Changes signalled while an index is being built, or None when no build is running. Guarded by
+# _changes_lock, which is also held whenever _index is swapped, so no change falls in between
+_pending = None
+_changes_lock = threading.Lock()
+
+
+def _build_index():
+    """Load every student into a new PrefixIndex, or return None if there are too many of them."""
+    maximum = getattr(settings, 'STUDIO_AUTOCOMPLETE_MAX_STUDENTS', 50000)
+    # The signals keep the index current from here on, so it has to start from the primary
+    students = Student.objects.using(DEFAULT_DB_ALIAS)
+    if students.count() > maximum:
+        return None
+    return PrefixIndex(students.values_list('pk', 'name', 'phone', 'membership_number').iterator(chunk_size=5000))
+
+
+def get_autocomplete_index():
+    """
+    Return the cached PrefixIndex, building it if needed, or None if the roster is too big
+    to keep in memory (the caller should search the database instead).
+    """
+    global _index, _built_at, _pending
+    ttl = getattr(settings, 'STUDIO_AUTOCOMPLETE_TTL', 300)
+    if _built_at is not None and time.monotonic() - _built_at < ttl:
+        return _index
+    with _lock:
+        if _built_at is None or time.monotonic() - _built_at >= ttl:
+            with _changes_lock:
+                _pending = []
+            index = None
+            try:
+                index = _build_index()
+            finally:
+                with _changes_lock:
+                    # The build's read may have missed these, so apply them before anyone sees the index
+                    for change in _pending if index is not None else ():
+                        _apply(index, change)
+                    _pending = None
+                    _index = index
+            _built_at = time.monotonic()
+        return _index
+
+
+def _apply(index, change):
+    if change[0] == 'add':
+        index.add(*change[1:])
+    else:
+        index.remove(change[1])
+
+
+def _record(change):
+    """Apply a change to the index, if it has been built, and keep it for a build under way."""
+    with _changes_lock:
+        if _pending is not None:
+            _pending.append(change)
+        if _index is not None:
+            _apply(_index, change)
+
+
+def student_changed(student):
+    """Re-file a saved student."""
+    _record(('add', student.pk, student.name, student.phone, student.membership_number))
+
+
+def student_removed(pk):
+    """Drop a deleted student."""
+    _record(('remove', pk))
+
+
+def invalidate_autocomplete_index():
+    """Throw away the index so the next lookup rebuilds it."""
+    global _index, _built_at
+    with _lock:
+        _index, _built_at = None, None
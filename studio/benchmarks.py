@@ -0,0 +1,232 @@
+import datetime
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.test import Client
+from django.urls import reverse
+
+from .changes import STUDENTS, CLASSES, touch
+from .checkin import insert_attendance_sql, attendance_params
+from .middleware import QueryRecorder
+from .models import Student, DanceClass, Attendance
+from .rollups import rebuild_rollups
+
+# This module seeds realistic data sets and times the studio views against them.
+# It is used by the seed_studio and benchmark_studio management commands: results are written
+# as JSON so two runs can be compared, and a run can be checked against a stored baseline.
+
+FIRST_NAMES = ['Ava', 'Ben', 'Chloe', 'Daniel', 'Emma', 'Felix', 'Grace', 'Hana', 'Ivan', 'Jia',
+               'Kai', 'Lena', 'Min', 'Noah', 'Olivia', 'Priya', 'Quinn', 'Ravi', 'Sofia', 'Theo']
+LAST_NAMES = ['Kim', 'Lee', 'Park', 'Chen', 'Wang', 'Smith', 'Garcia', 'Nguyen', 'Patel', 'Brown',
+              'Jones', 'Silva', 'Rossi', 'Muller', 'Tanaka', 'Cohen', 'Novak', 'Haddad', 'Khan', 'Moreau']
+DAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+# Seeded attendance ends on this day rather than today, so the same seed gives the same data set
+# whenever it runs
+SEED_END_DATE = datetime.date(2025, 6, 30)
+
+SCENARIOS = ['index', 'index_search', 'check_in', 'student_attendance_history', 'export_attendance_csv']
+
+
+def seed(students=1000, classes=20, years=1, visits_per_week=2, seed=0, end=None, log=None):
+    """
+    Fill the database with `students` members, `classes` classes and `years` of attendance up to
+    `end` (SEED_END_DATE by default), with each student coming `visits_per_week` times a week on
+    average. Returns row counts.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+
+    styles = [style for style, label in DanceClass.STYLE_CHOICES]
+    levels = [level for level, label in DanceClass.LEVEL_CHOICES if level != 'Unknown']
+    new_classes = []
+    for number in range(classes):
+        style, level = styles[number % len(styles)], levels[number // len(styles) % len(levels)]
+        new_classes.append(DanceClass(
+            name=f"{level} {style} {number + 1}", style=style, level=level,
+            schedule=f"{DAYS[number % 7]} {17 + number % 4}:00-{18 + number % 4}:00",
+            max_students=rng.choice([20, 30, 40]),
+        ))
+    DanceClass.objects.bulk_create(new_classes)
+    class_ids = list(DanceClass.objects.values_list('pk', flat=True))
+    log(f"Created {classes} classes")
+
+    offset = Student.objects.count()
+    for start in range(0, students, 5000):
+        Student.objects.bulk_create([
+            Student(
+                name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {offset + number}",
+                phone=f"555{offset + number:08d}",
+                membership_number=f"B{offset + number:07d}",
+                classes_left=rng.choice([0, 5, 30, 50, 100]),
+            )
+            for number in range(start, min(start + 5000, students))
+        ])
+    student_ids = list(Student.objects.values_list('pk', flat=True))
+    log(f"Created {students} students")
+
+    # Attendance goes in with raw inserts so each row keeps its historical date and time
+    connection = connections['default']
+    end = end or SEED_END_DATE
+    days = 365 * years
+    visits = int(len(student_ids) * visits_per_week * days / 7)
+    inserted = 0
+    while inserted < visits:
+        rows = []
+        for _ in range(min(5000, visits - inserted)):
+            when = datetime.datetime.combine(
+                end - datetime.timedelta(days=rng.randrange(days)),
+                datetime.time(rng.randrange(17, 21), rng.randrange(60), rng.randrange(60)),
+            )
+            rows.append(attendance_params(connection, rng.choice(student_ids), rng.choice(class_ids), when))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(insert_attendance_sql(), rows)
+        inserted += len(rows)
+    log(f"Created {Attendance.objects.count()} attendance records")
+
+    rebuild_rollups(months_per_batch=12)
+    log("Rebuilt rollups")
+    # bulk_create and raw inserts send no signals, so mark the pages and cached fragments as changed here
+    touch(STUDENTS, CLASSES)
+    return {
+        'students': Student.objects.count(),
+        'classes': DanceClass.objects.count(),
+        'attendance': Attendance.objects.count(),
+    }
+
+
+def _staff_client(user):
+    client = Client()
+    client.force_login(user)
+    return client
+
+
+def _timed_request(client, url):
+    """Fetch `url` (reading any streamed body) and return (seconds, queries)."""
+    recorder = QueryRecorder()
+    with connections['default'].execute_wrapper(recorder):
+        started = time.perf_counter()
+        response = client.get(url)
+        if response.streaming:
+            for chunk in response.streaming_content:
+                pass
+        elapsed = time.perf_counter() - started
+    if response.status_code >= 400:
+        raise RuntimeError(f"GET {url} returned {response.status_code}")
+    return elapsed, recorder.count
+
+
+def _scenario_urls(name, iterations, rng):
+    """The URLs one scenario requests, one per iteration, picked by `rng` so a seed always picks the same ones."""
+    students = list(Student.objects.order_by('pk').values_list('pk', 'name'))
+    student_ids = [pk for pk, student_name in rng.sample(students, min(iterations, len(students)))]
+    if name == 'index':
+        return [reverse('index')] * iterations
+    if name == 'index_search':
+        names = [student_name.split()[0] for pk, student_name in students]
+        return [f"{reverse('index')}?query={rng.choice(names)}" for _ in range(iterations)] if names else []
+    if name == 'check_in':
+        return [reverse('check_in', args=[pk]) for pk in student_ids]
+    if name == 'student_attendance_history':
+        return [reverse('student_attendance_history', args=[pk]) for pk in student_ids]
+    if name == 'export_attendance_csv':
+        return [reverse('export_attendance_csv')] * iterations
+    raise ValueError(f"Unknown scenario {name!r}")
+
+
+def run_scenario(name, user, iterations=20, concurrency=1, seed=0):
+    """
+    Request one scenario's URLs `iterations` times, from `concurrency` clients at once for the
+    check-in scenario, and return latency percentiles, queries per request and peak memory.
+    """
+    rng = random.Random(seed)
+    urls = _scenario_urls(name, iterations, rng)
+    if not urls:
+        return None
+    workers = concurrency if name == 'check_in' else 1
+
+    def worker(chunk):
+        client = _staff_client(user)
+        try:
+            return [_timed_request(client, url) for url in chunk]
+        finally:
+            if workers > 1:
+                connections.close_all()
+
+    # One extra request under tracemalloc measures peak memory without slowing the timed runs
+    tracemalloc.start()
+    try:
+        _timed_request(_staff_client(user), urls[0])
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    started = time.perf_counter()
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            samples = [sample for chunk in pool.map(worker, [urls[i::workers] for i in range(workers)]) for sample in chunk]
+    else:
+        samples = worker(urls)
+    wall = time.perf_counter() - started
+
+    latencies = sorted(seconds * 1000 for seconds, queries in samples)
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'iterations': len(samples),
+        'concurrency': workers,
+        'p50_ms': round(cuts[49], 3),
+        'p90_ms': round(cuts[89], 3),
+        'p99_ms': round(cuts[98], 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'requests_per_second': round(len(samples) / wall, 1) if wall else None,
+        'queries_per_request': round(statistics.fmean(queries for seconds, queries in samples), 2),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(scenarios=SCENARIOS, iterations=20, concurrency=8, seed=0, log=None):
+    """Run the given scenarios and return a results dict ready to be saved as JSON."""
+    log = log or (lambda message: None)
+    user, created = User.objects.get_or_create(username='benchmark', defaults={'is_staff': True})
+    results = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'dataset': {
+            'students': Student.objects.count(),
+            'classes': DanceClass.objects.count(),
+            'attendance': Attendance.objects.count(),
+        },
+        'scenarios': {},
+    }
+    for name in scenarios:
+        results['scenarios'][name] = run_scenario(name, user, iterations, concurrency, seed)
+        log(f"{name}: {results['scenarios'][name]}")
+    return results
+
+
+def compare(results, baseline, threshold=0.2, metric='p50_ms'):
+    """
+    Compare two results dicts and return a list of (scenario, baseline_value, new_value) for every
+    scenario whose `metric` got worse by more than `threshold` (0.2 means 20%).
+    """
+    regressions = []
+    for name, stats in results['scenarios'].items():
+        before = (baseline.get('scenarios', {}).get(name) or {}).get(metric)
+        if stats and before and stats[metric] > before * (1 + threshold):
+            regressions.append((name, before, stats[metric]))
+    return regressions
+
+
+def save_results(results, path):
+    with open(path, 'w', encoding='utf-8') as handle:
+        json.dump(results, handle, indent=2)
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as handle:
+        return json.load(handle)
@@ -0,0 +1,103 @@
+import functools
+import hashlib
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib import messages
+from django.db import connections, router
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from .models import ChangeMarker
+
+# This module keeps change markers: small rows recording when something the pages show last
+# changed, so a view can tell a kiosk "nothing new" (304 Not Modified) from one indexed lookup
+# instead of re-running its queries and re-rendering its template.
+#
+# Scopes:
+#   - STUDENTS: any student or attendance row, added, changed or removed,
+#   - CLASSES: any dance class, since class names appear on the pages,
+#   - student_scope(pk): one student's details and attendance.
+# Writes through the ORM touch the markers from signal receivers (see studio.signals); the
+# check-in engine and the bulk import, which bypass signals, touch them in their own transactions.
+
+STUDENTS = 'students'
+CLASSES = 'classes'
+
+
+def student_scope(pk):
+    return f'student:{pk}'
+
+
+def touch_sql():
+    """SQL that bumps one marker's version. Parameters: scope, modified."""
+    table = ChangeMarker._meta.db_table
+    return (
+        f"INSERT INTO {table} (scope, version, modified) VALUES (%s, 1, %s) "
+        f"ON CONFLICT (scope) DO UPDATE SET version = {table}.version + 1, modified = excluded.modified"
+    )
+
+
+def touch(*scopes, using=None):
+    """Record that the given scopes changed just now (inside the caller's transaction, if any)."""
+    using = using or router.db_for_write(ChangeMarker)
+    connection = connections[using]
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.executemany(touch_sql(), [(scope, now) for scope in dict.fromkeys(scopes)])
+
+
+def _markers(request, scopes):
+    """Fetch the markers for `scopes` in one query, once per request."""
+    cached = getattr(request, '_change_markers', None)
+    if cached is None or cached[0] != scopes:
+        rows = ChangeMarker.objects.filter(scope__in=scopes).values_list('scope', 'version', 'modified')
+        cached = request._change_markers = (scopes, {scope: (version, modified) for scope, version, modified in rows})
+    return cached[1]
+
+
+def conditional_on_changes(scopes_for):
+    """
+    Decorate a view so a repeat GET gets a 304 while none of its change markers have moved.
+    `scopes_for(request, *args, **kwargs)` returns the scopes the page depends on.
+    The ETag also covers who is looking, the day (pages show today's numbers) and the CSRF
+    secret that forms on the page were rendered with. Responses are marked private and must
+    be revalidated, so browsers ask every time and a shared cache never serves them.
+    """
+    def validators(request, *args, **kwargs):
+        """The (ETag, Last-Modified) pair for the request, worked out once."""
+        cached = getattr(request, '_change_validators', None)
+        if cached is not None:
+            return cached
+        # A pending flash message must be shown, so never answer 304 while one is waiting
+        if len(messages.get_messages(request)):
+            cached = (None, None)
+        else:
+            scopes = scopes_for(request, *args, **kwargs)
+            markers = _markers(request, scopes)
+            parts = [f'{scope}={markers.get(scope, (0, None))[0]}' for scope in scopes]
+            parts += [f'user={request.user.pk}', f'day={timezone.localdate()}', request.META.get('CSRF_COOKIE') or '']
+            modified = [modified for version, modified in markers.values()]
+            cached = (hashlib.sha1('|'.join(parts).encode()).hexdigest(), max(modified) if modified else None)
+        request._change_validators = cached
+        return cached
+
+    def etag(request, *args, **kwargs):
+        return validators(request, *args, **kwargs)[0]
+
+    def last_modified(request, *args, **kwargs):
+        return validators(request, *args, **kwargs)[1]
+
+    def decorator(view):
+        conditional = cache_control(private=True, no_cache=True)(condition(etag_func=etag, last_modified_func=last_modified)(view))
+        if not iscoroutinefunction(view):
+            return conditional
+
+        @functools.wraps(view)
+        async def async_view(request, *args, **kwargs):
+            # condition() asks for the validators without awaiting, and they read the session, the user
+            # and the markers, so work them out on a worker thread first
+            await sync_to_async(validators)(request, *args, **kwargs)
+            return await conditional(request, *args, **kwargs)
+        return async_view
+    return decorator
@@ -0,0 +1,313 @@
+from django.db import OperationalError, connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .changes import STUDENTS, student_scope, touch
+from .db import is_busy
+from .credits import LedgerContention, append_credit, entry_params, head, insert_entry_sql, with_ledger_head
+from .events import publish_on_commit
+from .models import Student, DanceClass, Attendance, ClassOccupancy, CreditEntry
+from .rollups import month_start, monthly_upsert_sql, monthly_params
+from .schedule import get_schedule_index
+
+# This module is the check-in engine used by the check_in view.
+# A check-in is four statements inside one short transaction:
+#   1. a guarded INSERT that appends a -1 entry to the student's credit ledger only if they have a
+#      class left (see studio.credits; the Student row itself is never updated),
+#   2. an INSERT ... ON CONFLICT DO NOTHING on the (student, dance_class, date) unique constraint, and
+#   3. an upsert that bumps the class's occupancy counter for the day only while it is below max_students, and
+#   4. an upsert that bumps the student's monthly visit count for reporting (see studio.rollups).
+# If the insert turns out to be a duplicate, or the class is full, the transaction is rolled back so the
+# class is not spent, which makes checking in twice for the same class on the same day a harmless no-op.
+
+# Result codes returned by check_in_student()
+CHECKED_IN = 'ok'
+DUPLICATE = 'duplicate'
+NO_CLASSES_LEFT = 'no_classes_left'
+UNKNOWN_MEMBER = 'unknown_member'
+CLASS_FULL = 'class_full'
+INVALID = 'invalid'
+
+
+
+class CheckInBusy(Exception):
+    """Other writers kept the database locked past its busy timeout, or kept appending to the student's ledger; the check-in did not happen."""
+
+
+RESULT_MESSAGES = {
+    CHECKED_IN: "Checked in.",
+    DUPLICATE: "Already checked in to this class today.",
+    NO_CLASSES_LEFT: "No classes left.",
+    UNKNOWN_MEMBER: "Unknown member.",
+    CLASS_FULL: "This class is full.",
+    INVALID: "Invalid check-in.",
+}
+
+
+def legacy_style_and_level(now):
+    """The original weekday/hour rules, used for check-ins that don't fall in any scheduled slot."""
+    current_hour = now.hour
+    current_weekday = now.strftime('%A')  # Get the current weekday
+
+    # Try to find a scheduled class for this time/weekday
+    weekday_map = {
+        'Monday': 'Jazz',
+        'Wednesday': 'Jazz',
+        'Friday': 'Jazz',
+        'Tuesday': 'Kpop',
+        'Thursday': 'Kpop'}
+    style = weekday_map.get(current_weekday)  # Default style based on weekday using a dictionary
+    if not style: # If not found, determine style based on hour
+        if current_hour == 17:
+            style = 'Hip-hop'
+        elif current_hour == 18:
+            style = 'House'
+        else:
+            style = 'Urban'
+
+    if current_hour == 17:
+        level = 'Basic'
+    elif current_hour == 18:
+        level = 'Intermediate'
+    elif current_hour == 19:
+        level = 'Advanced'
+    else:
+        level = 'Unknown'
+    return style, level
+
+
+def resolve_dance_class(now):
+    """
+    Work out which class is running at `now`.
+    The in-memory timetable answers without touching the database; only when no class of the
+    right style and level exists at all do we create one.
+    """
+    index = get_schedule_index()
+    dance_class = index.resolve(now)
+    if dance_class:
+        return dance_class
+
+    # Not in any scheduled slot: fall back to the weekday/hour rules
+    style, level = legacy_style_and_level(now)
+    dance_class = index.first_by_style_level(style, level)
+    if not dance_class:
+        # Fallback: create (or get) by class name, along with style and level
+        class_name = f"{level} - {style}"
+
+        dance_class, created = DanceClass.objects.get_or_create(
+            name=class_name,
+            defaults={
+                "style": style,
+                "level": level,
+                "description": f"{level} {style} class",
+                "schedule": f"{now.strftime('%A')} {now.hour}:00",
+                "max_students": 20,
+            }
+        )
+    return dance_class
+
+
+def insert_attendance_sql():
+    """SQL that logs one attendance row, doing nothing if the student already attended that class that day."""
+    table = Attendance._meta.db_table
+    return (
+        f"INSERT INTO {table} (student_id, dance_class_id, date, time) VALUES (%s, %s, %s, %s) "
+        f"ON CONFLICT (student_id, dance_class_id, date) DO NOTHING"
+    )
+
+
+def attendance_params(connection, student_id, dance_class_id, when):
+    """Parameters for insert_attendance_sql(), adapted to the database's date and time formats."""
+    return [
+        student_id,
+        dance_class_id,
+        connection.ops.adapt_datefield_value(when.date()),
+        connection.ops.adapt_timefield_value(when.time()),
+    ]
+
+
+def occupancy_upsert_sql():
+    """
+    SQL that adds %s check-ins to a class's counter for a day, as long as the total stays within
+    %s (the class's max_students). Affects no rows if the class would go over capacity.
+    Parameters: dance_class_id, date, count, count, max_students, max_students.
+    """
+    table = ClassOccupancy._meta.db_table
+    return (
+        f"INSERT INTO {table} (dance_class_id, date, checked_in) SELECT %s, %s, %s WHERE %s <= %s "
+        f"ON CONFLICT (dance_class_id, date) DO UPDATE SET checked_in = {table}.checked_in + excluded.checked_in "
+        f"WHERE {table}.checked_in + excluded.checked_in <= %s"
+    )
+
+
+def occupancy_params(connection, dance_class, date, count=1):
+    """Parameters for occupancy_upsert_sql()."""
+    date = connection.ops.adapt_datefield_value(date)
+    return [dance_class.pk, date, count, count, dance_class.max_students, dance_class.max_students]
+
+
+def check_in_student(student_id, dance_class, now=None):
+    """
+    Check a student in to `dance_class`, spending one of their classes.
+    Returns one of CHECKED_IN, DUPLICATE, NO_CLASSES_LEFT, CLASS_FULL or UNKNOWN_MEMBER.
+    Raises CheckInBusy if other writers kept the database, or this student's ledger, busy.
+    """
+    now = now or timezone.localtime()
+    try:
+        return _check_in_student(student_id, dance_class, now, router.db_for_write(Attendance))
+    except OperationalError as error:
+        if is_busy(error):
+            raise CheckInBusy(str(error)) from error
+        raise
+    except LedgerContention as error:
+        raise CheckInBusy(str(error)) from error
+
+
+def _check_in_student(student_id, dance_class, now, using):
+    """The work of check_in_student(), in one transaction on `using`."""
+    with transaction.atomic(using=using):
+        # Spend a class only if there is one left; the database does the check and the append together
+        spent = append_credit(student_id, CreditEntry.CHECK_IN, -1, dance_class_id=dance_class.pk, using=using)
+        if not spent:
+            exists = Student.objects.using(using).filter(pk=student_id).exists()
+            return NO_CLASSES_LEFT if exists else UNKNOWN_MEMBER
+
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            cursor.execute(insert_attendance_sql(), attendance_params(connection, student_id, dance_class.pk, now))
+            inserted = cursor.rowcount
+            if not inserted:
+                # Already checked in to this class today: take the ledger entry back
+                transaction.set_rollback(True, using=using)
+                return DUPLICATE
+
+            # Count the student in, unless the class is already at max_students
+            cursor.execute(occupancy_upsert_sql(), occupancy_params(connection, dance_class, now.date()))
+            if not cursor.rowcount:
+                transaction.set_rollback(True, using=using)
+                return CLASS_FULL
+
+            cursor.execute(monthly_upsert_sql(), monthly_params(connection, student_id, now.date()))
+        # Pages showing this student or the attendance totals are out of date now
+        touch(STUDENTS, student_scope(student_id), using=using)
+        # Desk screens hear about the check-in once it has committed (see studio.events)
+        publish_on_commit([(student_id, dance_class.pk, now)], using=using)
+
+    return CHECKED_IN
+
+
+def check_in_batch(items):
+    """
+    Check in many students at once, e.g. a burst of door-scanner reads.
+    Each item is a dict with a 'student_id' or a 'membership_number', and a 'when' datetime.
+    Returns one result dict per item, in order, with a 'status' of CHECKED_IN, DUPLICATE,
+    NO_CLASSES_LEFT, CLASS_FULL, UNKNOWN_MEMBER or INVALID.
+
+    The whole batch is one transaction of eight statements, however many items it has: queries for
+    the students (with their credit balances), the attendance already logged and the classes'
+    occupancy, multi-row upserts for attendance, occupancy, monthly visits and change markers, and
+    one multi-row INSERT that appends every class spent to the credit ledger.
+    """
+    results = [{'status': INVALID} for item in items]
+    ids = {item['student_id'] for item in items if item.get('student_id') is not None}
+    numbers = {item['membership_number'] for item in items if item.get('membership_number')}
+    if not ids and not numbers:
+        return results
+
+    # Work out each item's class from the in-memory timetable before taking any locks
+    classes = [resolve_dance_class(item['when']) for item in items]
+    classes_by_id = {dance_class.pk: dance_class for dance_class in classes}
+    using = router.db_for_write(Attendance)
+    connection = connections[using]
+
+    with transaction.atomic(using=using):
+        students = list(
+            with_ledger_head(Student.objects.using(using).filter(Q(pk__in=ids) | Q(membership_number__in=numbers)))
+            .values_list('pk', 'membership_number', 'credits_seq', 'classes_left', 'head_seq', 'head_balance')
+        )
+        by_id = {pk: pk for pk, number, *ledger in students}  # Drops ids that don't exist
+        by_number = {number: pk for pk, number, *ledger in students}
+        # No row locks: if another desk appends to one of these ledgers meanwhile, the entries
+        # numbered from here conflict and the batch starts again (see below)
+        heads = {pk: head(*ledger) for pk, number, *ledger in students}
+        remaining = {pk: balance for pk, (seq, balance) in heads.items()}
+
+        # Attendance already logged for these students on these days, to spot duplicates up front
+        already_logged = set(
+            Attendance.objects.using(using)
+            .filter(student_id__in=remaining, date__in={item['when'].date() for item in items})
+            .values_list('student_id', 'dance_class_id', 'date')
+        )
+        occupancy = {
+            (class_id, date): checked_in for class_id, date, checked_in in
+            ClassOccupancy.objects.using(using)
+            .filter(dance_class_id__in=classes_by_id, date__in={item['when'].date() for item in items})
+            .values_list('dance_class_id', 'date', 'checked_in')
+        }
+
+        rows, debits, checked_in, spent, joined, visits = [], [], [], {}, {}, {}
+        for item, dance_class, result in zip(items, classes, results):
+            student_id = by_id.get(item.get('student_id')) or by_number.get(item.get('membership_number'))
+            if student_id is None:
+                result['status'] = UNKNOWN_MEMBER
+                continue
+            result.update(student_id=student_id, dance_class_id=dance_class.pk)
+            key = (student_id, dance_class.pk, item['when'].date())
+            # Checked in the same order as check_in_student(), so both paths give the same answer
+            if remaining[student_id] <= 0:
+                result['status'] = NO_CLASSES_LEFT
+            elif key in already_logged:
+                result['status'] = DUPLICATE
+            elif occupancy.get(key[1:], 0) >= dance_class.max_students:
+                result['status'] = CLASS_FULL
+            else:
+                result['status'] = CHECKED_IN
+                already_logged.add(key)
+                remaining[student_id] -= 1
+                spent[student_id] = spent.get(student_id, 0) + 1
+                debits.append(entry_params(
+                    connection, student_id, heads[student_id][0] + spent[student_id], CreditEntry.CHECK_IN, -1,
+                    remaining[student_id], dance_class.pk,
+                ))
+                occupancy[key[1:]] = occupancy.get(key[1:], 0) + 1
+                joined[key[1:]] = joined.get(key[1:], 0) + 1
+                month = (student_id, month_start(item['when'].date()))
+                visits[month] = visits.get(month, 0) + 1
+                rows.append(attendance_params(connection, student_id, dance_class.pk, item['when']))
+                checked_in.append((student_id, dance_class.pk, item['when']))
+
+        if not rows:
+            return results
+
+        counted = debited = 0
+        with connection.cursor() as cursor:
+            cursor.executemany(insert_attendance_sql(), rows)
+            inserted = cursor.rowcount
+            if inserted == len(rows):
+                cursor.executemany(occupancy_upsert_sql(), [
+                    occupancy_params(connection, classes_by_id[class_id], date, count)
+                    for (class_id, date), count in joined.items()
+                ])
+                counted = cursor.rowcount
+            if counted == len(joined):
+                cursor.executemany(insert_entry_sql(), debits)
+                debited = cursor.rowcount
+        if inserted != len(rows) or counted != len(joined) or debited != len(debits):
+            # Another desk logged or spent some of these between our read and our insert: start again
+            # and check the items in one at a time, which handles each conflict on its own
+            transaction.set_rollback(True, using=using)
+            spent = None
+        else:
+            with connection.cursor() as cursor:
+                cursor.executemany(monthly_upsert_sql(), [
+                    monthly_params(connection, student_id, month, count)
+                    for (student_id, month), count in visits.items()
+                ])
+            touch(STUDENTS, *[student_scope(pk) for pk in spent], using=using)
+            publish_on_commit(checked_in, using=using)
+
+    if spent is None:
+        for item, dance_class, result in zip(items, classes, results):
+            if 'student_id' in result:
+                result['status'] = check_in_student(result['student_id'], dance_class, item['when'])
+    return results
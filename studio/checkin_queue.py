@@ -0,0 +1,141 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from .checkin import check_in_batch
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to a lock that only covers this process
+    fcntl = None
+
+# This module is the optional write-behind pipeline for check-ins.
+# Instead of writing to the database while the member waits at the desk, check_in appends the
+# check-in to a local append-only journal file and answers straight away. A drainer process
+# (manage.py drain_checkins) reads the journal in order and applies many check-ins per
+# transaction through check_in_batch(), so each gets the same guarded ledger debit, duplicate
+# check and capacity check as a direct check-in.
+#
+# The drainer records how far it got in an offset file, written only after its transaction
+# commits. If it dies in between, the same entries are applied again on restart and come back
+# as duplicates, so nothing is charged twice.
+
+# One lock guards the journal file itself and is only held for quick file operations;
+# the other makes sure a single drainer runs at a time, and is held while it talks to the database
+_thread_locks = {'journal': threading.Lock(), 'drain': threading.Lock()}
+
+
+def journal_path():
+    return Path(getattr(settings, 'STUDIO_CHECKIN_JOURNAL', settings.BASE_DIR / 'checkin-journal.jsonl'))
+
+
+def _offset_path():
+    return journal_path().with_suffix('.offset')
+
+
+@contextlib.contextmanager
+def _locked(name='journal'):
+    """Hold the named lock ('journal' or 'drain'), shared by every process using the journal."""
+    path = journal_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _thread_locks[name], open(path.with_suffix(f'.{name}.lock'), 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_offset():
+    try:
+        return int(_offset_path().read_text() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _write_offset(offset):
+    """Replace the offset file in one step, so a crash never leaves it half written."""
+    temporary = _offset_path().with_suffix('.offset.tmp')
+    temporary.write_text(str(offset))
+    os.replace(temporary, _offset_path())
+
+
+def enqueue_check_in(student_id, when):
+    """Durably record a check-in for the drainer to apply."""
+    entry = json.dumps({'student_id': student_id, 'when': when.isoformat(), 'queued_at': time.time()})
+    with _locked(), open(journal_path(), 'a', encoding='utf-8') as journal:
+        journal.write(entry + '\n')
+        journal.flush()
+        os.fsync(journal.fileno())
+
+
+def _pending_lines(journal, limit=None):
+    """Read complete lines after the current offset; returns (lines, offset after the last one)."""
+    offset = _read_offset()
+    journal.seek(offset)
+    lines = []
+    while limit is None or len(lines) < limit:
+        line = journal.readline()
+        if not line.endswith(b'\n'):
+            break  # End of file, or an entry still being written
+        offset += len(line)
+        lines.append(line.decode('utf-8'))
+    return lines, offset
+
+
+def drain(batch_size=500):
+    """
+    Apply up to `batch_size` queued check-ins in one transaction.
+    Returns a dict counting the results by status (empty if the queue was empty).
+    If the database raises OperationalError nothing is applied and the offset stays put, so
+    calling drain() again replays the same check-ins.
+    """
+    with _locked('drain'):
+        path = journal_path()
+        if not path.exists():
+            return {}
+        with _locked(), open(path, 'rb') as journal:
+            lines, offset = _pending_lines(journal, batch_size)
+        if not lines:
+            return {}
+
+        items = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                items.append({'student_id': int(entry['student_id']), 'when': parse_datetime(entry['when'])})
+            except (ValueError, KeyError, TypeError):
+                continue  # A corrupt line can never be applied, so skip it
+        counts = {}
+        for result in check_in_batch([item for item in items if item['when']]):
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+
+        with _locked():
+            _write_offset(offset)
+            if offset == path.stat().st_size:
+                # Everything has been applied: start the journal afresh so it doesn't grow forever
+                path.write_text('')
+                _write_offset(0)
+        return counts
+
+
+def queue_status():
+    """Return the number of queued check-ins and how many seconds the oldest has been waiting."""
+    path = journal_path()
+    if not path.exists():
+        return {'depth': 0, 'lag_seconds': 0.0}
+    with _locked(), open(path, 'rb') as journal:
+        lines, offset = _pending_lines(journal)
+    lag = 0.0
+    if lines:
+        with contextlib.suppress(ValueError, KeyError):
+            lag = max(0.0, time.time() - json.loads(lines[0])['queued_at'])
+    return {'depth': len(lines), 'lag_seconds': round(lag, 3)}
@@ -0,0 +1,221 @@
+from django.db import IntegrityError, connections, router
+from django.db.models import Exists, F, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Student, CreditEntry
+
+# This module keeps the credit ledger: the append-only record of every class a student buys,
+# spends at check-in, or has adjusted by staff (see CreditEntry).
+#
+# Writers only ever append. Each entry takes the next number in the student's sequence and stores
+# the balance it leaves, and (student, seq) is unique, so two desks appending for the same member
+# at once can't both succeed from the same starting balance: the loser's insert does nothing, and
+# it reads the new balance and tries again. No writer updates the Student row.
+#
+# Readers take Student.classes_left, a snapshot of the balance as of entry Student.credits_seq,
+# and add the deltas of the few entries after it (see with_balance). "manage.py compact_credits"
+# moves the snapshots forward now and then, so there are only ever a handful of deltas to add.
+# "manage.py reconcile_credits" gives students from before the ledger an opening entry (seq 0)
+# for the classes they had, and checks every running balance adds up.
+
+
+class LedgerContention(Exception):
+    """Other writers kept appending to the same student's ledger; the entry was not appended."""
+
+
+def with_balance(queryset):
+    """Annotate students with `balance`: the classes_left snapshot plus the ledger entries after it."""
+    recent = (CreditEntry.objects.filter(student=OuterRef('pk'), seq__gt=OuterRef('credits_seq'))
+              .order_by().values('student').annotate(total=Sum('delta')).values('total'))
+    return queryset.annotate(balance=F('classes_left') + Coalesce(Subquery(recent, output_field=IntegerField()), 0))
+
+
+def with_ledger_head(queryset):
+    """Annotate students with `head_seq` and `head_balance` from their latest ledger entry (None without one)."""
+    latest = CreditEntry.objects.filter(student=OuterRef('pk')).order_by('-seq')
+    return queryset.annotate(
+        head_seq=Subquery(latest.values('seq')[:1]), head_balance=Subquery(latest.values('balance')[:1]),
+    )
+
+
+def head(credits_seq, classes_left, head_seq, head_balance):
+    """(seq, balance) of a student's latest entry, or of their snapshot if they have no entries yet."""
+    return (head_seq, head_balance) if head_seq is not None else (credits_seq, classes_left)
+
+
+def ledger_heads(student_ids, using='default'):
+    """{student_id: (seq, balance)} for each existing student in `student_ids` (see head()). One query."""
+    rows = with_ledger_head(Student.objects.using(using).filter(pk__in=student_ids)).values_list(
+        'pk', 'credits_seq', 'classes_left', 'head_seq', 'head_balance',
+    )
+    return {pk: head(*fields) for pk, *fields in rows}
+
+
+def insert_entry_sql():
+    """SQL that appends one ledger entry worked out by the caller, doing nothing if its number is already taken."""
+    table = CreditEntry._meta.db_table
+    return (
+        f"INSERT INTO {table} (student_id, seq, kind, delta, balance, dance_class_id, note, created_at) "
+        f"VALUES (%s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT (student_id, seq) DO NOTHING"
+    )
+
+
+def entry_params(connection, student_id, seq, kind, delta, balance, dance_class_id=None, note=''):
+    """Parameters for insert_entry_sql()."""
+    return [student_id, seq, kind, delta, balance, dance_class_id, note,
+            connection.ops.adapt_datetimefield_value(timezone.now())]
+
+
+def append_sql():
+    """
+    SQL that appends an entry after a student's latest one (or their snapshot, if they have none),
+    only if the balance stays at or above zero. Affects no rows if it would go below zero, the
+    student doesn't exist, or another writer took the number first.
+    Parameters: kind, delta, delta, dance_class_id, note, created_at, student_id, delta.
+    """
+    ledger, students = CreditEntry._meta.db_table, Student._meta.db_table
+    return (
+        f"INSERT INTO {ledger} (student_id, seq, kind, delta, balance, dance_class_id, note, created_at) "
+        f"SELECT s.id, COALESCE(e.seq, s.credits_seq) + 1, %s, %s, COALESCE(e.balance, s.classes_left) + %s, %s, %s, %s "
+        f"FROM {students} s LEFT JOIN {ledger} e ON e.student_id = s.id "
+        f"AND e.seq = (SELECT MAX(seq) FROM {ledger} WHERE student_id = s.id) "
+        f"WHERE s.id = %s AND COALESCE(e.balance, s.classes_left) + %s >= 0 "
+        f"ON CONFLICT (student_id, seq) DO NOTHING"
+    )
+
+
+def append_credit(student_id, kind, delta, dance_class_id=None, note='', using=None):
+    """
+    Append one entry to a student's ledger. Returns True, or False if the student doesn't exist
+    or has too few classes left for a negative `delta`. Raises LedgerContention if other writers
+    took every number it tried.
+    Callers that show balances should touch the student's change marker (see studio.changes).
+    """
+    using = using or router.db_for_write(CreditEntry)
+    connection = connections[using]
+    params = [kind, delta, delta, dance_class_id, note, connection.ops.adapt_datetimefield_value(timezone.now()),
+              student_id, delta]
+    with connection.cursor() as cursor:
+        for attempt in range(3):
+            cursor.execute(append_sql(), params)
+            if cursor.rowcount:
+                return True
+            latest = ledger_heads([student_id], using).get(student_id)
+            if latest is None or latest[1] + delta < 0:
+                return False
+            # Another desk appended to this member's ledger between our read and our write: go again
+    raise LedgerContention(f"Other writers kept appending to the ledger of student {student_id}.")
+
+
+def append_credits(entries, using='default'):
+    """
+    Append many entries in one statement: each is (student_id, kind, delta, note), applied in order.
+    Entries for students that don't exist, or that would leave a negative balance, are skipped.
+    Returns the number appended. Raises IntegrityError if another writer appended to one of
+    these ledgers meanwhile, so the caller's transaction rolls back and can be retried.
+    """
+    connection = connections[using]
+    heads = ledger_heads({student_id for student_id, kind, delta, note in entries}, using)
+    rows = []
+    for student_id, kind, delta, note in entries:
+        if student_id not in heads or heads[student_id][1] + delta < 0:
+            continue
+        seq, balance = heads[student_id][0] + 1, heads[student_id][1] + delta
+        heads[student_id] = (seq, balance)
+        rows.append(entry_params(connection, student_id, seq, kind, delta, balance, note=note))
+    if rows:
+        with connection.cursor() as cursor:
+            cursor.executemany(insert_entry_sql(), rows)
+            if cursor.rowcount != len(rows):
+                raise IntegrityError("Another writer appended to the same credit ledger; try again.")
+    return len(rows)
+
+
+def backfill_openings(batch_size=5000, using='default', log=None):
+    """
+    Give each student whose ledger has no opening entry one at seq 0, holding the classes they
+    had before their first entry (their classes_left, for students with no entries at all).
+    Students who started from nothing need none. Returns the number of openings written.
+    """
+    connection = connections[using]
+    first = CreditEntry.objects.using(using).filter(student=OuterRef('pk')).order_by('seq')
+    students = Student.objects.using(using).exclude(
+        Exists(CreditEntry.objects.using(using).filter(student=OuterRef('pk'), seq=0)),
+    ).annotate(
+        first_balance=Subquery(first.values('balance')[:1]), first_delta=Subquery(first.values('delta')[:1]),
+    ).order_by('pk')
+    written, last_pk = 0, 0
+    while True:
+        batch = list(students.filter(pk__gt=last_pk).values_list('pk', 'classes_left', 'first_balance', 'first_delta')[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+        rows = []
+        for pk, classes_left, first_balance, first_delta in batch:
+            opening = classes_left if first_balance is None else first_balance - first_delta
+            if opening > 0:
+                rows.append(entry_params(connection, pk, 0, CreditEntry.OPENING, opening, opening,
+                                         note="Balance carried over from before the ledger"))
+        if rows:
+            with connection.cursor() as cursor:
+                cursor.executemany(insert_entry_sql(), rows)
+        written += len(rows)
+        if log:
+            log(f"Wrote {written} opening entries")
+    return written
+
+
+def compact_snapshots(batch_size=5000, using='default', log=None):
+    """
+    Move every student's classes_left snapshot up to their latest ledger entry, `batch_size`
+    students per statement. Balances don't change, so nothing else needs to know. Returns the
+    number of students whose snapshot moved.
+    """
+    latest = CreditEntry.objects.using(using).filter(student=OuterRef('pk')).order_by('-seq')
+    behind = Student.objects.using(using).filter(
+        Exists(CreditEntry.objects.using(using).filter(student=OuterRef('pk'), seq__gt=OuterRef('credits_seq'))),
+    )
+    compacted, last_pk = 0, 0
+    while True:
+        ids = list(Student.objects.using(using).filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        last_pk = ids[-1]
+        # One statement per batch reads the latest entry and writes the snapshot together, so an
+        # entry appended meanwhile is simply left for the next run
+        compacted += behind.filter(pk__gte=ids[0], pk__lte=ids[-1]).update(
+            credits_seq=Subquery(latest.values('seq')[:1]), classes_left=Subquery(latest.values('balance')[:1]),
+        )
+        if log:
+            log(f"Compacted {compacted} snapshots")
+    return compacted
+
+
+def find_discrepancies(using='default'):
+    """
+    Check the whole ledger, yielding (student_id, seq, problem) for each entry whose balance isn't
+    the one before it plus its delta, whose number skips, or which has no opening to start from,
+    and for each snapshot that doesn't match the entry it claims to be as of.
+    """
+    snapshots = dict((pk, (seq, classes_left)) for pk, seq, classes_left in
+                     Student.objects.using(using).filter(Q(credits_seq__gt=0) | Q(classes_left__gt=0)).values_list('pk', 'credits_seq', 'classes_left'))
+    previous = None
+    entries = (CreditEntry.objects.using(using).order_by('student_id', 'seq')
+               .values_list('student_id', 'seq', 'delta', 'balance').iterator(chunk_size=5000))
+    for student_id, seq, delta, balance in entries:
+        if previous is None or previous[0] != student_id:
+            # The first entry starts from nothing: an opening, or a purchase made since the ledger began
+            if seq not in (0, 1):
+                yield student_id, seq, "expected entry #0 or #1"
+            if balance != delta:
+                yield student_id, seq, f"no opening entry for the {balance - delta} classes before it"
+        else:
+            if seq != previous[1] + 1:
+                yield student_id, seq, f"expected entry #{previous[1] + 1}"
+            if balance != previous[2] + delta:
+                yield student_id, seq, f"balance {balance} should be {previous[2] + delta}"
+        snapshot = snapshots.get(student_id)
+        if snapshot is not None and snapshot[0] == seq and snapshot[1] != balance:
+            yield student_id, seq, f"snapshot of {snapshot[1]} classes should be {balance}"
+        previous = (student_id, seq, balance)
@@ -0,0 +1,141 @@
+import contextvars
+import functools
+import sqlite3
+
+from asgiref.sync import iscoroutinefunction
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Max, Min
+
+# This module holds the studio's database tuning:
+#   - configure_connection() applies the SQLite pragmas from settings.STUDIO_SQLITE_PRAGMAS to
+#     every new connection (WAL so readers don't block the check-in writer, a busy timeout, mmap),
+#   - read_only_view marks views whose queries may be served by the 'replica' database, and
+#     ReadReplicaRouter sends those reads there while every write stays on 'default',
+#   - sync_replica() refreshes a local file copy of the database that stands in for a real replica,
+#   - estimated_row_count() sizes a big table without counting every row,
+#   - is_busy() tells a write that lost to other writers from any other database error.
+
+REPLICA = 'replica'
+
+_reading_from_replica = contextvars.ContextVar('reading_from_replica', default=False)
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created receiver: apply the configured pragmas to new SQLite connections."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'STUDIO_SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def replica_enabled():
+    """True if a replica is configured and is a different database from the primary."""
+    if REPLICA not in settings.DATABASES:
+        return False
+    # Under test the replica mirrors the primary, and sending reads there would only add a second
+    # connection to the same database
+    return connections[REPLICA].settings_dict['NAME'] != connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+
+
+def read_only_view(view):
+    """
+    Let the ORM reads made by `view` go to the read replica, if one is configured.
+    Put it below @login_required, so the session and user are still read from the primary.
+    Works for async views too: the async ORM runs queries with the view's context, so the router sees the mark.
+    """
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            token = _reading_from_replica.set(True)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _reading_from_replica.reset(token)
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _reading_from_replica.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _reading_from_replica.reset(token)
+    return wrapper
+
+
+class ReadReplicaRouter:
+    """Send studio reads made inside read_only_view views to the replica; everything else to default."""
+    def db_for_read(self, model, **hints):
+        if _reading_from_replica.get() and model._meta.app_label == 'studio' and replica_enabled():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of the primary, so it is never migrated on its own
+        return db != REPLICA
+
+
+def sync_replica():
+    """
+    Copy the primary SQLite database onto the replica file with SQLite's online backup API,
+    which gives a consistent snapshot without stopping writers for long.
+    """
+    primary, replica = settings.DATABASES['default'], settings.DATABASES[REPLICA]
+    if 'sqlite' not in primary['ENGINE'] or 'sqlite' not in replica['ENGINE']:
+        raise ValueError("sync_replica only copies SQLite databases; use real replication for other backends.")
+    source = sqlite3.connect(str(primary['NAME']))
+    target = sqlite3.connect(str(replica['NAME']))
+    try:
+        with target:
+            source.backup(target, pages=1024)
+    finally:
+        source.close()
+        target.close()
+
+
+# SQLite's result codes for "another connection holds the lock" (extended codes keep them in the low byte)
+SQLITE_BUSY_CODES = {sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED}
+# PostgreSQL's SQLSTATEs for lock_not_available, serialization_failure and deadlock_detected
+POSTGRES_BUSY_STATES = {'55P03', '40001', '40P01'}
+
+
+def is_busy(error):
+    """True if a database error means other writers held the lock, so the same write may succeed later."""
+    cause = error.__cause__ or error
+    code = getattr(cause, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in SQLITE_BUSY_CODES
+    return getattr(cause, 'sqlstate', None) in POSTGRES_BUSY_STATES or getattr(cause, 'pgcode', None) in POSTGRES_BUSY_STATES
+
+
+def estimated_row_count(model, using=DEFAULT_DB_ALIAS):
+    """
+    A cheap estimate of the number of rows in `model`'s table, or None if there is none to be had.
+    PostgreSQL keeps one in its catalogue; elsewhere the span of the primary key is read from
+    both ends of its index, which is close for tables that mostly grow and lose their oldest rows.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return row[0]
+    if model._meta.pk.get_internal_type() not in ('AutoField', 'BigAutoField', 'BigIntegerField', 'IntegerField'):
+        return None
+    # Two separate aggregates, since SQLite only reads MIN or MAX off an index when it is alone in the query
+    rows = model._default_manager.using(using)
+    first, last = rows.aggregate(value=Min('pk'))['value'], rows.aggregate(value=Max('pk'))['value']
+    if first is None:
+        return 0
+    return last - first + 1
@@ -0,0 +1,152 @@
+import asyncio
+import functools
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import Student, ClassOccupancy
+
+# This module pushes live updates to the desk screens: each check-in, and the new head count of
+# its class. Views and the check-in engine publish events once their transaction has committed
+# (see publish_on_commit); the event stream view (studio.async_views.occupancy_events) holds one
+# subscription per connected screen and forwards what arrives, so screens never poll.
+#
+# Events are dicts with a 'type' of 'check_in' or 'occupancy'. They go through a broker chosen by
+# STUDIO_EVENT_BACKEND. The default InProcessBroker only reaches screens connected to the same
+# server process, which suits the usual single ASGI worker; a deployment with several workers
+# can plug in a broker backed by a shared pub/sub service that offers the same three methods:
+#   - publish(event): send an event to every subscriber; called from any thread,
+#   - subscribe(): return a subscription, from inside the event loop that will read it,
+#   - has_subscribers(): False if nobody is listening, so publishers can skip building events.
+# A subscription has `await get(timeout)`, returning the next event or None after `timeout`
+# seconds without one, and close().
+
+CHECK_IN = 'check_in'
+OCCUPANCY = 'occupancy'
+
+
+class Subscription:
+    """One listener's bounded queue of events, read on the event loop that created it."""
+    def __init__(self, broker, size):
+        self.broker = broker
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=size)
+
+    def deliver(self, event):
+        """Queue an event; runs on the subscriber's loop. A screen that falls behind loses its oldest events."""
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Hand events to the subscribers in this process."""
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size or getattr(settings, 'STUDIO_EVENT_QUEUE_SIZE', 100)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self, self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                # Publishers run on request or worker threads; the queue belongs to the subscriber's loop
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The subscriber's loop has shut down without closing the subscription
+                self.unsubscribe(subscription)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """The process-wide broker named by STUDIO_EVENT_BACKEND."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'STUDIO_EVENT_BACKEND', 'studio.events.InProcessBroker'))()
+        return _broker
+
+
+def occupancy_event(entry):
+    """The 'occupancy' event for a ClassOccupancy row (with its dance_class loaded)."""
+    return {
+        'type': OCCUPANCY,
+        'dance_class_id': entry.dance_class_id,
+        'dance_class': entry.dance_class.name,
+        'date': entry.date.isoformat(),
+        'checked_in': entry.checked_in,
+        'max_students': entry.dance_class.max_students,
+    }
+
+
+def publish_changes(check_ins=(), classes=(), using='default'):
+    """
+    Publish a 'check_in' event for each (student_id, dance_class_id, when) in `check_ins`, then
+    an 'occupancy' event for each class and day they touched, plus each (dance_class_id, date)
+    in `classes`. Costs two queries, and none when no screen is listening.
+    """
+    broker = get_broker()
+    if not broker.has_subscribers():
+        return
+    check_ins = list(check_ins)
+    days = dict.fromkeys([(class_id, when.date()) for student_id, class_id, when in check_ins] + list(classes))
+    occupancy = {
+        (entry.dance_class_id, entry.date): entry for entry in
+        ClassOccupancy.objects.using(using).select_related('dance_class')
+        .filter(dance_class_id__in={class_id for class_id, date in days}, date__in={date for class_id, date in days})
+    }
+    names = dict(Student.objects.using(using).filter(pk__in={student_id for student_id, class_id, when in check_ins})
+                 .values_list('pk', 'name'))
+
+    for student_id, class_id, when in check_ins:
+        entry = occupancy.get((class_id, when.date()))
+        broker.publish({
+            'type': CHECK_IN,
+            'student_id': student_id,
+            'student': names.get(student_id, ''),
+            'dance_class_id': class_id,
+            'dance_class': entry.dance_class.name if entry else '',
+            'date': when.date().isoformat(),
+            'time': when.time().isoformat(timespec='seconds'),
+        })
+    for key in days:
+        if key in occupancy:
+            broker.publish(occupancy_event(occupancy[key]))
+
+
+def publish_on_commit(check_ins=(), classes=(), using='default'):
+    """Schedule publish_changes() for when the current transaction commits (or now, outside one)."""
+    if not get_broker().has_subscribers():
+        return
+    # robust: a failure to publish is logged, and never turns a committed check-in into an error page
+    transaction.on_commit(
+        functools.partial(publish_changes, list(check_ins), list(classes), using), using=using, robust=True,
+    )
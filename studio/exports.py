@@ -0,0 +1,210 @@
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .forms import AttendanceExportForm
+from .archive import attendance_sources
+from .changes import STUDENTS, CLASSES
+from .models import ChangeMarker, ExportJob
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet exports are only offered when pyarrow is installed
+    pyarrow = None
+
+# This module builds attendance exports in the background.
+# A request for an export becomes an ExportJob; a small thread pool runs the job, reading the
+# rows in chunks (like the streaming CSV view) and writing them to a file under
+# STUDIO_EXPORT_DIR, recording its progress on the job as it goes.
+#
+# Jobs are keyed by their filters and format, and remember the attendance watermark (the versions
+# of the student and class change markers, see studio.changes) at the time they were requested.
+# A later request with the same key and watermark gets the finished file straight from disk;
+# once attendance changes, the watermark moves on and a fresh file is built, replacing the old one.
+
+logger = logging.getLogger('studio.exports')
+
+HEADER = ['Student Name', 'Membership Number', 'Class Name', 'Date', 'Time']
+COLUMNS = ['student__name', 'student__membership_number', 'dance_class__name', 'date', 'time']
+CHUNK_SIZE = 2000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def available_formats():
+    """The export formats this installation can write."""
+    return [(value, label) for value, label in ExportJob.FORMAT_CHOICES if value != 'parquet' or pyarrow]
+
+
+def export_dir():
+    return Path(getattr(settings, 'STUDIO_EXPORT_DIR', settings.BASE_DIR / 'exports'))
+
+
+def attendance_watermark(using='default'):
+    """A value that changes whenever attendance, a student or a class changes (see studio.changes)."""
+    versions = dict(ChangeMarker.objects.using(using).filter(scope__in=[STUDENTS, CLASSES]).values_list('scope', 'version'))
+    return f"{versions.get(STUDENTS, 0)}-{versions.get(CLASSES, 0)}"
+
+
+def filters_from_form(form):
+    """The cleaned filters of an AttendanceExportForm, as JSON-friendly values the job can store."""
+    data = form.cleaned_data
+    return {
+        'start': data['start'].isoformat() if data.get('start') else '',
+        'end': data['end'].isoformat() if data.get('end') else '',
+        'dance_class': data['dance_class'].pk if data.get('dance_class') else '',
+        'style': data.get('style') or '',
+    }
+
+
+def job_key(filters, export_format):
+    return hashlib.sha256(json.dumps([filters, export_format], sort_keys=True).encode()).hexdigest()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'STUDIO_EXPORT_WORKERS', 2), thread_name_prefix='studio-export',
+            )
+        return _executor
+
+
+def start_export(filters, export_format, user=None):
+    """
+    Return the ExportJob for these filters and format: a finished one whose file is still current,
+    one already under way, or a new one handed to the thread pool.
+    """
+    key = job_key(filters, export_format)
+    watermark = attendance_watermark()
+    stale_before = timezone.now() - datetime.timedelta(seconds=getattr(settings, 'STUDIO_EXPORT_STALE_AFTER', 3600))
+    for job in ExportJob.objects.filter(key=key, watermark=watermark).exclude(status=ExportJob.FAILED).order_by('-pk'):
+        if job.status == ExportJob.DONE and Path(job.file).exists():
+            return job
+        # A job that has not moved for a long time died with its process, so it is not worth waiting for
+        if job.status in (ExportJob.PENDING, ExportJob.RUNNING) and job.updated_at >= stale_before:
+            return job
+
+    job = ExportJob.objects.create(
+        key=key, watermark=watermark, filters=filters, format=export_format,
+        requested_by=user if user and user.is_authenticated else None,
+    )
+    _get_executor().submit(run_export_job, job.pk)
+    return job
+
+
+def _rows(filters):
+    """
+    Return the number of filtered attendance rows, and an iterator over them in chunks of tuples
+    of the exported columns. Each chunk is its own query seeking past the last id of the one
+    before, so no read stays open while the job writes its progress: on SQLite in WAL mode a
+    connection holding an old snapshot may not write once someone else has committed.
+    """
+    form = AttendanceExportForm(filters)
+    if not form.is_valid():
+        raise ValueError(form.errors.as_text())
+    sources = attendance_sources(form)
+
+    def chunks():
+        for queryset in sources:
+            last_id = 0
+            while True:
+                chunk = list(queryset.filter(pk__gt=last_id).order_by('pk').values_list('pk', *COLUMNS)[:CHUNK_SIZE])
+                if not chunk:
+                    break
+                last_id = chunk[-1][0]
+                yield [row[1:] for row in chunk]
+
+    return sum(queryset.count() for queryset in sources), chunks()
+
+
+def _write_csv(handle, chunks, progress):
+    text = io.TextIOWrapper(handle, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerow(HEADER)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        progress(len(chunk))
+    text.flush()
+    text.detach()
+
+
+def _write_parquet(handle, chunks, progress):
+    schema = pyarrow.schema([
+        ('student_name', pyarrow.string()),
+        ('membership_number', pyarrow.string()),
+        ('class_name', pyarrow.string()),
+        ('date', pyarrow.date32()),
+        ('time', pyarrow.time64('us')),
+    ])
+    # Each chunk becomes one row group, so memory use stays flat however long the history is
+    with pyarrow.parquet.ParquetWriter(handle, schema, compression='zstd') as writer:
+        for chunk in chunks:
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(zip(*chunk), schema)], schema=schema,
+            ))
+            progress(len(chunk))
+
+
+def run_export_job(job_id):
+    """Build one export file, recording progress on the job. Runs on an export pool thread."""
+    jobs = ExportJob.objects.filter(pk=job_id)
+    temporary = None
+    try:
+        job = jobs.get()
+        jobs.update(status=ExportJob.RUNNING, updated_at=timezone.now())
+        total, chunks = _rows(job.filters)
+        jobs.update(total_rows=total)
+
+        written = 0
+
+        def progress(count):
+            nonlocal written
+            written += count
+            jobs.update(rows_written=written, updated_at=timezone.now())
+
+        directory = export_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"attendance-{job.key[:16]}-{job.watermark}.{job.format}"
+        temporary = path.with_name(path.name + '.tmp')
+        with open(temporary, 'wb') as handle:
+            if job.format == 'parquet':
+                if pyarrow is None:
+                    raise ValueError("Parquet exports need the pyarrow package.")
+                _write_parquet(handle, chunks, progress)
+            elif job.format == 'csv.gz':
+                with gzip.GzipFile(fileobj=handle, mode='wb') as compressed:
+                    _write_csv(compressed, chunks, progress)
+            else:
+                _write_csv(handle, chunks, progress)
+        # Only a complete file ever appears under the final name
+        os.replace(temporary, path)
+        jobs.update(status=ExportJob.DONE, file=str(path), finished_at=timezone.now(), updated_at=timezone.now())
+
+        # Files built for the same export before attendance changed will never be served again. Only
+        # jobs requested before this one are older: a job requested later may hold a newer file
+        for old in ExportJob.objects.filter(key=job.key, status=ExportJob.DONE, pk__lt=job_id).exclude(file=str(path)):
+            Path(old.file).unlink(missing_ok=True)
+    except Exception as error:
+        logger.exception("Export job %s failed", job_id)
+        jobs.update(status=ExportJob.FAILED, error=str(error), updated_at=timezone.now())
+        if temporary:
+            temporary.unlink(missing_ok=True)
+    finally:
+        # Pool threads keep their own connections, which nothing else would ever close
+        connections.close_all()
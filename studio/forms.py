@@ -1,5 +1,7 @@
 from django import forms
-from .models import Student, DanceClass
+from .fragments import class_choices
+from .models import Student, DanceClass, ExportJob
+from .schedule import parse_schedule
 
 # This module defines forms for the Dance Studio application, 
 # allowing for the creation and editing of Student and DanceClass models.
@@ -21,6 +23,15 @@ class StudentForm(forms.ModelForm):
             'classes_left': forms.Select(choices=[(30, '30'), (50, '50'), (100, '100')]),
         }
 
+class StudentImportForm(StudentForm):
+    """
+    StudentForm for rows of a bulk import.
+    It applies the same field rules but skips the per-row uniqueness queries, because the
+    import_students command checks phone and membership number collisions for a whole batch at once.
+    """
+    def validate_unique(self):
+        pass
+
 class DanceClassForm(forms.ModelForm):  
     """
     Form for creating or updating a DanceClass instance.
@@ -30,5 +41,80 @@ class DanceClassForm(forms.ModelForm):
     class Meta:
         model = DanceClass
         fields = ['name', 'style', 'level', 'description', 'schedule', 'max_students']
+        help_texts = {
+            'schedule': 'Days and times, e.g. "Mon/Wed 18:00-19:30" or "Tue 7pm; Sat 10am".',
+        }
+
+    def clean_schedule(self):
+        """Make sure check-in will be able to read the schedule."""
+        schedule = self.cleaned_data.get('schedule')
+        try:
+            parse_schedule(schedule)
+        except ValueError as error:
+            raise forms.ValidationError(str(error))
+        return schedule
+
+class AttendanceExportForm(forms.Form):
+    """
+    Filters for the attendance CSV export.
+    All fields are optional, so an empty form exports the full history.
+    """
+    start = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    dance_class = forms.ModelChoiceField(queryset=DanceClass.objects.all(), required=False)
+    style = forms.ChoiceField(choices=[('', 'All styles')] + DanceClass.STYLE_CHOICES, required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.is_bound:
+            # A blank form only shows the class list, which comes from the fragment cache instead of a query
+            field = self.fields['dance_class']
+            field.choices = [('', field.empty_label)] + class_choices()
 
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start and end and start > end:
+            raise forms.ValidationError("Start date must be on or before the end date.")
+        return cleaned_data
+
+    def filter_queryset(self, queryset):
+        """Apply the cleaned filters to an Attendance queryset."""
+        data = self.cleaned_data
+        if data.get('start'):
+            queryset = queryset.filter(date__gte=data['start'])
+        if data.get('end'):
+            queryset = queryset.filter(date__lte=data['end'])
+        if data.get('dance_class'):
+            queryset = queryset.filter(dance_class=data['dance_class'])
+        if data.get('style'):
+            queryset = queryset.filter(dance_class__style=data['style'])
+        return queryset
+
+class ExportJobForm(AttendanceExportForm):
+    """
+    The attendance export filters plus how to deliver the file: streamed straight away,
+    or built in the background in the chosen format.
+    """
+    format = forms.ChoiceField(choices=ExportJob.FORMAT_CHOICES, initial='csv', required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Only offer the formats this installation can write (Parquet needs pyarrow)
+        from .exports import available_formats
+        self.fields['format'].choices = available_formats()
+
+class ReportForm(forms.Form):
+    """
+    Date range for the attendance reports dashboard.
+    Both dates are optional; the view falls back to the last 90 days.
+    """
+    start = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
 
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start and end and start > end:
+            raise forms.ValidationError("Start date must be on or before the end date.")
+        return cleaned_data
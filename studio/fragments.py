@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .changes import CLASSES, student_scope
+from .metrics import registry
+from .models import ChangeMarker, DanceClass
+
+# This module caches rendered pieces of the pages that many requests share: the index table's
+# row for each student, and the list of classes offered by the export form.
+#
+# Each piece is stored under a key holding the version of the change marker it depends on
+# (see studio.changes): student_scope(pk) for a student's row, which the signal receivers and the
+# check-in engine bump whenever the student or their attendance changes, and CLASSES for the class
+# list. A change never has to delete anything: the version moves on, the next request asks for a
+# key nobody has stored yet, and the old entry ages out of the cache. So each worker may keep its
+# own cache without ever serving a stale fragment.
+#
+# The cache is the 'fragments' entry in settings.CACHES, a bounded LRU in-process cache by default
+# (see STUDIO_FRAGMENT_CACHE). Hits and misses are counted in studio_fragment_cache_total on /metrics.
+
+CACHE_ALIAS = 'fragments'
+
+
+def fragment_cache():
+    return caches[CACHE_ALIAS if CACHE_ALIAS in settings.CACHES else 'default']
+
+
+def count(fragment, hits, misses):
+    """Record cache hits and misses for a kind of fragment."""
+    if hits:
+        registry.increment('studio_fragment_cache_total', hits, fragment=fragment, result='hit')
+    if misses:
+        registry.increment('studio_fragment_cache_total', misses, fragment=fragment, result='miss')
+
+
+def versions(scopes):
+    """The current version of each change marker in `scopes`, in one query (0 if it has never changed)."""
+    found = dict(ChangeMarker.objects.filter(scope__in=scopes).values_list('scope', 'version'))
+    return {scope: found.get(scope, 0) for scope in scopes}
+
+
+def student_rows(students, user):
+    """
+    The index table row for each of `students`, as HTML, in order.
+    Costs one query for the versions and one cache round trip, plus rendering whatever rows missed.
+    """
+    students = list(students)
+    if not students:
+        return []
+    current = versions([student_scope(student.pk) for student in students])
+    # Staff see a Check In button, so the row differs by whether the viewer is logged in
+    authenticated = int(user.is_authenticated)
+    keys = [f'student-row:{student.pk}:{current[student_scope(student.pk)]}:{authenticated}' for student in students]
+
+    cache = fragment_cache()
+    found = cache.get_many(keys)
+    rendered = {}
+    rows = []
+    for student, key in zip(students, keys):
+        html = found.get(key)
+        if html is None:
+            html = rendered[key] = render_to_string('student_row.html', {'student': student, 'user': user})
+        rows.append(mark_safe(html))
+    if rendered:
+        cache.set_many(rendered)
+    count('student_row', len(found), len(rendered))
+    return rows
+
+
+def class_choices():
+    """(pk, label) for every dance class, as a ModelChoiceField would list them, cached until a class changes."""
+    key = f'class-choices:{versions([CLASSES])[CLASSES]}'
+    cache = fragment_cache()
+    choices = cache.get(key)
+    if choices is None:
+        choices = [(dance_class.pk, str(dance_class)) for dance_class in DanceClass.objects.all()]
+        cache.set(key, choices)
+        count('class_choices', 0, 1)
+    else:
+        count('class_choices', 1, 0)
+    return choices
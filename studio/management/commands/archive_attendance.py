@@ -0,0 +1,31 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from studio.archive import archive_attendance, default_cutoff, latest_cutoff
+from studio.models import Attendance
+
+
+class Command(BaseCommand):
+    help = "Move attendance older than a cut-off date from the Attendance table into the archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before', type=datetime.date.fromisoformat,
+            help="Archive attendance dated before this day (YYYY-MM-DD; default: STUDIO_ARCHIVE_AFTER_DAYS ago).",
+        )
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows moved per transaction (default: 5000).")
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many rows would be archived.")
+
+    def handle(self, *args, **options):
+        before = options['before'] or default_cutoff()
+        if before > latest_cutoff():
+            raise CommandError(f"The cut-off must be on or before {latest_cutoff()}, so recent check-ins stay live.")
+
+        if options['dry_run']:
+            count = Attendance.objects.filter(date__lt=before).count()
+            self.stdout.write(f"{count} attendance records dated before {before} would be archived.")
+            return
+
+        moved = archive_attendance(before, batch_size=max(1, options['batch_size']), log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} attendance records dated before {before}."))
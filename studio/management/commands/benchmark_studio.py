@@ -0,0 +1,80 @@
+import tempfile
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from studio.benchmarks import SCENARIOS, seed, run_benchmarks, compare, save_results, load_results
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the studio views (index, search, check-in, attendance history and export) and save "
+        "latency percentiles, query counts and peak memory as JSON. By default the run seeds and "
+        "uses a throwaway database; with --baseline it fails if a scenario got slower."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=1000, help="Students to seed (default: 1000).")
+        parser.add_argument('--classes', type=int, default=20, help="Classes to seed (default: 20).")
+        parser.add_argument('--years', type=int, default=1, help="Years of attendance to seed (default: 1).")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed (default: 0).")
+        parser.add_argument('--iterations', type=int, default=20, help="Requests per scenario (default: 20).")
+        parser.add_argument('--concurrency', type=int, default=8, help="Concurrent clients for check-in (default: 8).")
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, help="Run only this scenario (repeatable).")
+        parser.add_argument('--output', default='benchmark-results.json', help="Results file (default: benchmark-results.json).")
+        parser.add_argument('--baseline', help="Results file from an earlier run to compare against.")
+        parser.add_argument('--threshold', type=float, default=0.2, help="Allowed slowdown against the baseline (default: 0.2 = 20%%).")
+        parser.add_argument('--metric', default='p50_ms', choices=['p50_ms', 'p90_ms', 'p99_ms', 'mean_ms'],
+                            help="Which latency to compare against the baseline (default: p50_ms).")
+        parser.add_argument('--use-existing-db', action='store_true',
+                            help="Benchmark the configured database as it is (e.g. after seed_studio) instead of a seeded throwaway one.")
+
+    def handle(self, *args, **options):
+        baseline = load_results(options['baseline']) if options['baseline'] else None
+
+        if options['use_existing_db']:
+            results = self.run(options)
+        else:
+            results = self.run_in_throwaway_database(options)
+
+        save_results(results, options['output'])
+        self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline:
+            regressions = compare(results, baseline, options['threshold'], options['metric'])
+            for name, before, after in regressions:
+                self.stderr.write(f"{name}: {options['metric']} went from {before} to {after}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} scenario(s) slower than the baseline by more than {options['threshold']:.0%}.")
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def run(self, options):
+        return run_benchmarks(
+            scenarios=options['scenario'] or SCENARIOS,
+            iterations=options['iterations'],
+            concurrency=options['concurrency'],
+            seed=options['seed'],
+            log=self.stdout.write,
+        )
+
+    def run_in_throwaway_database(self, options):
+        """Create a file-backed test database (so concurrent clients share it), seed it, benchmark it and drop it."""
+        with tempfile.TemporaryDirectory() as directory:
+            connection = connections['default']
+            if connection.vendor == 'sqlite':
+                connection.settings_dict.setdefault('TEST', {})['NAME'] = str(Path(directory) / 'benchmark.sqlite3')
+            setup_test_environment()
+            runner = DiscoverRunner(verbosity=0, interactive=False)
+            old_config = runner.setup_databases()
+            try:
+                seed(
+                    students=options['students'], classes=options['classes'],
+                    years=options['years'], seed=options['seed'], log=self.stdout.write,
+                )
+                return self.run(options)
+            finally:
+                runner.teardown_databases(old_config)
+                teardown_test_environment()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from studio.credits import compact_snapshots
+
+
+class Command(BaseCommand):
+    help = "Bring each student's classes_left snapshot up to their latest credit ledger entry, so balances add fewer deltas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Students compacted per statement (default: 5000).")
+
+    def handle(self, *args, **options):
+        compacted = compact_snapshots(batch_size=max(1, options['batch_size']), log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"Compacted {compacted} snapshot(s)."))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError
+
+from studio.checkin import CheckInBusy
+from studio.checkin_queue import drain
+
+
+class Command(BaseCommand):
+    help = "Apply check-ins queued by the write-behind pipeline, many per transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Check-ins per transaction (default: 500).")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to wait when the queue is empty (default: 1).")
+        parser.add_argument('--once', action='store_true', help="Drain what is queued now, then exit.")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                counts = drain(batch_size=max(1, options['batch_size']))
+            except (OperationalError, CheckInBusy) as error:
+                # Usually "database is locked" while the desks are busy: nothing was applied and the
+                # offset hasn't moved, so wait and replay the same check-ins
+                self.stderr.write(f"Could not apply queued check-ins, retrying: {error}")
+                time.sleep(options['interval'])
+                continue
+            if counts:
+                summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+                self.stdout.write(f"Applied {sum(counts.values())} queued check-ins: {summary}")
+                continue  # There may be more waiting
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,157 @@
+import csv
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from studio.changes import STUDENTS, student_scope, touch
+from studio.credits import append_credits
+from studio.forms import StudentImportForm
+from studio.models import Student, CreditEntry
+
+FIELDS = ['name', 'phone', 'membership_number', 'classes_left']
+
+
+class Command(BaseCommand):
+    help = (
+        "Import students from a CSV or JSON Lines file with name, phone, membership_number and "
+        "classes_left columns, validating each row with the StudentForm rules."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV (.csv) or JSON Lines (.jsonl) file to import.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="File format (default: from the extension).")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per transaction (default: 1000).")
+        parser.add_argument(
+            '--upsert', action='store_true',
+            help="Add the classes to the balance of members whose membership number already exists instead of rejecting them.",
+        )
+        parser.add_argument('--rejects', help="Where to write rejected rows (default: <path>.rejects.csv).")
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f"{path} does not exist.")
+        file_format = options['format'] or ('jsonl' if path.suffix in ('.jsonl', '.json') else 'csv')
+        batch_size = max(1, options['batch_size'])
+        self.upsert = options['upsert']
+        self.rejects_path = Path(options['rejects'] or f"{path}.rejects.csv")
+        self.rejects_file = self.rejects_writer = None
+        self.counts = {'read': 0, 'created': 0, 'topped_up': 0, 'rejected': 0}
+        # Phones and membership numbers already taken by earlier rows of this file
+        self.seen_phones, self.seen_numbers = set(), set()
+
+        started = time.perf_counter()
+        batch = []
+        try:
+            for line_number, row in self.read(path, file_format):
+                self.counts['read'] += 1
+                batch.append((line_number, row))
+                if len(batch) >= batch_size:
+                    self.import_batch(batch)
+                    batch = []
+            if batch:
+                self.import_batch(batch)
+        finally:
+            if self.rejects_file:
+                self.rejects_file.close()
+        elapsed = time.perf_counter() - started
+
+        rate = self.counts['read'] / elapsed if elapsed else 0
+        self.stdout.write(
+            f"Read {self.counts['read']} rows in {elapsed:.2f}s ({rate:.0f} rows/s): "
+            f"{self.counts['created']} created, {self.counts['topped_up']} topped up, "
+            f"{self.counts['rejected']} rejected."
+        )
+        if self.counts['rejected']:
+            self.stdout.write(self.style.WARNING(f"Rejected rows written to {self.rejects_path}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("All rows imported."))
+
+    def read(self, path, file_format):
+        """Yield (line_number, row_dict) pairs without loading the whole file."""
+        with open(path, newline='', encoding='utf-8') as handle:
+            if file_format == 'csv':
+                reader = csv.DictReader(handle)
+                for row in reader:
+                    yield reader.line_num, row
+            else:
+                for line_number, line in enumerate(handle, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        row = None
+                    yield line_number, row if isinstance(row, dict) else None
+
+    def reject(self, line_number, row, reason):
+        """Record a rejected row in the rejects file, opening it on first use."""
+        if self.rejects_writer is None:
+            self.rejects_file = open(self.rejects_path, 'w', newline='', encoding='utf-8')
+            self.rejects_writer = csv.writer(self.rejects_file)
+            self.rejects_writer.writerow(['line'] + FIELDS + ['reason'])
+        row = row or {}
+        self.rejects_writer.writerow([line_number] + [row.get(field, '') for field in FIELDS] + [reason])
+        self.counts['rejected'] += 1
+
+    def import_batch(self, batch):
+        """Validate a batch of rows, check it against the database in one query, and save it in one transaction."""
+        valid = []
+        for line_number, row in batch:
+            if row is None:
+                self.reject(line_number, row, "Not a valid row.")
+                continue
+            form = StudentImportForm({field: str(row.get(field, '')).strip() for field in FIELDS})
+            if not form.is_valid():
+                reason = "; ".join(f"{field}: {' '.join(errors)}" for field, errors in form.errors.items())
+                self.reject(line_number, row, reason)
+                continue
+            valid.append((line_number, row, form.cleaned_data))
+        if not valid:
+            return
+
+        # One query finds every existing student sharing a phone or membership number with the batch
+        phones = {data['phone'] for _, _, data in valid}
+        numbers = {data['membership_number'] for _, _, data in valid}
+        existing = list(Student.objects.filter(Q(phone__in=phones) | Q(membership_number__in=numbers)))
+        by_phone = {student.phone: student for student in existing}
+        by_number = {student.membership_number: student for student in existing}
+
+        new_students, purchases, top_ups = [], [], {}
+        for line_number, row, data in valid:
+            phone, number = data['phone'], data['membership_number']
+            member = by_number.get(number)
+            if member and self.upsert:
+                if phone in by_phone and by_phone[phone].pk != member.pk:
+                    self.reject(line_number, row, "Phone already belongs to another member.")
+                    continue
+                top_ups[member.pk] = top_ups.get(member.pk, 0) + data['classes_left']
+            elif member:
+                self.reject(line_number, row, "Membership number already exists.")
+            elif phone in by_phone or phone in self.seen_phones:
+                self.reject(line_number, row, "Phone already exists.")
+            elif number in self.seen_numbers:
+                self.reject(line_number, row, "Membership number appears earlier in the file.")
+            else:
+                self.seen_phones.add(phone)
+                self.seen_numbers.add(number)
+                # The classes go on the credit ledger once the student has an id
+                new_students.append(Student(**dict(data, classes_left=0)))
+                purchases.append(data['classes_left'])
+
+        with transaction.atomic():
+            Student.objects.bulk_create(new_students)
+            # One multi-row insert appends every purchase and top-up to the credit ledger
+            append_credits(
+                [(student.pk, CreditEntry.PURCHASE, classes, "Imported") for student, classes in zip(new_students, purchases)]
+                + [(pk, CreditEntry.PURCHASE, classes, "Imported top-up") for pk, classes in top_ups.items()]
+            )
+            # bulk_create and the ledger inserts send no signals, so mark the pages as changed here
+            if new_students or top_ups:
+                touch(STUDENTS, *[student_scope(pk) for pk in top_ups])
+        self.counts['created'] += len(new_students)
+        self.counts['topped_up'] += len(top_ups)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from studio.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the occupancy and monthly attendance rollups from live and archived attendance."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-per-batch', type=int, default=1,
+            help="How many months of attendance to recount per transaction (default: 1).",
+        )
+
+    def handle(self, *args, **options):
+        batches = rebuild_rollups(
+            months_per_batch=max(1, options['months_per_batch']),
+            log=lambda message: self.stdout.write(message),
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rollups in {batches} batch(es)."))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from studio.credits import backfill_openings, find_discrepancies
+
+
+class Command(BaseCommand):
+    help = (
+        "Give students from before the credit ledger an opening entry for the classes they had, "
+        "then check every running balance and snapshot in the ledger adds up."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Students backfilled per statement (default: 5000).")
+        parser.add_argument('--dry-run', action='store_true', help="Only check the ledger, writing no opening entries.")
+        parser.add_argument('--limit', type=int, default=20, help="How many problems to list (default: 20).")
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            written = backfill_openings(batch_size=max(1, options['batch_size']), log=self.stdout.write)
+            self.stdout.write(f"Wrote {written} opening entries.")
+
+        problems = 0
+        for student_id, seq, problem in find_discrepancies():
+            problems += 1
+            if problems <= options['limit']:
+                self.stdout.write(self.style.WARNING(f"Student {student_id}, entry #{seq}: {problem}"))
+        if problems:
+            self.stdout.write(self.style.ERROR(f"Found {problems} problem(s) in the credit ledger."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Every balance in the credit ledger adds up."))
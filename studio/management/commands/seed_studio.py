@@ -0,0 +1,38 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from studio.benchmarks import SEED_END_DATE, seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the configured database with generated students, classes and years of attendance "
+        "for load testing. Do not run this against a production database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=1000, help="Number of students (default: 1000).")
+        parser.add_argument('--classes', type=int, default=20, help="Number of dance classes (default: 20).")
+        parser.add_argument('--years', type=int, default=1, help="Years of attendance history (default: 1).")
+        parser.add_argument('--visits-per-week', type=float, default=2, help="Average visits per student per week (default: 2).")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, so data sets are reproducible (default: 0).")
+        parser.add_argument(
+            '--end', type=datetime.date.fromisoformat, default=SEED_END_DATE,
+            help=f"Last day of attendance (YYYY-MM-DD; default: {SEED_END_DATE}).",
+        )
+
+    def handle(self, *args, **options):
+        counts = seed(
+            students=options['students'],
+            classes=options['classes'],
+            years=options['years'],
+            visits_per_week=options['visits_per_week'],
+            seed=options['seed'],
+            end=options['end'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Database now has {counts['students']} students, {counts['classes']} classes "
+            f"and {counts['attendance']} attendance records."
+        ))
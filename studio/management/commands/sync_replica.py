@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from studio.db import replica_enabled, sync_replica
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database to the read replica file (set STUDIO_READ_REPLICA to enable the replica)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help="Keep copying every this many seconds instead of once.")
+
+    def handle(self, *args, **options):
+        if not replica_enabled():
+            raise CommandError("No 'replica' database is configured; set STUDIO_READ_REPLICA.")
+        while True:
+            started = time.perf_counter()
+            sync_replica()
+            self.stdout.write(f"Replica refreshed in {time.perf_counter() - started:.2f}s")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
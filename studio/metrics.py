@@ -0,0 +1,102 @@
+import threading
+
+# This module keeps per-view performance metrics in process memory and renders them in the
+# Prometheus text exposition format for the /metrics endpoint.
+# Each worker process has its own registry; Prometheus adds them up across scrape targets.
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class ViewStats:
+    """Running totals for one view."""
+    def __init__(self):
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.requests = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.n_plus_one = 0
+
+
+class MetricsRegistry:
+    """Thread-safe collection of ViewStats keyed by view name, plus free-form counters."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+        self._counters = {}
+
+    def observe(self, view, seconds, queries, sql_seconds, n_plus_one=False):
+        """Record one request handled by `view`."""
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = ViewStats()
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats.bucket_counts[index] += 1
+                    break
+            stats.requests += 1
+            stats.seconds += seconds
+            stats.queries += queries
+            stats.sql_seconds += sql_seconds
+            stats.n_plus_one += bool(n_plus_one)
+
+    def increment(self, name, amount=1, **labels):
+        """Add `amount` to a counter identified by `name` and its labels."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def counter(self, name, **labels):
+        """Current value of a counter."""
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+            self._counters.clear()
+
+    def render(self):
+        """Render every metric in the Prometheus text format."""
+        with self._lock:
+            views = sorted(self._views.items())
+            counters = sorted(self._counters.items())
+
+        lines = [
+            '# HELP studio_request_duration_seconds Time spent handling requests, by view.',
+            '# TYPE studio_request_duration_seconds histogram',
+        ]
+        for view, stats in views:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.bucket_counts):
+                cumulative += count
+                lines.append(f'studio_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+            lines.append(f'studio_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {stats.requests}')
+            lines.append(f'studio_request_duration_seconds_sum{{view="{view}"}} {stats.seconds:.6f}')
+            lines.append(f'studio_request_duration_seconds_count{{view="{view}"}} {stats.requests}')
+
+        for name, help_text, attribute in (
+            ('studio_db_queries_total', 'ORM queries executed, by view.', 'queries'),
+            ('studio_db_query_seconds_total', 'Time spent in SQL, by view.', 'sql_seconds'),
+            ('studio_n_plus_one_requests_total', 'Requests that repeated the same query many times, by view.', 'n_plus_one'),
+        ):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for view, stats in views:
+                value = getattr(stats, attribute)
+                value = f'{value:.6f}' if isinstance(value, float) else value
+                lines.append(f'{name}{{view="{view}"}} {value}')
+
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                lines.append(f'# TYPE {name} counter')
+                declared.add(name)
+            label_text = ','.join(f'{key}="{label}"' for key, label in labels)
+            lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# The registry shared by the middleware, the metrics view and anything else that counts things
+registry = MetricsRegistry()
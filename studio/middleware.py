@@ -0,0 +1,195 @@
+import contextlib
+import contextvars
+import logging
+import time
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseNotModified
+
+from .metrics import registry
+from .staticfiles import load_static_files
+
+logger = logging.getLogger('studio.performance')
+
+
+class QueryRecorder:
+    """
+    A database execute wrapper that counts queries and the time spent in them.
+    It also counts how often each SQL statement repeats, since the same statement run many
+    times in one request (with different parameters) is the signature of an N+1 query loop.
+    """
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] = self.statements.get(sql, 0) + 1
+
+    def repeated_statement(self, threshold):
+        """Return (sql, times) for the most repeated statement if it ran at least `threshold` times."""
+        if not self.statements:
+            return None
+        sql, times = max(self.statements.items(), key=lambda item: item[1])
+        return (sql, times) if times >= threshold else None
+
+
+# The QueryRecorder of the request being served. Context variables follow a request onto the
+# worker threads that sync_to_async and the async ORM run its queries on, where the connections
+# (which belong to each thread) are not the ones the middleware itself could reach
+_current_recorder = contextvars.ContextVar('query_recorder', default=None)
+
+
+def record_queries(execute, sql, params, many, context):
+    """Execute wrapper on every connection: hand the query to the current request's recorder, if any."""
+    recorder = _current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver: put record_queries on each connection, in whichever thread opens it."""
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+class PerformanceMiddleware:
+    """
+    Record each request's latency, query count and SQL time per view in studio.metrics,
+    flag likely N+1 query loops, and optionally report timings in a Server-Timing header.
+    It runs natively under ASGI too, so async views are not pushed onto a worker thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with self._recording(recorder):
+            response = self.get_response(request)
+        return self._finish(request, response, recorder, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        # The async ORM and sync_to_async run the queries on worker threads, with their own
+        # connections; the recorder reaches them through the request's context (see record_queries)
+        with self._recording(recorder):
+            response = await self.get_response(request)
+        return self._finish(request, response, recorder, time.perf_counter() - started)
+
+    @contextlib.contextmanager
+    def _recording(self, recorder):
+        token = _current_recorder.set(recorder)
+        try:
+            yield
+        finally:
+            _current_recorder.reset(token)
+
+    def _finish(self, request, response, recorder, elapsed):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        repeated = recorder.repeated_statement(getattr(settings, 'STUDIO_N_PLUS_ONE_THRESHOLD', 10))
+        if repeated:
+            logger.warning("Possible N+1 queries in %s: ran %d times: %s", view, repeated[1], repeated[0])
+        registry.observe(view, elapsed, recorder.count, recorder.seconds, n_plus_one=bool(repeated))
+
+        if getattr(settings, 'STUDIO_SERVER_TIMING', False):
+            response['Server-Timing'] = (
+                f'db;dur={recorder.seconds * 1000:.1f};desc="{recorder.count} queries", '
+                f'total;dur={elapsed * 1000:.1f}'
+            )
+        return response
+
+
+def accepted_encodings(header):
+    """The content codings an Accept-Encoding header allows, ignoring any it gives q=0."""
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        try:
+            quality = float(params.strip().removeprefix('q=')) if params.strip() else 1.0
+        except ValueError:
+            quality = 1.0
+        if coding.strip() and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticFilesMiddleware:
+    """
+    Serve the files "manage.py collectstatic" prepared (see studio.staticfiles) straight from
+    memory, picking the brotli or gzip copy the browser accepts.
+    Content-hashed names never change, so they are cached for a year as immutable and a
+    repeat page load fetches nothing; plain names must be revalidated, and get 304 while
+    unchanged. Put it first in MIDDLEWARE so static requests skip sessions and the rest.
+    """
+    sync_capable = True
+    async_capable = True
+    # Preferred first: brotli is smaller than gzip
+    ENCODINGS = ('br', 'gzip')
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'STUDIO_STATIC_PIPELINE', False):
+            raise MiddlewareNotUsed
+        prefix = urlsplit(settings.STATIC_URL)
+        if prefix.netloc:
+            raise MiddlewareNotUsed  # Static files live on another host
+        self.files = load_static_files()
+        if self.files is None:
+            logger.warning("Static files are not collected; run 'manage.py collectstatic'.")
+            raise MiddlewareNotUsed
+        self.prefix = '/' + prefix.path.lstrip('/')
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.serve(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.serve(request) or await self.get_response(request)
+
+    def serve(self, request):
+        """The response for a collected static file, or None if the request is for something else."""
+        if request.method not in ('GET', 'HEAD') or not request.path_info.startswith(self.prefix):
+            return None
+        entry = self.files.get(request.path_info[len(self.prefix):])
+        if entry is None:
+            return None
+
+        bodies = entry['bodies']
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        encoding = next((encoding for encoding in self.ENCODINGS if encoding in bodies and encoding in accepted), 'identity')
+        etag = f'"{entry["etag"]}-{encoding}"'
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(b'' if request.method == 'HEAD' else bodies[encoding], content_type=entry['type'])
+            response['Content-Length'] = len(bodies[encoding])
+            if encoding != 'identity':
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        if len(bodies) > 1:
+            response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = 'public, max-age=31536000, immutable' if entry['immutable'] else 'public, no-cache'
+        return response
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_occupancy(apps, schema_editor):
+    """Count the attendance already logged for each class and day."""
+    Attendance = apps.get_model("studio", "Attendance")
+    ClassOccupancy = apps.get_model("studio", "ClassOccupancy")
+    counts = (
+        Attendance.objects.values("dance_class_id", "date")
+        .annotate(checked_in=Count("id"))
+        .order_by()
+    )
+    ClassOccupancy.objects.bulk_create(
+        (ClassOccupancy(**row) for row in counts.iterator()), batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studio", "0003_student_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ClassOccupancy",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("date", models.DateField()),
+                ("checked_in", models.PositiveIntegerField(default=0)),
+                ("dance_class", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="studio.danceclass")),
+            ],
+            options={
+                "verbose_name_plural": "class occupancies",
+                "unique_together": {("dance_class", "date")},
+            },
+        ),
+        migrations.RunPython(backfill_occupancy, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+
+def backfill_monthly_attendance(apps, schema_editor):
+    """Count the attendance already logged for each student and month."""
+    Attendance = apps.get_model("studio", "Attendance")
+    StudentMonthlyAttendance = apps.get_model("studio", "StudentMonthlyAttendance")
+    counts = (
+        Attendance.objects.annotate(month=TruncMonth("date"))
+        .values("student_id", "month")
+        .annotate(visits=Count("id"))
+        .order_by()
+    )
+    StudentMonthlyAttendance.objects.bulk_create(
+        (StudentMonthlyAttendance(**row) for row in counts.iterator()), batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studio", "0004_class_occupancy"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StudentMonthlyAttendance",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("month", models.DateField()),
+                ("visits", models.PositiveIntegerField(default=0)),
+                ("student", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="studio.student")),
+            ],
+            options={
+                "verbose_name_plural": "student monthly attendance",
+                "unique_together": {("student", "month")},
+            },
+        ),
+        migrations.RunPython(backfill_monthly_attendance, migrations.RunPython.noop),
+    ]
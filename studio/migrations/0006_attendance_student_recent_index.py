@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studio", "0005_student_monthly_attendance"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="attendance",
+            index=models.Index(fields=["student", "-date", "-time"], name="attendance_student_recent_idx"),
+        ),
+    ]
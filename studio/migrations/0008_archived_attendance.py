@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studio", "0007_export_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedAttendance",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("date", models.DateField()),
+                ("time", models.TimeField()),
+                ("dance_class", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="studio.danceclass")),
+                ("student", models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to="studio.student")),
+            ],
+            options={
+                "verbose_name_plural": "archived attendance",
+                "indexes": [models.Index(fields=["student", "-date", "-time"], name="archived_student_recent_idx"), models.Index(fields=["date"], name="archived_date_idx")],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studio", "0008_archived_attendance"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="archivedattendance",
+            name="archived_date_idx",
+        ),
+        migrations.AddIndex(
+            model_name="archivedattendance",
+            index=models.Index(fields=["date", "id"], name="archived_date_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="attendance",
+            index=models.Index(fields=["date"], name="attendance_date_idx"),
+        ),
+    ]
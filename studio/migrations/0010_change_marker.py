@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studio", "0009_attendance_date_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChangeMarker",
+            fields=[
+                ("scope", models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ("version", models.PositiveBigIntegerField(default=0)),
+                ("modified", models.DateTimeField()),
+            ],
+        ),
+    ]
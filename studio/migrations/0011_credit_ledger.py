@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from studio.search import create_search_index
+
+
+def restore_search_index(apps, schema_editor):
+    # Adding or removing credits_seq rebuilds studio_student on SQLite, which drops the search triggers
+    create_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studio", "0010_change_marker"),
+    ]
+
+    operations = [
+        # Runs last when migrating backwards, after credits_seq is removed again
+        migrations.RunPython(migrations.RunPython.noop, restore_search_index),
+        migrations.AddField(
+            model_name="student",
+            name="credits_seq",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(restore_search_index, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name="CreditEntry",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("seq", models.PositiveIntegerField()),
+                ("kind", models.CharField(choices=[("opening", "Opening balance"), ("purchase", "Purchase"), ("check_in", "Check-in"), ("adjustment", "Adjustment")], max_length=12)),
+                ("delta", models.IntegerField()),
+                ("balance", models.PositiveIntegerField()),
+                ("note", models.CharField(blank=True, max_length=200)),
+                ("created_at", models.DateTimeField()),
+                ("dance_class", models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to="studio.danceclass")),
+                ("student", models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to="studio.student")),
+            ],
+            options={
+                "verbose_name_plural": "credit entries",
+                "constraints": [models.UniqueConstraint(fields=("student", "seq"), name="credit_entry_student_seq")],
+            },
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 class DanceClass(models.Model):
     '''This model represents a dance class with fields for name, style, level, description, schedule, and maximum number of students.'''
@@ -33,7 +34,16 @@ class Student(models.Model):
     name = models.CharField(max_length=100)
     phone = models.CharField(max_length=15, unique=True)
     membership_number = models.CharField(max_length=20, unique=True)
+    # Classes left as of ledger entry `credits_seq`: a snapshot that compact_credits brings up to date.
+    # The current balance adds the CreditEntry deltas after it (see studio.credits.with_balance)
     classes_left = models.PositiveIntegerField(default=0)
+    credits_seq = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        '''Meta class to index the (name, id) ordering used by the paginated student list.'''
+        indexes = [
+            models.Index(fields=['name', 'id'], name='student_name_id_idx'),
+        ]
 
     def __str__(self):
         '''Returns a string representation of the student, including their name and membership number.'''
@@ -47,9 +57,151 @@ class Attendance(models.Model):
     time = models.TimeField(auto_now_add=True)
 
     class Meta:
-        '''Meta class to define unique constraints for the Attendance model.''' c
+        '''Meta class to define unique constraints and indexes for the Attendance model.'''
         unique_together = ('student', 'dance_class', 'date')
+        indexes = [
+            # Matches the newest-first ordering of a student's attendance history
+            models.Index(fields=['student', '-date', '-time'], name='attendance_student_recent_idx'),
+            # Date filters and the admin's newest-first listing (the index also holds the id)
+            models.Index(fields=['date'], name='attendance_date_idx'),
+        ]
 
     def __str__(self):
         '''Returns a string representation of the attendance record, including the student's name, dance class name, date, and time.'''
-        return f"{self.student.name} - {self.dance_class.name} on {self.date} at {self.time}"
\ No newline at end of file
+        return f"{self.student.name} - {self.dance_class.name} on {self.date} at {self.time}"
+
+class ClassOccupancy(models.Model):
+    '''This model keeps a running count of check-ins for each dance class on each day, so capacity can be checked with a single row read.'''
+    dance_class = models.ForeignKey(DanceClass, on_delete=models.CASCADE)
+    date = models.DateField()
+    checked_in = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        '''Meta class to define unique constraints for the ClassOccupancy model.'''
+        unique_together = ('dance_class', 'date')
+        verbose_name_plural = 'class occupancies'
+
+    def __str__(self):
+        '''Returns a string representation of the occupancy, including the class name, date and head count.'''
+        return f"{self.dance_class.name} on {self.date}: {self.checked_in}/{self.dance_class.max_students}"
+
+
+class StudentMonthlyAttendance(models.Model):
+    '''This model keeps a running count of each student's check-ins per calendar month, for reporting without scanning Attendance.'''
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    month = models.DateField()  # Always the first day of the month
+    visits = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        '''Meta class to define unique constraints for the StudentMonthlyAttendance model.'''
+        unique_together = ('student', 'month')
+        verbose_name_plural = 'student monthly attendance'
+
+    def __str__(self):
+        '''Returns a string representation of the rollup, including the student's name, month and visit count.'''
+        return f"{self.student.name} in {self.month:%B %Y}: {self.visits}"
+
+
+class ExportJob(models.Model):
+    '''This model tracks an attendance export being built in the background, and the file it produced, so repeat requests can be served from disk.'''
+    PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('csv.gz', 'CSV (gzip)'),
+        ('parquet', 'Parquet'),
+    ]
+
+    key = models.CharField(max_length=64, db_index=True)  # Hash of the filters and format
+    watermark = models.CharField(max_length=64)  # State of the attendance table when the job was requested
+    filters = models.JSONField(default=dict)
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='csv')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    rows_written = models.PositiveIntegerField(default=0)
+    total_rows = models.PositiveIntegerField(null=True, blank=True)
+    file = models.CharField(max_length=255, blank=True)  # Path of the finished file
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        '''Returns a string representation of the job, including its format and status.'''
+        return f"Export {self.pk} ({self.format}): {self.status}"
+
+    @property
+    def progress(self):
+        '''Returns the percentage of rows written so far, or None while the total is unknown.'''
+        if self.status == self.DONE:
+            return 100
+        if not self.total_rows:
+            return None
+        return min(100, self.rows_written * 100 // self.total_rows)
+
+class ArchivedAttendance(models.Model):
+    '''This model holds attendance moved out of the Attendance table by the archive_attendance command, keeping each row's original id, so the live table stays small.'''
+    id = models.BigIntegerField(primary_key=True)  # The id the row had in Attendance
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, db_index=False)  # Covered by the index below
+    dance_class = models.ForeignKey(DanceClass, on_delete=models.CASCADE)
+    date = models.DateField()
+    time = models.TimeField()
+
+    class Meta:
+        '''Meta class to index the archive for attendance history pages and date-range exports.'''
+        indexes = [
+            models.Index(fields=['student', '-date', '-time'], name='archived_student_recent_idx'),
+            # The id is not SQLite's rowid here, so it is indexed explicitly for ordering by (date, id)
+            models.Index(fields=['date', 'id'], name='archived_date_id_idx'),
+        ]
+        verbose_name_plural = 'archived attendance'
+
+    def __str__(self):
+        '''Returns a string representation of the archived record, including the student's name, dance class name, date, and time.'''
+        return f"{self.student.name} - {self.dance_class.name} on {self.date} at {self.time} (archived)"
+
+class ChangeMarker(models.Model):
+    '''This model records when something the pages show last changed, so views can answer conditional GETs without re-running their queries.'''
+    scope = models.CharField(max_length=40, primary_key=True)  # 'students', 'classes' or 'student:<id>'
+    version = models.PositiveBigIntegerField(default=0)
+    modified = models.DateTimeField()
+
+    def __str__(self):
+        '''Returns a string representation of the marker, including its scope and version.'''
+        return f"{self.scope} v{self.version}"
+
+class CreditEntry(models.Model):
+    '''This model is the append-only ledger of a student's classes: purchases, check-in debits and adjustments, each with the balance it left, so every change to a balance can be traced.'''
+    OPENING, PURCHASE, CHECK_IN, ADJUSTMENT = 'opening', 'purchase', 'check_in', 'adjustment'
+    KIND_CHOICES = [
+        (OPENING, 'Opening balance'),
+        (PURCHASE, 'Purchase'),
+        (CHECK_IN, 'Check-in'),
+        (ADJUSTMENT, 'Adjustment'),
+    ]
+
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, db_index=False)  # Covered by the unique index below
+    seq = models.PositiveIntegerField()  # 1, 2, 3... per student; 0 for a balance carried over from before the ledger
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES)
+    delta = models.IntegerField()  # Classes added (positive) or spent (negative)
+    balance = models.PositiveIntegerField()  # Classes left after this entry
+    dance_class = models.ForeignKey(DanceClass, null=True, blank=True, on_delete=models.SET_NULL)  # The class a check-in paid for
+    note = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        '''Meta class to number each student's entries uniquely, which also indexes the latest entry and the running balance.'''
+        constraints = [
+            # Two desks appending to the same ledger at once can't both take the next number
+            models.UniqueConstraint(fields=['student', 'seq'], name='credit_entry_student_seq'),
+        ]
+        verbose_name_plural = 'credit entries'
+
+    def __str__(self):
+        '''Returns a string representation of the entry, including the student's name, the change and the balance after it.'''
+        return f"{self.student.name} #{self.seq}: {self.delta:+d} ({self.get_kind_display()}), {self.balance} left"
@@ -0,0 +1,169 @@
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+# This module implements keyset (cursor) pagination for the studio views.
+# Instead of OFFSET, each page remembers the ordering values of its first and last rows,
+# and the next query asks for rows strictly after (or before) them, so the database can
+# seek straight to the page through an index no matter how deep into the list we are.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def get_page_size(request):
+    """Read the page size from the query string, falling back to settings and capping it."""
+    default = getattr(settings, 'STUDIO_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    maximum = getattr(settings, 'STUDIO_MAX_PAGE_SIZE', MAX_PAGE_SIZE)
+    try:
+        page_size = int(request.GET.get('page_size', default))
+    except ValueError:
+        page_size = default
+    return max(1, min(page_size, maximum))
+
+
+def encode_cursor(values):
+    """Turn a list of ordering values into an opaque, URL-safe token."""
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _ordering_field(model, path):
+    """The model field an ordering name such as 'date' or 'student__name' refers to."""
+    *relations, name = path.lstrip('-').split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
+
+
+def decode_cursor(token, ordering, model):
+    """
+    Turn a token back into ordering values, each converted by its field on `model`, or None if it
+    is missing or malformed. Cursors arrive in the URL, so a tampered or stale one just means
+    "no cursor", never an error.
+    """
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(ordering):
+        return None
+    try:
+        values = [_ordering_field(model, field).to_python(value) for field, value in zip(ordering, values)]
+    except (ValueError, TypeError, ValidationError, FieldDoesNotExist):
+        return None
+    # None can't be compared with, and the ordering fields never hold it
+    return None if any(value is None for value in values) else values
+
+
+class KeysetPage:
+    """One page of results plus the cursors pointing at its neighbours."""
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_other_pages(self):
+        return bool(self.next_cursor or self.previous_cursor)
+
+
+def _seek_filter(ordering, values, reverse):
+    """
+    Build the WHERE clause for "rows after these values" in the given ordering, e.g. for
+    ('name', 'id'): name > v1 OR (name = v1 AND id > v2).
+    """
+    condition = Q()
+    equal_so_far = Q()
+    for field, value in zip(ordering, values):
+        descending = field.startswith('-')
+        name = field.lstrip('-')
+        lookup = 'lt' if descending != reverse else 'gt'
+        condition |= equal_so_far & Q(**{f'{name}__{lookup}': value})
+        equal_so_far &= Q(**{name: value})
+    # The redundant bound on the first field lets the database seek to the cursor through an index
+    first = ordering[0]
+    bound = 'lte' if first.startswith('-') != reverse else 'gte'
+    return Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & condition
+
+
+def _sort(rows, ordering):
+    """Sort model instances by `ordering` in Python, one stable pass per field, last field first."""
+    for field in reversed(ordering):
+        rows.sort(key=lambda obj: getattr(obj, field.lstrip('-')), reverse=field.startswith('-'))
+    return rows
+
+
+def _page_queries(queryset, ordering, request, page_size):
+    """
+    Work out the queries for one page: returns (querysets, backwards, has_cursor, page_size),
+    where each queryset is already filtered past the cursor, ordered and limited.
+    """
+    page_size = page_size or get_page_size(request)
+    querysets = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+    model = querysets[0].model
+    after = decode_cursor(request.GET.get('after'), ordering, model)
+    before = decode_cursor(request.GET.get('before'), ordering, model) if after is None else None
+
+    if before is not None:
+        # Walk backwards from the cursor using the reversed ordering; the rows are flipped back later
+        reversed_ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+        return [
+            source.filter(_seek_filter(ordering, before, reverse=True)).order_by(*reversed_ordering)[:page_size + 1]
+            for source in querysets
+        ], True, True, page_size
+    if after is not None:
+        querysets = [source.filter(_seek_filter(ordering, after, reverse=False)) for source in querysets]
+    return [source.order_by(*ordering)[:page_size + 1] for source in querysets], False, after is not None, page_size
+
+
+def _build_page(results, ordering, backwards, has_cursor, page_size):
+    """Merge the rows each query returned into a KeysetPage."""
+    rows = [obj for result in results for obj in result]
+    if len(results) > 1:
+        rows = _sort(rows, [field[1:] if field.startswith('-') else f'-{field}' for field in ordering] if backwards else ordering)
+    rows = rows[:page_size + 1]
+    if backwards:
+        has_previous, has_next = len(rows) > page_size, True
+        items = rows[:page_size][::-1]
+    else:
+        has_previous, has_next = has_cursor, len(rows) > page_size
+        items = rows[:page_size]
+
+    def cursor_for(obj):
+        return encode_cursor([getattr(obj, field.lstrip('-')) for field in ordering])
+
+    return KeysetPage(
+        items,
+        next_cursor=cursor_for(items[-1]) if items and has_next else None,
+        previous_cursor=cursor_for(items[0]) if items and has_previous else None,
+    )
+
+
+def keyset_paginate(queryset, ordering, request, page_size=None):
+    """
+    Return a KeysetPage of `queryset` ordered by `ordering` (a list of field names,
+    prefixed with '-' for descending, ending with a unique field such as 'id').
+    The page position is read from the `after` or `before` query parameter.
+    `queryset` may also be a list of querysets over models with the same ordering fields
+    (e.g. live and archived attendance); each is read up to one page and the rows are merged.
+    """
+    querysets, backwards, has_cursor, page_size = _page_queries(queryset, ordering, request, page_size)
+    return _build_page([list(source) for source in querysets], ordering, backwards, has_cursor, page_size)
+
+
+async def akeyset_paginate(queryset, ordering, request, page_size=None):
+    """The same as keyset_paginate(), reading the rows through the async ORM, for async views."""
+    querysets, backwards, has_cursor, page_size = _page_queries(queryset, ordering, request, page_size)
+    return _build_page([[obj async for obj in source] for source in querysets], ordering, backwards, has_cursor, page_size)
@@ -0,0 +1,118 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q
+from django.db.models.functions import TruncMonth
+
+from .models import Attendance, ArchivedAttendance, ClassOccupancy, StudentMonthlyAttendance
+
+# This module maintains the reporting rollups:
+#   - ClassOccupancy: check-ins per dance class per day (also used to enforce capacity), and
+#   - StudentMonthlyAttendance: check-ins per student per calendar month.
+# Totals per style or level are summed from ClassOccupancy joined to the small DanceClass table.
+# The check-in engine updates both tables with upserts in the same transaction as the attendance
+# insert; attendance written through the ORM is covered by the receivers in studio.signals.
+# rebuild_rollups() recomputes everything from Attendance and ArchivedAttendance (archived visits
+# still count towards the totals), one month per transaction.
+
+
+def month_start(date):
+    """Return the first day of `date`'s month."""
+    return date.replace(day=1)
+
+
+def next_month(date):
+    """Return the first day of the month after `date`'s month."""
+    return (date.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def monthly_upsert_sql():
+    """SQL that adds %s visits to a student's count for a month. Parameters: student_id, month, visits."""
+    table = StudentMonthlyAttendance._meta.db_table
+    return (
+        f"INSERT INTO {table} (student_id, month, visits) VALUES (%s, %s, %s) "
+        f"ON CONFLICT (student_id, month) DO UPDATE SET visits = {table}.visits + excluded.visits"
+    )
+
+
+def monthly_params(connection, student_id, date, visits=1):
+    """Parameters for monthly_upsert_sql()."""
+    return [student_id, connection.ops.adapt_datefield_value(month_start(date)), visits]
+
+
+def adjust_occupancy(dance_class_id, date, delta):
+    """Add `delta` (positive or negative) to a class's check-in counter for a day."""
+    updated = ClassOccupancy.objects.filter(dance_class_id=dance_class_id, date=date).update(
+        checked_in=F('checked_in') + delta
+    )
+    if not updated and delta > 0:
+        ClassOccupancy.objects.create(dance_class_id=dance_class_id, date=date, checked_in=delta)
+
+
+def adjust_monthly_visits(student_id, date, delta):
+    """Add `delta` (positive or negative) to a student's visit count for the month of `date`."""
+    month = month_start(date)
+    updated = StudentMonthlyAttendance.objects.filter(student_id=student_id, month=month).update(
+        visits=F('visits') + delta
+    )
+    if not updated and delta > 0:
+        StudentMonthlyAttendance.objects.create(student_id=student_id, month=month, visits=delta)
+
+
+def _grouped_counts(start, end, fields, **annotations):
+    """Count live and archived attendance in [start, end), grouped by `fields`; returns {values: count}."""
+    counts = {}
+    for model in (Attendance, ArchivedAttendance):
+        rows = (model.objects.filter(date__gte=start, date__lt=end).annotate(**annotations)
+                .values_list(*fields).annotate(total=Count('id')).order_by())
+        for *values, total in rows:
+            counts[tuple(values)] = counts.get(tuple(values), 0) + total
+    return counts
+
+
+def rebuild_period(start, end):
+    """Recompute the rollups for dates in [start, end) from attendance. Call inside a transaction."""
+    ClassOccupancy.objects.filter(date__gte=start, date__lt=end).delete()
+    ClassOccupancy.objects.bulk_create(
+        ClassOccupancy(dance_class_id=dance_class_id, date=date, checked_in=total)
+        for (dance_class_id, date), total in _grouped_counts(start, end, ['dance_class_id', 'date']).items()
+    )
+
+    StudentMonthlyAttendance.objects.filter(month__gte=start, month__lt=end).delete()
+    StudentMonthlyAttendance.objects.bulk_create(
+        StudentMonthlyAttendance(student_id=student_id, month=month, visits=total)
+        for (student_id, month), total in
+        _grouped_counts(start, end, ['student_id', 'month'], month=TruncMonth('date')).items()
+    )
+
+
+def rebuild_rollups(months_per_batch=1, log=None):
+    """
+    Rebuild all rollups from live and archived attendance, committing one batch of months at a
+    time so check-ins can carry on in between. Returns the number of batches processed.
+    """
+    bounds = [model.objects.aggregate(first=Min('date'), last=Max('date')) for model in (Attendance, ArchivedAttendance)]
+    firsts = [bound['first'] for bound in bounds if bound['first'] is not None]
+    if not firsts:
+        ClassOccupancy.objects.all().delete()
+        StudentMonthlyAttendance.objects.all().delete()
+        return 0
+
+    first, last = month_start(min(firsts)), max(bound['last'] for bound in bounds if bound['last'] is not None)
+    # Rollups outside the range of any attendance are left over from deleted rows
+    ClassOccupancy.objects.filter(Q(date__lt=first) | Q(date__gt=last)).delete()
+    StudentMonthlyAttendance.objects.filter(Q(month__lt=first) | Q(month__gt=last)).delete()
+
+    batches = 0
+    start = first
+    while start <= last:
+        end = start
+        for _ in range(months_per_batch):
+            end = next_month(end)
+        with transaction.atomic():
+            rebuild_period(start, end)
+        batches += 1
+        if log:
+            log(f"Rebuilt rollups for {start:%Y-%m} to {end - datetime.timedelta(days=1):%Y-%m}")
+        start = end
+    return batches
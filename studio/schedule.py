@@ -0,0 +1,169 @@
+import bisect
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from .models import DanceClass
+
+# This module turns the free-text DanceClass.schedule field into a timetable held in memory,
+# so check-in can find the class that is running right now without querying the database.
+#
+# A schedule is one or more slots separated by ';', each naming some days and a start time,
+# optionally with an end time, for example:
+#     "Monday 17:00"
+#     "Mon/Wed 18:00-19:30"
+#     "Tue, Thu 7pm-8:30pm; Saturday 10am"
+#     "Weekdays 12:00-13:00"
+# Slots without an end time last STUDIO_DEFAULT_CLASS_MINUTES.
+#
+# The timetable is an interval index over the minutes of the week: slot windows (widened by the
+# grace periods) sorted by start, so a lookup is a binary search plus a short scan.
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+DAY_NAMES = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+DAY_GROUPS = {
+    'daily': range(7),
+    'everyday': range(7),
+    'weekdays': range(5),
+    'weekends': range(5, 7),
+}
+
+DAY_PATTERN = re.compile(r'\b(mon|tue|wed|thu|fri|sat|sun)[a-z]*\b')
+DAY_RANGE_PATTERN = re.compile(r'\b(mon|tue|wed|thu|fri|sat|sun)[a-z]*\s*(?:-|to)\s*(mon|tue|wed|thu|fri|sat|sun)[a-z]*\b')
+TIME_PATTERN = re.compile(r'\b(\d{1,2})(?:[:.](\d{2}))?\s*(am|pm)?\b')
+
+
+def _parse_time(match):
+    """Convert a TIME_PATTERN match into minutes after midnight, or None if it isn't a valid time."""
+    hour, minute, meridiem = int(match.group(1)), int(match.group(2) or 0), match.group(3)
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem == 'pm' else 0)
+    if hour > 23 or minute > 59:
+        return None
+    return hour * 60 + minute
+
+
+def parse_schedule(text, default_minutes=60):
+    """
+    Parse a schedule string into a list of (weekday, start_minute, end_minute) tuples,
+    where weekday 0 is Monday. Raises ValueError if a slot can't be understood.
+    """
+    slots = []
+    for part in (text or '').lower().split(';'):
+        part = part.strip()
+        if not part:
+            continue
+
+        days = set()
+        for group, group_days in DAY_GROUPS.items():
+            if re.search(rf'\b{group}\b', part):
+                days.update(group_days)
+                part = re.sub(rf'\b{group}\b', ' ', part)
+        for first, last in DAY_RANGE_PATTERN.findall(part):
+            first, last = DAY_NAMES.index(first), DAY_NAMES.index(last)
+            days.update(day % 7 for day in range(first, last + (7 if last < first else 0) + 1))
+        part = DAY_RANGE_PATTERN.sub(' ', part)
+        days.update(DAY_NAMES.index(day) for day in DAY_PATTERN.findall(part))
+        part = DAY_PATTERN.sub(' ', part)
+
+        times = [_parse_time(match) for match in TIME_PATTERN.finditer(part)]
+        if not days or not times or None in times or len(times) > 2:
+            raise ValueError(f"Could not understand schedule slot {part.strip()!r}")
+
+        start = times[0]
+        end = times[1] if len(times) == 2 else start + default_minutes
+        if end <= start:
+            end += MINUTES_PER_DAY  # The class runs past midnight
+        slots.extend((day, start, end) for day in sorted(days))
+    return slots
+
+
+class ScheduleIndex:
+    """An in-memory timetable of every DanceClass, answering "which class is on at this moment?"."""
+    def __init__(self, dance_classes, grace_before=0, grace_after=0, default_minutes=60):
+        windows = []
+        self.by_style_level = {}
+        for dance_class in sorted(dance_classes, key=lambda c: c.pk):
+            self.by_style_level.setdefault((dance_class.style, dance_class.level), dance_class)
+            try:
+                slots = parse_schedule(dance_class.schedule, default_minutes)
+            except ValueError:
+                continue  # Unparseable schedules are simply not part of the timetable
+            for day, start, end in slots:
+                start += day * MINUTES_PER_DAY
+                end += day * MINUTES_PER_DAY
+                windows.append((start - grace_before, end + grace_after, start, dance_class))
+
+        windows.sort(key=lambda window: (window[0], window[2], window[3].pk))
+        self._windows = windows
+        self._window_starts = [window[0] for window in windows]
+        # The longest window bounds how far back from a lookup we need to scan
+        self._max_span = max((window[1] - window[0] for window in windows), default=0)
+
+    def __len__(self):
+        return len(self._windows)
+
+    def _candidates(self, minute):
+        """Yield windows containing `minute`, where minute is measured from Monday 00:00."""
+        # Look at the week before and after too, for windows wrapping past Sunday midnight
+        for offset in (0, MINUTES_PER_WEEK, -MINUTES_PER_WEEK):
+            point = minute + offset
+            lo = bisect.bisect_left(self._window_starts, point - self._max_span)
+            hi = bisect.bisect_right(self._window_starts, point)
+            for window_start, window_end, start, dance_class in self._windows[lo:hi]:
+                if window_start <= point <= window_end:
+                    yield abs(point - start), start - offset, dance_class
+
+    def resolve(self, when):
+        """
+        Return the DanceClass scheduled at datetime `when`, or None.
+        When slots overlap, the class whose start time is closest to `when` wins.
+        """
+        minute = when.weekday() * MINUTES_PER_DAY + when.hour * 60 + when.minute
+        best = min(self._candidates(minute), key=lambda c: (c[0], c[1], c[2].pk), default=None)
+        return best[2] if best else None
+
+    def first_by_style_level(self, style, level):
+        """Return the lowest-id DanceClass with this style and level, or None."""
+        return self.by_style_level.get((style, level))
+
+
+_index = None
+_built_at = 0.0
+_lock = threading.Lock()
+
+
+def get_schedule_index():
+    """
+    Return the cached ScheduleIndex, building it from the database if needed.
+    Saving or deleting a DanceClass invalidates it (see studio.signals); the TTL also
+    catches changes made by other processes.
+    """
+    global _index, _built_at
+    ttl = getattr(settings, 'STUDIO_SCHEDULE_TTL', 300)
+    index = _index
+    if index is not None and time.monotonic() - _built_at < ttl:
+        return index
+    with _lock:
+        if _index is None or time.monotonic() - _built_at >= ttl:
+            _index = ScheduleIndex(
+                DanceClass.objects.all(),
+                grace_before=getattr(settings, 'STUDIO_CHECKIN_GRACE_BEFORE', 15),
+                grace_after=getattr(settings, 'STUDIO_CHECKIN_GRACE_AFTER', 15),
+                default_minutes=getattr(settings, 'STUDIO_DEFAULT_CLASS_MINUTES', 60),
+            )
+            _built_at = time.monotonic()
+        return _index
+
+
+def invalidate_schedule_index():
+    """Throw away the cached timetable so the next lookup rebuilds it."""
+    global _index
+    with _lock:
+        _index = None
@@ -0,0 +1,133 @@
+from django.db import connections, OperationalError
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Student
+
+# This module provides indexed student search for the front desk.
+# On SQLite, an FTS5 shadow table with the trigram tokenizer indexes Student.name, phone and
+# membership_number, so a substring search is an index lookup instead of a LIKE '%q%' table scan.
+# The shadow table is kept in sync by triggers on studio_student (see create_search_index),
+# which also covers bulk_create() and update() calls that never send model signals.
+# On other backends, or for queries too short for trigrams, we fall back to icontains filters.
+
+FTS_TABLE = 'studio_student_fts'
+
+# The trigram tokenizer can only match terms of at least three characters
+MIN_QUERY_LENGTH = 3
+
+# Cache of which database aliases have the FTS table, so we only introspect once per process
+_fts_available = {}
+
+CREATE_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, phone, membership_number,
+        content='studio_student', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON studio_student BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, phone, membership_number)
+        VALUES (new.id, new.name, new.phone, new.membership_number);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON studio_student BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, phone, membership_number)
+        VALUES ('delete', old.id, old.name, old.phone, old.membership_number);
+    END""",
+    # Only changes to the searchable columns touch the index, so updates to classes_left (credit compaction) don't
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, phone, membership_number ON studio_student BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, phone, membership_number)
+        VALUES ('delete', old.id, old.name, old.phone, old.membership_number);
+        INSERT INTO {FTS_TABLE}(rowid, name, phone, membership_number)
+        VALUES (new.id, new.name, new.phone, new.membership_number);
+    END""",
+    # Backfill the index from the rows already in studio_student
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def create_search_index(schema_editor):
+    """
+    Create (or re-create) the FTS table and its triggers, then rebuild it from studio_student.
+    Call this from any migration that rebuilds the studio_student table on SQLite, because
+    dropping the old table drops its triggers along with it.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        for statement in CREATE_SQL:
+            schema_editor.execute(statement)
+    except OperationalError:
+        # SQLite was built without FTS5 or the trigram tokenizer; search falls back to icontains
+        for statement in DROP_SQL:
+            schema_editor.execute(statement)
+    _fts_available.pop(schema_editor.connection.alias, None)
+
+
+def drop_search_index(schema_editor):
+    """Remove the FTS table and its triggers."""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+    _fts_available.pop(schema_editor.connection.alias, None)
+
+
+def fts_available(using='default'):
+    """Return True if the given database has the FTS search table."""
+    if using not in _fts_available:
+        connection = connections[using]
+        _fts_available[using] = (
+            connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _fts_available[using]
+
+
+def match_expression(query):
+    """Quote the user's input as a single FTS phrase, so operators in it are treated as text."""
+    return '"%s"' % query.replace('"', '""')
+
+
+def _can_use_fts(query, using):
+    return len(query) >= MIN_QUERY_LENGTH and fts_available(using)
+
+
+def filter_students(queryset, query):
+    """
+    Narrow a Student queryset to rows whose name, phone or membership number contains `query`.
+    The queryset keeps its own ordering, so it can still be paginated by name.
+    """
+    query = query.strip()
+    if not query:
+        return queryset
+    if _can_use_fts(query, queryset.db):
+        return queryset.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match_expression(query)]
+        ))
+    return queryset.filter(
+        Q(name__icontains=query) | Q(phone__icontains=query) | Q(membership_number__icontains=query)
+    )
+
+
+def search_students(query, limit=20, using='default'):
+    """Return a list of up to `limit` students matching `query`, best matches first."""
+    query = query.strip()
+    if not query:
+        return []
+    if not _can_use_fts(query, using):
+        return list(filter_students(Student.objects.using(using), query).order_by('name', 'id')[:limit])
+
+    with connections[using].cursor() as cursor:
+        # bm25() ranks rows where the match covers more of a short column (e.g. an exact phone) first
+        cursor.execute(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s",
+            [match_expression(query), limit],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+    students = Student.objects.using(using).in_bulk(ids)
+    return [students[pk] for pk in ids if pk in students]
@@ -0,0 +1,104 @@
+import datetime
+
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .autocomplete import student_changed, student_removed
+from .changes import STUDENTS, CLASSES, student_scope, touch
+from .db import configure_connection
+from .events import publish_on_commit
+from .middleware import install_query_recorder
+from .models import Student, DanceClass, Attendance, ArchivedAttendance
+from .rollups import adjust_occupancy, adjust_monthly_visits
+from .schedule import invalidate_schedule_index
+
+# Signal receivers that keep the studio's in-memory caches in step with the database.
+# They are connected when the app is ready (see StudioConfig.ready).
+
+# Apply the SQLite pragmas from settings to every new database connection
+connection_created.connect(configure_connection)
+
+# Let PerformanceMiddleware count the queries run on every connection, whichever thread opens it
+connection_created.connect(install_query_recorder)
+
+@receiver([post_save, post_delete], sender=DanceClass)
+def dance_class_changed(sender, **kwargs):
+    """Rebuild the check-in timetable after a class is added, edited or removed."""
+    invalidate_schedule_index()
+
+@receiver(post_save, sender=Student)
+def student_saved(sender, instance, **kwargs):
+    """Keep the type-ahead index up to date with a new or edited student."""
+    student_changed(instance)
+
+@receiver(post_delete, sender=Student)
+def student_deleted(sender, instance, **kwargs):
+    """Stop suggesting a removed student."""
+    student_removed(instance.pk)
+
+
+# The check-in engine maintains the counters and rollups itself with raw SQL, which sends no signals.
+# These receivers cover attendance added, moved or removed through the ORM, e.g. in the admin.
+
+@receiver(pre_save, sender=Attendance)
+def remember_attendance_class(sender, instance, **kwargs):
+    """Note which class an existing attendance row belonged to before it is saved."""
+    if instance.pk:
+        instance._previous_class_id = (
+            Attendance.objects.filter(pk=instance.pk).values_list('dance_class_id', flat=True).first()
+        )
+
+@receiver(post_save, sender=Attendance)
+def attendance_saved(sender, instance, created, **kwargs):
+    """Count a new attendance row, or move it between classes if its class changed."""
+    previous_class_id = getattr(instance, '_previous_class_id', None)
+    if created:
+        adjust_occupancy(instance.dance_class_id, instance.date, 1)
+        adjust_monthly_visits(instance.student_id, instance.date, 1)
+    elif previous_class_id and previous_class_id != instance.dance_class_id:
+        adjust_occupancy(previous_class_id, instance.date, -1)
+        adjust_occupancy(instance.dance_class_id, instance.date, 1)
+
+@receiver(post_delete, sender=Attendance)
+@receiver(post_delete, sender=ArchivedAttendance)
+def attendance_deleted(sender, instance, **kwargs):
+    """Stop counting a removed attendance row, live or archived."""
+    adjust_occupancy(instance.dance_class_id, instance.date, -1)
+    adjust_monthly_visits(instance.student_id, instance.date, -1)
+
+
+# Change markers let the kiosk pages answer 304 Not Modified (see studio.changes).
+
+@receiver([post_save, post_delete], sender=DanceClass)
+def touch_classes(sender, **kwargs):
+    """Class names appear on the pages, so a class change invalidates them."""
+    touch(CLASSES)
+
+@receiver([post_save, post_delete], sender=Student)
+def touch_student(sender, instance, **kwargs):
+    """Mark the student list and this student's page as changed."""
+    touch(STUDENTS, student_scope(instance.pk))
+
+@receiver([post_save, post_delete], sender=Attendance)
+@receiver(post_delete, sender=ArchivedAttendance)
+def touch_student_attendance(sender, instance, **kwargs):
+    """Mark the attendance totals and the student's history as changed."""
+    touch(STUDENTS, student_scope(instance.student_id))
+
+
+# Desk screens showing live occupancy hear about attendance changed through the ORM too (see studio.events).
+
+@receiver(post_save, sender=Attendance)
+def announce_attendance_saved(sender, instance, created, using, **kwargs):
+    """Announce a new attendance row as a check-in, or an edited one as a change to its class's head count."""
+    if created:
+        publish_on_commit([(instance.student_id, instance.dance_class_id, datetime.datetime.combine(instance.date, instance.time))], using=using)
+    else:
+        previous_class_id = getattr(instance, '_previous_class_id', None) or instance.dance_class_id
+        publish_on_commit(classes=[(previous_class_id, instance.date), (instance.dance_class_id, instance.date)], using=using)
+
+@receiver(post_delete, sender=Attendance)
+def announce_attendance_deleted(sender, instance, using, **kwargs):
+    """Announce the new head count of the class a removed attendance row counted towards."""
+    publish_on_commit(classes=[(instance.dance_class_id, instance.date)], using=using)
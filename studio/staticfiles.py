@@ -0,0 +1,101 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # Brotli variants are only written when the brotli package is installed
+    brotli = None
+
+# This module is the static file pipeline used when STUDIO_STATIC_PIPELINE is on.
+# "manage.py collectstatic" copies the files into STATIC_ROOT under content-hashed names (so
+# {% static %} links change whenever a file does), writes gzip and brotli copies of the text
+# files next to them, and records everything the server needs to know about each file in
+# SERVE_MANIFEST: its content type, ETag and the compressed copies available.
+# StaticFilesMiddleware (see studio.middleware) loads that manifest and the files once at startup
+# and answers /static/ requests from memory, before any other middleware or view runs.
+
+SERVE_MANIFEST = 'studio-static.json'
+
+# Files worth compressing; images and fonts are compressed already
+COMPRESSIBLE = {'.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml', '.ico'}
+# Below this many bytes compression saves less than the extra header costs
+MIN_COMPRESS_SIZE = 256
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage that also writes .gz and .br copies of text files and the
+    SERVE_MANIFEST read by StaticFilesMiddleware.
+    """
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        # Serve both the hashed names the templates link to and the plain names, for anything that
+        # links to a static file directly
+        names = set(paths) | {self.stored_name(name) for name in paths}
+        served = {}
+        for name in sorted(names):
+            if not self.exists(name):
+                continue
+            with self.open(name) as handle:
+                content = handle.read()
+            served[name] = {
+                'type': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                'etag': hashlib.md5(content, usedforsecurity=False).hexdigest()[:16],
+                'immutable': name not in paths,
+                'encodings': self._compress(name, content),
+            }
+        if self.exists(SERVE_MANIFEST):
+            self.delete(SERVE_MANIFEST)
+        self._save(SERVE_MANIFEST, ContentFile(json.dumps({'files': served}, sort_keys=True).encode()))
+
+    def _compress(self, name, content):
+        """Write the compressed copies of `name` that are worth having, returning {encoding: file name}."""
+        if os.path.splitext(name)[1].lower() not in COMPRESSIBLE or len(content) < MIN_COMPRESS_SIZE:
+            return {}
+        variants = {'gzip': (name + '.gz', gzip.compress(content, compresslevel=9, mtime=0))}
+        if brotli:
+            variants['br'] = (name + '.br', brotli.compress(content))
+        encodings = {}
+        for encoding, (variant, data) in variants.items():
+            # A copy that is barely smaller isn't worth the extra work of choosing it
+            if len(data) < len(content) * 0.95:
+                if self.exists(variant):
+                    self.delete(variant)
+                self._save(variant, ContentFile(data))
+                encodings[encoding] = variant
+        return encodings
+
+
+def load_static_files(root=None):
+    """
+    Read SERVE_MANIFEST and every file it lists from STATIC_ROOT into memory.
+    Returns {name: {'type', 'etag', 'immutable', 'bodies': {encoding: bytes}}}, or None if
+    collectstatic has not written the manifest.
+    """
+    root = root or settings.STATIC_ROOT
+    try:
+        with open(os.path.join(root, SERVE_MANIFEST)) as handle:
+            manifest = json.load(handle)['files']
+    except FileNotFoundError:
+        return None
+
+    def read(name):
+        with open(os.path.join(root, name), 'rb') as handle:
+            return handle.read()
+
+    files = {}
+    for name, entry in manifest.items():
+        bodies = {'identity': read(name)}
+        for encoding, variant in entry['encodings'].items():
+            bodies[encoding] = read(variant)
+        files[name] = {'type': entry['type'], 'etag': entry['etag'], 'immutable': entry['immutable'], 'bodies': bodies}
+    return files
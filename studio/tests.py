@@ -1,3 +1,1046 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime
+import gzip
+import io
+import json
+import sqlite3
+import random
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.admin.models import LogEntry
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.storage import storages
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.test import AsyncClient, AsyncRequestFactory, Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import Http404, HttpResponse
+from django.urls import reverse
+from django.utils import timezone
+
+from . import async_views, autocomplete, checkin, checkin_queue, credits, db, events, exports, fragments, search
+from .benchmarks import SEED_END_DATE, seed, run_scenario, compare, _scenario_urls
+from .checkin import check_in_batch, check_in_student
+from .credits import LedgerContention, append_credit, find_discrepancies, ledger_heads, with_balance
+from .metrics import registry
+from .middleware import QueryRecorder, StaticFilesMiddleware
+from .models import (
+    Student, DanceClass, Attendance, ArchivedAttendance, ClassOccupancy, CreditEntry, ExportJob, StudentMonthlyAttendance,
+)
+from .schedule import ScheduleIndex, invalidate_schedule_index, parse_schedule
+from .search import filter_students
+
+
+class BenchmarkSuiteTests(TestCase):
+    """Smoke tests for the benchmark tooling, on a tiny data set."""
+    def test_seed_creates_requested_data(self):
+        counts = seed(students=20, classes=4, years=1, visits_per_week=1)
+        self.assertEqual(counts['students'], 20)
+        self.assertEqual(counts['classes'], 4)
+        self.assertEqual(counts['attendance'], Attendance.objects.count())
+        self.assertGreater(counts['attendance'], 0)
+
+    def test_scenarios_report_latency_and_queries(self):
+        seed(students=10, classes=2, years=1, visits_per_week=1)
+        user = User.objects.create_user('bench', is_staff=True)
+        for name in ['index', 'index_search', 'student_attendance_history', 'export_attendance_csv']:
+            with self.subTest(scenario=name):
+                stats = run_scenario(name, user, iterations=3)
+                self.assertEqual(stats['iterations'], 3)
+                self.assertGreater(stats['queries_per_request'], 0)
+                self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+
+    def test_same_seed_gives_the_same_workload(self):
+        seed(students=30, classes=2, years=1, visits_per_week=1)
+        self.assertLessEqual(Attendance.objects.order_by('-date').values_list('date', flat=True).first(), SEED_END_DATE)
+        for name in ['index_search', 'student_attendance_history']:
+            with self.subTest(scenario=name):
+                self.assertEqual(_scenario_urls(name, 10, random.Random(1)), _scenario_urls(name, 10, random.Random(1)))
+
+    def test_compare_flags_only_slowdowns_beyond_threshold(self):
+        baseline = {'scenarios': {'index': {'p50_ms': 10.0}, 'check_in': {'p50_ms': 10.0}}}
+        results = {'scenarios': {'index': {'p50_ms': 11.0}, 'check_in': {'p50_ms': 13.0}}}
+        self.assertEqual(compare(results, baseline, threshold=0.2), [('check_in', 10.0, 13.0)])
+
+
+def ledger_contended():
+    """Patch the ledger append so it never gets a number, as if other desks took each one first."""
+    return mock.patch.object(credits, 'append_sql', return_value=credits.append_sql().replace("WHERE s.id = %s", "WHERE s.id = %s AND 0 = 1"))
+
+
+class ScheduleTests(TestCase):
+    """Parsing free-text class schedules, and finding the class that is on at a given moment."""
+    def test_parses_the_documented_formats(self):
+        self.assertEqual(parse_schedule("Monday 17:00"), [(0, 17 * 60, 18 * 60)])
+        self.assertEqual(parse_schedule("Mon/Wed 18:00-19:30"), [(0, 18 * 60, 19 * 60 + 30), (2, 18 * 60, 19 * 60 + 30)])
+        self.assertEqual(parse_schedule("Tue, Thu 7pm-8:30pm; Saturday 10am"), [
+            (1, 19 * 60, 20 * 60 + 30), (3, 19 * 60, 20 * 60 + 30), (5, 10 * 60, 11 * 60),
+        ])
+        self.assertEqual([day for day, start, end in parse_schedule("Weekdays 12:00-13:00")], [0, 1, 2, 3, 4])
+        self.assertEqual(parse_schedule("Sat 9:00", default_minutes=90), [(5, 9 * 60, 10 * 60 + 30)])
+        self.assertEqual(parse_schedule(""), [])
+
+    def test_day_ranges_and_classes_past_midnight(self):
+        self.assertEqual(parse_schedule("Fri-Sun 22:00-1:00"), [(day, 22 * 60, 25 * 60) for day in (4, 5, 6)])
+        self.assertEqual([day for day, start, end in parse_schedule("Sat to Mon 10am")], [0, 5, 6])
+
+    def test_rejects_slots_it_cannot_understand(self):
+        for text in ["Someday 17:00", "Monday", "Monday 25:00", "Monday 13pm", "Monday 9:00-10:00-11:00"]:
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                parse_schedule(text)
+
+    def test_resolves_the_class_on_now_within_the_grace_periods(self):
+        early = DanceClass.objects.create(name='Basic - Jazz', schedule="Monday 18:00-19:00")
+        late = DanceClass.objects.create(name='Basic - Kpop', schedule="Monday 19:00-20:00")
+        night = DanceClass.objects.create(name='Basic - House', schedule="Sunday 23:30-0:30")
+        DanceClass.objects.create(name='Basic - Urban', schedule="whenever")
+        index = ScheduleIndex(DanceClass.objects.all(), grace_before=15, grace_after=15)
+        self.assertEqual(len(index), 3)
+        monday = datetime.datetime(2024, 1, 1)
+        self.assertEqual(index.resolve(monday.replace(hour=17, minute=50)), early)
+        # Both windows cover 18:55; the class starting nearest to it wins
+        self.assertEqual(index.resolve(monday.replace(hour=18, minute=55)), late)
+        self.assertEqual(index.resolve(monday.replace(hour=18, minute=5)), early)
+        self.assertIsNone(index.resolve(monday.replace(hour=20, minute=20)))
+        # Sunday night's class runs on past midnight into Monday
+        self.assertEqual(index.resolve(monday.replace(hour=0, minute=20)), night)
+
+
+class StudentSearchTests(TestCase):
+    """Student search through the FTS5 trigram table, and the icontains fallback."""
+    def setUp(self):
+        self.ann = Student.objects.create(name='Ann Smith', phone='555 0101', membership_number='M100')
+        self.bob = Student.objects.create(name='Bob Jones', phone='555 0202', membership_number='M200')
+
+    def found(self, query):
+        return sorted(filter_students(Student.objects.all(), query).values_list('name', flat=True))
+
+    def test_trigram_search_finds_any_substring(self):
+        self.assertTrue(search.fts_available())
+        self.assertEqual(self.found('smi'), ['Ann Smith'])
+        self.assertEqual(self.found('0202'), ['Bob Jones'])
+        self.assertEqual(self.found('m10'), ['Ann Smith'])
+        self.assertEqual([student.name for student in search.search_students('555 0')], ['Ann Smith', 'Bob Jones'])
+
+    def test_index_follows_updates_and_deletes(self):
+        # update() and delete() send no model signals; the triggers keep the index in step
+        Student.objects.filter(pk=self.ann.pk).update(name='Ann Brown')
+        self.assertEqual(self.found('smith'), [])
+        self.assertEqual(self.found('brown'), ['Ann Brown'])
+        Student.objects.filter(pk=self.bob.pk).delete()
+        self.assertEqual(self.found('jones'), [])
+
+    def test_search_operators_are_taken_as_text(self):
+        self.assertEqual(self.found('Ann" OR "Bob'), [])
+        self.assertEqual(self.found('Jones*'), [])
+
+    def test_short_queries_and_missing_table_fall_back_to_icontains(self):
+        self.assertEqual(self.found('bo'), ['Bob Jones'])
+        with mock.patch.dict(search._fts_available, {'default': False}):
+            self.assertEqual(self.found('smi'), ['Ann Smith'])
+            self.assertEqual([student.name for student in search.search_students('jon')], ['Bob Jones'])
+
+
+class CheckInEngineTests(TestCase):
+    """The check-in engine's result codes, and what each one leaves in the database."""
+    def setUp(self):
+        invalidate_schedule_index()
+        self.now = timezone.localtime()
+        self.dance_class = DanceClass.objects.create(
+            name='Basic - Jazz', style='Jazz', level='Basic', description='', schedule='', max_students=2,
+        )
+        self.ann = Student.objects.create(name='Ann', phone='1', membership_number='M1', classes_left=2)
+        self.bob = Student.objects.create(name='Bob', phone='2', membership_number='M2', classes_left=0)
+
+    def balance(self, student):
+        return with_balance(Student.objects.filter(pk=student.pk)).get().balance
+
+    def checked_in(self):
+        occupancy = ClassOccupancy.objects.filter(dance_class=self.dance_class, date=self.now.date()).first()
+        return occupancy.checked_in if occupancy else 0
+
+    def test_ledger_contention_is_reported_as_busy(self):
+        with ledger_contended(), self.assertRaises(checkin.CheckInBusy):
+            check_in_student(self.ann.pk, self.dance_class, self.now)
+        self.assertEqual(self.balance(self.ann), 2)
+        self.assertFalse(Attendance.objects.exists())
+
+    def test_check_in_spends_a_class_and_counts_the_student_in(self):
+        self.assertEqual(check_in_student(self.ann.pk, self.dance_class, self.now), checkin.CHECKED_IN)
+        self.assertEqual(self.balance(self.ann), 1)
+        self.assertEqual(Attendance.objects.filter(student=self.ann).count(), 1)
+        self.assertEqual(self.checked_in(), 1)
+
+    def test_second_check_in_to_the_same_class_is_a_harmless_duplicate(self):
+        check_in_student(self.ann.pk, self.dance_class, self.now)
+        self.assertEqual(check_in_student(self.ann.pk, self.dance_class, self.now), checkin.DUPLICATE)
+        self.assertEqual(self.balance(self.ann), 1)
+        self.assertEqual(Attendance.objects.filter(student=self.ann).count(), 1)
+        self.assertEqual(self.checked_in(), 1)
+
+    def test_student_without_classes_is_turned_away(self):
+        self.assertEqual(check_in_student(self.bob.pk, self.dance_class, self.now), checkin.NO_CLASSES_LEFT)
+        self.assertEqual(self.balance(self.bob), 0)
+        self.assertFalse(Attendance.objects.exists())
+
+    def test_full_class_turns_students_away_without_spending_a_class(self):
+        self.dance_class.max_students = 1
+        self.dance_class.save()
+        cat = Student.objects.create(name='Cat', phone='3', membership_number='M3', classes_left=1)
+        check_in_student(self.ann.pk, self.dance_class, self.now)
+        self.assertEqual(check_in_student(cat.pk, self.dance_class, self.now), checkin.CLASS_FULL)
+        self.assertEqual(self.balance(cat), 1)
+        self.assertEqual(self.checked_in(), 1)
+
+    def test_unknown_member(self):
+        self.assertEqual(check_in_student(999999, self.dance_class, self.now), checkin.UNKNOWN_MEMBER)
+
+    def test_batch_reports_each_item(self):
+        tomorrow = self.now + datetime.timedelta(days=1)
+        items = [
+            {'student_id': self.ann.pk, 'when': self.now},
+            {'membership_number': 'M1', 'when': self.now},
+            {'membership_number': 'M2', 'when': self.now},
+            {'membership_number': 'M9', 'when': self.now},
+            {'student_id': self.ann.pk, 'when': tomorrow},
+        ]
+        with mock.patch.object(checkin, 'resolve_dance_class', return_value=self.dance_class):
+            results = check_in_batch(items)
+        self.assertEqual([result['status'] for result in results], [
+            checkin.CHECKED_IN, checkin.DUPLICATE, checkin.NO_CLASSES_LEFT, checkin.UNKNOWN_MEMBER, checkin.CHECKED_IN,
+        ])
+        self.assertEqual(self.balance(self.ann), 0)
+        self.assertEqual(Attendance.objects.filter(student=self.ann).count(), 2)
+
+    def test_batch_and_desk_agree_when_the_last_class_is_spent(self):
+        # Cat spends their last class, then is scanned again for the same class: no classes left, by either path
+        cat = Student.objects.create(name='Cat', phone='3', membership_number='M3', classes_left=1)
+        self.assertEqual(check_in_student(cat.pk, self.dance_class, self.now), checkin.CHECKED_IN)
+        self.assertEqual(check_in_student(cat.pk, self.dance_class, self.now), checkin.NO_CLASSES_LEFT)
+        with mock.patch.object(checkin, 'resolve_dance_class', return_value=self.dance_class):
+            results = check_in_batch([{'student_id': cat.pk, 'when': self.now}])
+        self.assertEqual(results[0]['status'], checkin.NO_CLASSES_LEFT)
+
+    def test_batch_falls_back_to_one_at_a_time_on_a_conflict(self):
+        real_head = checkin.head
+
+        def racing_head(*ledger):
+            # Another desk spends one of Ann's classes between the batch's read and its insert
+            if not CreditEntry.objects.exists():
+                append_credit(self.ann.pk, CreditEntry.CHECK_IN, -1)
+            return real_head(*ledger)
+
+        with mock.patch.object(checkin, 'resolve_dance_class', return_value=self.dance_class), \
+                mock.patch.object(checkin, 'head', side_effect=racing_head), \
+                mock.patch.object(checkin, 'check_in_student', wraps=check_in_student) as one_at_a_time:
+            results = check_in_batch([{'student_id': self.ann.pk, 'when': self.now}])
+        self.assertEqual(one_at_a_time.call_count, 1)
+        self.assertEqual(results[0]['status'], checkin.CHECKED_IN)
+        # The rolled-back batch left nothing behind: one class spent, one attendance row, one head counted
+        self.assertEqual(self.balance(self.ann), 1)
+        self.assertEqual(Attendance.objects.filter(student=self.ann).count(), 1)
+        self.assertEqual(self.checked_in(), 1)
+
+
+@override_settings(STUDIO_SCANNER_TOKEN='scanner-secret')
+class BatchCheckInApiTests(TestCase):
+    """Who may post to the batch check-in API, which is exempt from CSRF for door scanners."""
+    def setUp(self):
+        self.client = Client(enforce_csrf_checks=True)
+        self.url = reverse('check_in_batch')
+        self.body = '{"check_ins": []}'
+
+    def test_scanner_token_is_accepted(self):
+        response = self.client.post(self.url, self.body, content_type='text/plain', HTTP_X_SCANNER_TOKEN='scanner-secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_entry_without_a_member_is_invalid(self):
+        body = '{"check_ins": [{}, {"membership_number": ""}, {"timestamp": "2025-06-01T18:02:00"}, {"membership_number": "M9"}]}'
+        response = self.client.post(self.url, body, content_type='text/plain', HTTP_X_SCANNER_TOKEN='scanner-secret')
+        self.assertEqual([result['status'] for result in response.json()['results']],
+                         [checkin.INVALID, checkin.INVALID, checkin.INVALID, checkin.UNKNOWN_MEMBER])
+
+    def test_session_of_a_non_staff_user_is_refused(self):
+        self.client.force_login(User.objects.create_user('member'))
+        response = self.client.post(self.url, self.body, content_type='text/plain')
+        self.assertEqual(response.status_code, 403)
+
+    def test_staff_session_needs_a_csrf_token(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.client.post(self.url, self.body, content_type='text/plain')
+        self.assertEqual(response.status_code, 403)
+        self.client.get(reverse('index'))
+        response = self.client.post(self.url, self.body, content_type='text/plain',
+                                    HTTP_X_CSRFTOKEN=self.client.cookies['csrftoken'].value)
+        self.assertEqual(response.status_code, 200)
+
+
+class DrainCheckInsTests(TestCase):
+    """The write-behind drainer rides out a locked database instead of crashing."""
+    def test_locked_database_is_retried_from_the_same_offset(self):
+        dance_class = DanceClass.objects.create(name='Basic - Jazz', style='Jazz', level='Basic', description='', schedule='')
+        ann = Student.objects.create(name='Ann', phone='1', membership_number='M1', classes_left=2)
+        real_batch = checkin_queue.check_in_batch
+        calls = []
+
+        def locked_once(items):
+            calls.append(items)
+            if len(calls) == 1:
+                raise OperationalError("database is locked")
+            return real_batch(items)
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(STUDIO_CHECKIN_JOURNAL=Path(directory) / 'journal.jsonl'), \
+                mock.patch.object(checkin, 'resolve_dance_class', return_value=dance_class), \
+                mock.patch.object(checkin_queue, 'check_in_batch', side_effect=locked_once):
+            checkin_queue.enqueue_check_in(ann.pk, timezone.localtime())
+            stderr = io.StringIO()
+            call_command('drain_checkins', once=True, interval=0, stdout=io.StringIO(), stderr=stderr)
+        self.assertIn("database is locked", stderr.getvalue())
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0], calls[1])
+        self.assertEqual(Attendance.objects.filter(student=ann).count(), 1)
+
+
+class AttendanceExportTests(TestCase):
+    """The streamed attendance CSV and its date, class and style filters."""
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        ann = Student.objects.create(name='Ann', phone='1', membership_number='M1')
+        jazz = DanceClass.objects.create(name='Basic - Jazz', style='Jazz', level='Basic')
+        self.kpop = DanceClass.objects.create(name='Basic - Kpop', style='Kpop', level='Basic')
+        for dance_class, date in ((jazz, datetime.date(2024, 1, 10)), (self.kpop, datetime.date(2024, 2, 10)), (jazz, datetime.date(2024, 3, 10))):
+            attendance = Attendance.objects.create(student=ann, dance_class=dance_class)
+            Attendance.objects.filter(pk=attendance.pk).update(date=date, time=datetime.time(18, 0))
+
+    def export(self, **filters):
+        response = self.client.get(reverse('export_attendance_csv'), filters)
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['Student Name', 'Membership Number', 'Class Name', 'Date', 'Time'])
+        return [(class_name, date) for name, number, class_name, date, time in rows[1:]]
+
+    def test_exports_everything_without_filters(self):
+        self.assertEqual(self.export(), [
+            ('Basic - Jazz', '2024-01-10'), ('Basic - Kpop', '2024-02-10'), ('Basic - Jazz', '2024-03-10'),
+        ])
+
+    def test_filters_by_date_range_class_and_style(self):
+        self.assertEqual(self.export(start='2024-02-01', end='2024-03-10'), [('Basic - Kpop', '2024-02-10'), ('Basic - Jazz', '2024-03-10')])
+        self.assertEqual(self.export(dance_class=self.kpop.pk), [('Basic - Kpop', '2024-02-10')])
+        self.assertEqual(self.export(style='Jazz', end='2024-02-01'), [('Basic - Jazz', '2024-01-10')])
+
+    def test_backwards_date_range_is_rejected(self):
+        response = self.client.get(reverse('export_attendance_csv'), {'start': '2024-03-01', 'end': '2024-02-01'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ArchiveTests(TestCase):
+    """Archiving old attendance, and the history page and export reading through to the archive."""
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.ann = Student.objects.create(name='Ann', phone='1', membership_number='M1')
+        jazz = DanceClass.objects.create(name='Basic - Jazz', style='Jazz', level='Basic')
+        self.recent = timezone.localdate() - datetime.timedelta(days=1)
+        for date in (datetime.date(2020, 1, 10), datetime.date(2020, 6, 10), self.recent):
+            attendance = Attendance.objects.create(student=self.ann, dance_class=jazz)
+            Attendance.objects.filter(pk=attendance.pk).update(date=date)
+
+    def archive(self, *args):
+        call_command('archive_attendance', *args, stdout=io.StringIO())
+
+    def test_old_rows_move_with_their_ids_and_the_rollups_stay(self):
+        ids = list(Attendance.objects.filter(date__lt=datetime.date(2021, 1, 1)).values_list('pk', flat=True))
+        occupancy = list(ClassOccupancy.objects.values_list('date', 'checked_in'))
+        self.archive('--before', '2021-01-01', '--batch-size', '1')
+        self.assertEqual(sorted(ArchivedAttendance.objects.values_list('pk', flat=True)), sorted(ids))
+        self.assertEqual(list(Attendance.objects.values_list('date', flat=True)), [self.recent])
+        self.assertEqual(list(ClassOccupancy.objects.values_list('date', 'checked_in')), occupancy)
+
+    def test_recent_days_cannot_be_archived(self):
+        with self.assertRaises(CommandError):
+            self.archive('--before', timezone.localdate().isoformat())
+
+    def test_history_and_export_include_archived_attendance(self):
+        self.archive('--before', '2021-01-01')
+        response = self.client.get(reverse('student_attendance_history', args=[self.ann.pk]))
+        self.assertEqual([record.date for record in response.context['page']],
+                         [self.recent, datetime.date(2020, 6, 10), datetime.date(2020, 1, 10)])
+        self.assertEqual(response.context['total_visits'], 3)
+
+        def exported_dates(**filters):
+            response = self.client.get(reverse('export_attendance_csv'), filters)
+            return [row[3] for row in csv.reader(io.StringIO(b''.join(response.streaming_content).decode()))][1:]
+
+        self.assertEqual(exported_dates(), ['2020-01-10', '2020-06-10', self.recent.isoformat()])
+        self.assertEqual(exported_dates(end='2020-03-01'), ['2020-01-10'])
+        self.assertEqual(exported_dates(start='2021-01-01'), [self.recent.isoformat()])
+
+
+class RollupTests(TestCase):
+    """The occupancy and monthly visit rollups, kept up as attendance changes and rebuilt on demand."""
+    def setUp(self):
+        self.ann = Student.objects.create(name='Ann', phone='1', membership_number='M1')
+        self.jazz = DanceClass.objects.create(name='Basic - Jazz', style='Jazz', level='Basic')
+        self.kpop = DanceClass.objects.create(name='Basic - Kpop', style='Kpop', level='Basic')
+
+    def occupancy(self):
+        return {(row.dance_class.name, row.date): row.checked_in for row in ClassOccupancy.objects.filter(checked_in__gt=0)}
+
+    def visits(self):
+        return dict(StudentMonthlyAttendance.objects.filter(visits__gt=0).values_list('month', 'visits'))
+
+    def test_attendance_saved_through_the_orm_is_counted(self):
+        today = timezone.localdate()
+        attendance = Attendance.objects.create(student=self.ann, dance_class=self.jazz)
+        self.assertEqual(self.occupancy(), {('Basic - Jazz', today): 1})
+        self.assertEqual(self.visits(), {today.replace(day=1): 1})
+        attendance.dance_class = self.kpop
+        attendance.save()
+        self.assertEqual(self.occupancy(), {('Basic - Kpop', today): 1})
+        attendance.delete()
+        self.assertEqual(self.occupancy(), {})
+        self.assertEqual(self.visits(), {})
+
+    def test_rebuild_counts_live_and_archived_attendance(self):
+        for dance_class, date in ((self.jazz, datetime.date(2024, 1, 10)), (self.kpop, datetime.date(2024, 2, 10))):
+            attendance = Attendance.objects.create(student=self.ann, dance_class=dance_class)
+            # Moved in time behind the rollups' back, so only a rebuild gets them right
+            Attendance.objects.filter(pk=attendance.pk).update(date=date)
+        ArchivedAttendance.objects.create(id=1000, student=self.ann, dance_class=self.jazz,
+                                          date=datetime.date(2023, 12, 5), time=datetime.time(18, 0))
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        self.assertEqual(self.occupancy(), {
+            ('Basic - Jazz', datetime.date(2023, 12, 5)): 1,
+            ('Basic - Jazz', datetime.date(2024, 1, 10)): 1,
+            ('Basic - Kpop', datetime.date(2024, 2, 10)): 1,
+        })
+        self.assertEqual(self.visits(), {
+            datetime.date(2023, 12, 1): 1, datetime.date(2024, 1, 1): 1, datetime.date(2024, 2, 1): 1,
+        })
+
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.client.get(reverse('reports'), {'start': '2024-01-01', 'end': '2024-02-29'})
+        self.assertEqual(response.context['total'], 2)
+        self.assertEqual([row['visits'] for row in response.context['top_students']], [2])
+
+
+class ExportJobTests(TestCase):
+    """Finished export jobs clean up the files of older ones, and only older ones."""
+    def test_older_job_finishing_last_keeps_the_newer_file(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(STUDIO_EXPORT_DIR=directory), \
+                mock.patch.object(exports.connections, 'close_all'):
+            older = ExportJob.objects.create(key='same-export', watermark='1', filters={}, format='csv')
+            newer = ExportJob.objects.create(key='same-export', watermark='2', filters={}, format='csv')
+            exports.run_export_job(newer.pk)
+            exports.run_export_job(older.pk)
+            older.refresh_from_db()
+            newer.refresh_from_db()
+            self.assertEqual((older.status, newer.status), (ExportJob.DONE, ExportJob.DONE))
+            self.assertTrue(Path(newer.file).exists())
+            # Finishing again as the newest job removes the older file
+            exports.run_export_job(newer.pk)
+            self.assertFalse(Path(older.file).exists())
+
+
+class StudentAdminTests(TestCase):
+    """Students and their credit ledger in the admin."""
+    def test_deleting_a_student_removes_their_ledger(self):
+        ann = Student.objects.create(name='Ann', phone='1', membership_number='M1')
+        append_credit(ann.pk, CreditEntry.PURCHASE, 30)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        url = reverse('admin:studio_student_delete', args=[ann.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.post(url, {'post': 'yes'})
+        self.assertRedirects(response, reverse('admin:studio_student_changelist'))
+        self.assertFalse(Student.objects.filter(pk=ann.pk).exists())
+        self.assertFalse(CreditEntry.objects.exists())
+
+    def test_ledger_entries_cannot_be_deleted_on_their_own(self):
+        ann = Student.objects.create(name='Ann', phone='1', membership_number='M1')
+        append_credit(ann.pk, CreditEntry.PURCHASE, 30)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        entry = CreditEntry.objects.get()
+        self.assertEqual(self.client.get(reverse('admin:studio_creditentry_delete', args=[entry.pk])).status_code, 403)
+
+    def test_refused_ledger_entry_is_not_logged_as_added(self):
+        ann = Student.objects.create(name='Ann', phone='1', membership_number='M1')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        url = reverse('admin:studio_creditentry_add')
+        data = {'student': ann.pk, 'kind': CreditEntry.ADJUSTMENT, 'delta': 5, 'note': ''}
+        for refusal in (mock.patch('studio.admin.append_credit', return_value=False), ledger_contended()):
+            with refusal:
+                response = self.client.post(url, data, follow=True)
+            self.assertRedirects(response, url)
+            self.assertEqual(len(response.context['messages']), 1)
+            self.assertNotIn("added successfully", response.content.decode())
+        self.assertFalse(CreditEntry.objects.exists())
+        self.assertFalse(LogEntry.objects.exists())
+
+
+class ImportStudentsTests(TestCase):
+    """The import_students command: batches, rejected rows, and topping up existing members."""
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.ann = Student.objects.create(name='Ann', phone='100', membership_number='M1')
+        append_credit(self.ann.pk, CreditEntry.PURCHASE, 10)
+
+    def run_import(self, name, text, *args):
+        path = self.directory / name
+        path.write_text(text)
+        stdout = io.StringIO()
+        call_command('import_students', str(path), *args, stdout=stdout)
+        rejects = self.directory / f'{name}.rejects.csv'
+        rejected = [(row['line'], row['reason']) for row in csv.DictReader(rejects.open())] if rejects.exists() else []
+        return stdout.getvalue(), rejected
+
+    def balances(self):
+        return dict(with_balance(Student.objects.all()).values_list('membership_number', 'balance'))
+
+    def test_valid_rows_are_created_and_the_rest_rejected(self):
+        output, rejected = self.run_import('students.csv', (
+            "name,phone,membership_number,classes_left\n"
+            "Bob,200,M2,30\n"
+            "Cat,300,M3,lots\n"
+            "Dan,400,M1,30\n"
+            "Eve,200,M5,30\n"
+            "Fay,600,M6,50\n"
+            "Gus,700,M6,30\n"
+        ), '--batch-size', '2')
+        self.assertIn("2 created, 0 topped up, 4 rejected", output)
+        self.assertEqual([line for line, reason in rejected], ['3', '4', '5', '7'])
+        self.assertIn("classes_left", rejected[0][1])
+        self.assertEqual(rejected[1][1], "Membership number already exists.")
+        self.assertEqual(rejected[2][1], "Phone already exists.")
+        self.assertEqual(rejected[3][1], "Membership number appears earlier in the file.")
+        self.assertEqual(self.balances(), {'M1': 10, 'M2': 30, 'M6': 50})
+        self.assertEqual(list(find_discrepancies()), [])
+
+    def test_upsert_tops_up_existing_members(self):
+        output, rejected = self.run_import('students.jsonl', (
+            '{"name": "Ann", "phone": "100", "membership_number": "M1", "classes_left": 30}\n'
+            '["not", "a", "row"]\n'
+            '{"name": "Ann", "phone": "200", "membership_number": "M1", "classes_left": 30}\n'
+            '{"name": "Bob", "phone": "300", "membership_number": "M2", "classes_left": 50}\n'
+        ), '--upsert')
+        self.assertIn("1 created, 1 topped up, 1 rejected", output)
+        self.assertEqual(rejected, [('2', "Not a valid row.")])
+        # Both of Ann's rows add to their balance, whichever phone each row gives
+        self.assertEqual(self.balances(), {'M1': 70, 'M2': 50})
+
+
+class LargeTableAdminTests(TestCase):
+    """The attendance changelist: joined rows, estimated counts, the date filter and student search."""
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.jazz = DanceClass.objects.create(name='Basic - Jazz', style='Jazz', level='Basic')
+
+    def add_attendance(self, count, year=2020):
+        for number in range(count):
+            student = Student.objects.create(name=f'Student {year} {number}', phone=f'{year}-{number}', membership_number=f'M{year}-{number}')
+            attendance = Attendance.objects.create(student=student, dance_class=self.jazz)
+            Attendance.objects.filter(pk=attendance.pk).update(date=datetime.date(year, 1, 1) + datetime.timedelta(days=number))
+
+    def changelist(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:studio_attendance_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl'], len(queries)
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        self.add_attendance(2)
+        few = self.changelist()[1]
+        self.add_attendance(30, year=2021)
+        self.assertEqual(self.changelist()[1], few)
+
+    @override_settings(STUDIO_ADMIN_EXACT_COUNT_LIMIT=5)
+    def test_big_counts_are_estimated_or_capped(self):
+        self.add_attendance(8)
+        Attendance.objects.filter(date=datetime.date(2020, 1, 2)).delete()
+        # The estimate is the span of the ids, so it still includes the deleted row
+        self.assertEqual(self.changelist()[0].result_count, 8)
+        self.assertEqual(self.changelist(period='2020')[0].result_count, 6)
+
+    def test_year_filter_and_student_search(self):
+        self.add_attendance(2)
+        self.add_attendance(3, year=2021)
+        self.assertEqual(self.changelist(period='2021')[0].result_count, 3)
+        cl, queries = self.changelist(q='Student 2021 1')
+        self.assertEqual([attendance.student.name for attendance in cl.result_list], ['Student 2021 1'])
+
+
+class CreditLedgerTests(TestCase):
+    """Balances kept in the credit ledger, and the commands that backfill, compact and check it."""
+    def setUp(self):
+        # Ann and Bob have balances from before the ledger; Cat has none
+        self.ann = Student.objects.create(name='Ann', phone='1', membership_number='M1', classes_left=2)
+        self.bob = Student.objects.create(name='Bob', phone='2', membership_number='M2', classes_left=5)
+        self.cat = Student.objects.create(name='Cat', phone='3', membership_number='M3', classes_left=0)
+
+    def balances(self):
+        return dict(with_balance(Student.objects.all()).values_list('name', 'balance'))
+
+    def test_debit_is_refused_at_zero(self):
+        self.assertTrue(append_credit(self.ann.pk, CreditEntry.CHECK_IN, -1))
+        self.assertTrue(append_credit(self.ann.pk, CreditEntry.CHECK_IN, -1))
+        self.assertFalse(append_credit(self.ann.pk, CreditEntry.CHECK_IN, -1))
+        self.assertFalse(append_credit(self.cat.pk, CreditEntry.CHECK_IN, -1))
+        self.assertEqual(self.balances()['Ann'], 0)
+        self.assertEqual(CreditEntry.objects.filter(student=self.ann).count(), 2)
+
+    def test_balance_matches_the_latest_entry(self):
+        append_credit(self.ann.pk, CreditEntry.CHECK_IN, -1)
+        append_credit(self.ann.pk, CreditEntry.PURCHASE, 30)
+        append_credit(self.cat.pk, CreditEntry.PURCHASE, 10)
+        append_credit(self.cat.pk, CreditEntry.ADJUSTMENT, -3)
+        heads = ledger_heads([self.ann.pk, self.bob.pk, self.cat.pk])
+        self.assertEqual(self.balances(), {'Ann': heads[self.ann.pk][1], 'Bob': heads[self.bob.pk][1], 'Cat': heads[self.cat.pk][1]})
+        self.assertEqual(self.balances(), {'Ann': 31, 'Bob': 5, 'Cat': 7})
+
+    def test_compaction_leaves_balances_unchanged(self):
+        append_credit(self.ann.pk, CreditEntry.CHECK_IN, -1)
+        append_credit(self.cat.pk, CreditEntry.PURCHASE, 10)
+        before = self.balances()
+        call_command('compact_credits', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(self.balances(), before)
+        self.assertEqual(
+            list(Student.objects.order_by('name').values_list('classes_left', 'credits_seq')), [(1, 1), (5, 0), (10, 1)],
+        )
+        # Entries after the snapshot still count
+        append_credit(self.cat.pk, CreditEntry.CHECK_IN, -1)
+        self.assertEqual(self.balances()['Cat'], 9)
+
+    def test_reconcile_writes_openings_only_for_students_with_a_balance(self):
+        append_credit(self.ann.pk, CreditEntry.CHECK_IN, -1)
+        before = self.balances()
+        call_command('reconcile_credits', stdout=io.StringIO())
+        openings = dict(CreditEntry.objects.filter(kind=CreditEntry.OPENING).values_list('student__name', 'balance'))
+        self.assertEqual(openings, {'Ann': 2, 'Bob': 5})
+        self.assertEqual(self.balances(), before)
+        self.assertEqual(list(find_discrepancies()), [])
+        # Running it again finds nothing left to backfill
+        call_command('reconcile_credits', stdout=io.StringIO())
+        self.assertEqual(CreditEntry.objects.filter(kind=CreditEntry.OPENING).count(), 2)
+
+    def test_losing_every_race_raises_ledger_contention(self):
+        with ledger_contended(), self.assertRaises(LedgerContention):
+            append_credit(self.ann.pk, CreditEntry.CHECK_IN, -1)
+        self.assertFalse(CreditEntry.objects.exists())
+
+    def test_corrupted_entry_is_reported(self):
+        append_credit(self.cat.pk, CreditEntry.PURCHASE, 10)
+        append_credit(self.cat.pk, CreditEntry.CHECK_IN, -1)
+        self.assertEqual(list(find_discrepancies()), [])
+        CreditEntry.objects.filter(student=self.cat, seq=2).update(balance=8)
+        self.assertEqual(list(find_discrepancies()), [(self.cat.pk, 2, "balance 8 should be 9")])
+        stdout = io.StringIO()
+        call_command('reconcile_credits', dry_run=True, stdout=stdout)
+        self.assertIn("Found 1 problem(s)", stdout.getvalue())
+
+
+def cursor(values):
+    """A pagination cursor, encoded as the pages do."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+class KeysetPaginationTests(TestCase):
+    """Paging through the index by (name, id) cursors, and ignoring cursors that don't decode."""
+    def setUp(self):
+        for number in range(5):
+            Student.objects.create(name=f'Student {number}', phone=str(number), membership_number=f'M{number}')
+
+    def names(self, response):
+        return [student.name for student in response.context['page']]
+
+    def test_pages_walk_forwards_and_back(self):
+        first = self.client.get(reverse('index'), {'page_size': 2})
+        self.assertEqual(self.names(first), ['Student 0', 'Student 1'])
+        second = self.client.get(reverse('index'), {'page_size': 2, 'after': first.context['page'].next_cursor})
+        self.assertEqual(self.names(second), ['Student 2', 'Student 3'])
+        back = self.client.get(reverse('index'), {'page_size': 2, 'before': second.context['page'].previous_cursor})
+        self.assertEqual(self.names(back), ['Student 0', 'Student 1'])
+
+    def test_students_sharing_a_name_are_neither_skipped_nor_repeated(self):
+        for number in range(5, 8):
+            Student.objects.create(name='Student 1', phone=str(number), membership_number=f'M{number}')
+        seen, after = [], None
+        while True:
+            response = self.client.get(reverse('index'), {'page_size': 2, **({'after': after} if after else {})})
+            seen += [student.pk for student in response.context['page']]
+            after = response.context['page'].next_cursor
+            if not after:
+                break
+        self.assertEqual(seen, list(Student.objects.order_by('name', 'pk').values_list('pk', flat=True)))
+
+    def test_bad_cursors_show_the_first_page(self):
+        for bad in [cursor(['a', {}]), cursor(['a', None]), cursor(['a']), cursor({'name': 'a'}), 'not-base64!']:
+            for direction in ['after', 'before']:
+                with self.subTest(cursor=bad, direction=direction):
+                    response = self.client.get(reverse('index'), {'page_size': 2, direction: bad})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(self.names(response), ['Student 0', 'Student 1'])
+
+
+class AttendanceHistoryPaginationTests(TestCase):
+    """The attendance history pages by (date, time, id) cursors, newest first."""
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.ann = Student.objects.create(name='Ann', phone='1', membership_number='M1')
+        dance_class = DanceClass.objects.create(name='Basic - Jazz', style='Jazz', level='Basic', description='', schedule='')
+        for day in range(1, 4):
+            attendance = Attendance.objects.create(student=self.ann, dance_class=dance_class)
+            # date and time are filled in on creation, so set them afterwards
+            Attendance.objects.filter(pk=attendance.pk).update(date=datetime.date(2024, 1, day), time=datetime.time(18))
+        self.url = reverse('student_attendance_history', args=[self.ann.pk])
+
+    def dates(self, response):
+        return [record.date.day for record in response.context['page']]
+
+    def test_pages_walk_newest_first(self):
+        first = self.client.get(self.url, {'page_size': 2})
+        self.assertEqual(self.dates(first), [3, 2])
+        second = self.client.get(self.url, {'page_size': 2, 'after': first.context['page'].next_cursor})
+        self.assertEqual(self.dates(second), [1])
+
+    def test_bad_cursors_show_the_first_page(self):
+        for bad in [['2024-01-01', '25:00', 1], ['bad', 'bad', 1], ['2024-01-01', '18:00', 'x'], [None, '18:00', 1]]:
+            with self.subTest(cursor=bad):
+                response = self.client.get(self.url, {'page_size': 2, 'after': cursor(bad)})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.dates(response), [3, 2])
+
+
+def database_locked():
+    """The error Django raises when SQLite's busy timeout runs out."""
+    cause = sqlite3.OperationalError("database is locked")
+    cause.sqlite_errorcode = sqlite3.SQLITE_BUSY
+    error = OperationalError(*cause.args)
+    error.__cause__ = cause
+    return error
+
+
+class ConditionalGetTests(TestCase):
+    """Pages answer 304 Not Modified until something they show changes."""
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.ann = Student.objects.create(name='Ann', phone='1', membership_number='M1')
+
+    def revalidate(self, url):
+        """Fetch `url` (twice, so the CSRF cookie is settled), then ask again with its ETag; returns the status."""
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.etag = response['ETag']
+        return self.client.get(url, headers={'if-none-match': self.etag}).status_code
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in [reverse('index'), reverse('student_attendance_history', args=[self.ann.pk]), reverse('export_attendance_csv')]:
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url), 304)
+
+    def test_history_changes_only_with_its_student(self):
+        url = reverse('student_attendance_history', args=[self.ann.pk])
+        self.assertEqual(self.revalidate(url), 304)
+        Student.objects.create(name='Bob', phone='2', membership_number='M2')
+        self.assertEqual(self.client.get(url, headers={'if-none-match': self.etag}).status_code, 304)
+        self.assertEqual(self.client.get(reverse('index'), headers={'if-none-match': self.etag}).status_code, 200)
+        self.ann.name = 'Ann Smith'
+        self.ann.save()
+        self.assertEqual(self.client.get(url, headers={'if-none-match': self.etag}).status_code, 200)
+
+    def test_check_in_changes_the_index(self):
+        DanceClass.objects.create(name='Basic - Jazz', style='Jazz', level='Basic')
+        append_credit(self.ann.pk, CreditEntry.PURCHASE, 5)
+        self.assertEqual(self.revalidate(reverse('index')), 304)
+        self.client.get(reverse('check_in', args=[self.ann.pk]))
+        self.assertTrue(Attendance.objects.filter(student=self.ann).exists())
+        # The check-in leaves a message to show, then the page has a new balance to show
+        self.assertEqual(self.client.get(reverse('index'), headers={'if-none-match': self.etag}).status_code, 200)
+        self.assertEqual(self.client.get(reverse('index'), headers={'if-none-match': self.etag}).status_code, 200)
+
+
+class CheckInViewTests(TestCase):
+    """What the desk is told when the database is too busy to take a check-in."""
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.ann = Student.objects.create(name='Ann', phone='1', membership_number='M1', classes_left=2)
+        DanceClass.objects.create(name='Basic - Jazz', style='Jazz', level='Basic', description='', schedule='')
+        invalidate_schedule_index()
+
+    def test_locked_database_is_reported_not_queued_without_write_behind(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(STUDIO_CHECKIN_WRITE_BEHIND=False, STUDIO_CHECKIN_JOURNAL=Path(directory) / 'journal.jsonl'), \
+                mock.patch.object(checkin, '_check_in_student', side_effect=database_locked()):
+            response = self.client.get(reverse('check_in', args=[self.ann.pk]), follow=True)
+            self.assertFalse(checkin_queue.journal_path().exists())
+        self.assertEqual([str(message) for message in response.context['messages']],
+                         ["The studio is busy right now; nothing was recorded. Please check in again."])
+
+    def test_other_database_errors_are_not_mistaken_for_a_lock(self):
+        with mock.patch.object(checkin, '_check_in_student', side_effect=OperationalError("no such table: studio_student")):
+            with self.assertRaises(OperationalError):
+                self.client.get(reverse('check_in', args=[self.ann.pk]))
+
+
+class AsyncViewTests(TestCase):
+    """The async views and the live event stream, called as an ASGI server would."""
+    def setUp(self):
+        invalidate_schedule_index()
+        self.staff = User.objects.create_user('staff', is_staff=True)
+        self.ann = Student.objects.create(name='Ann', phone='1', membership_number='M1')
+        Student.objects.create(name='Bob', phone='2', membership_number='M2')
+        append_credit(self.ann.pk, CreditEntry.PURCHASE, 5)
+
+    def request(self, path, data=None):
+        request = AsyncRequestFactory().get(path, data)
+        request.user, request.session = self.staff, SessionStore()
+        # What AuthenticationMiddleware would add, for the async login_required
+        request.auser = sync_to_async(lambda: self.staff)
+        request._messages = FallbackStorage(request)
+        return request
+
+    async def test_index_lists_and_searches_students(self):
+        response = await async_views.index(self.request(reverse('index'), {'query': 'ann'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Ann')
+        self.assertNotContains(response, 'Bob')
+
+    async def test_check_in_and_history(self):
+        response = await async_views.check_in(self.request(reverse('check_in', args=[self.ann.pk])), self.ann.pk)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(await Attendance.objects.filter(student=self.ann).aexists())
+        response = await async_views.student_attendance_history(
+            self.request(reverse('student_attendance_history', args=[self.ann.pk])), self.ann.pk,
+        )
+        self.assertContains(response, 'Total visits: 1')
+        with self.assertRaises(Http404):
+            await async_views.student_attendance_history(self.request(reverse('student_attendance_history', args=[999])), 999)
+
+    def test_event_stream_needs_asgi(self):
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('occupancy_events')).status_code, 501)
+
+    async def test_event_stream_sends_head_counts_then_live_events(self):
+        dance_class = await DanceClass.objects.acreate(name='Basic - Jazz', style='Jazz', level='Basic', max_students=10)
+        await ClassOccupancy.objects.acreate(dance_class=dance_class, date=timezone.localdate(), checked_in=3)
+        broker = events.InProcessBroker()
+        with mock.patch.object(async_views, 'get_broker', return_value=broker), \
+                mock.patch.object(async_views.connections, 'close_all'), \
+                override_settings(STUDIO_EVENT_KEEPALIVE=0.01):
+            response = await async_views.occupancy_events(self.request(reverse('occupancy_events')))
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            stream = aiter(response.streaming_content)
+            self.assertIn(b'event: snapshot', await anext(stream))
+            occupancy = (await anext(stream)).decode()
+            self.assertTrue(occupancy.startswith('event: occupancy\n'))
+            self.assertEqual(json.loads(occupancy.split('data: ')[1])['checked_in'], 3)
+            self.assertEqual(await anext(stream), b': keepalive\n\n')
+            broker.publish({'type': 'check_in', 'student': 'Ann'})
+            self.assertTrue((await anext(stream)).startswith(b'event: check_in\n'))
+
+
+class FragmentCacheTests(TestCase):
+    """Cached student rows and class choices, replaced as soon as what they show changes."""
+    def setUp(self):
+        fragments.fragment_cache().clear()
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.staff = User.objects.create_user('staff', is_staff=True)
+        self.ann = Student.objects.create(name='Ann', phone='1', membership_number='M1')
+        self.bob = Student.objects.create(name='Bob', phone='2', membership_number='M2')
+        append_credit(self.ann.pk, CreditEntry.PURCHASE, 5)
+
+    def rows(self, user=None):
+        return fragments.student_rows(with_balance(Student.objects.order_by('name')), user or self.staff)
+
+    def counts(self, fragment):
+        return tuple(registry.counter('studio_fragment_cache_total', fragment=fragment, result=result) for result in ('hit', 'miss'))
+
+    def test_rows_are_reused_until_their_student_changes(self):
+        self.rows()
+        self.assertEqual(self.counts('student_row'), (0, 2))
+        self.rows()
+        self.assertEqual(self.counts('student_row'), (2, 2))
+        self.bob.name = 'Bobby'
+        self.bob.save()
+        self.assertIn('Bobby', self.rows()[1])
+        self.assertEqual(self.counts('student_row'), (3, 3))
+
+    def test_check_in_replaces_the_row(self):
+        self.assertIn('<td>5</td>', self.rows()[0])
+        dance_class = DanceClass.objects.create(name='Basic - Jazz', style='Jazz', level='Basic')
+        self.assertEqual(check_in_student(self.ann.pk, dance_class), checkin.CHECKED_IN)
+        self.assertIn('<td>4</td>', self.rows()[0])
+
+    def test_rows_differ_for_visitors_and_staff(self):
+        self.assertIn('Check In', self.rows()[0])
+        self.assertNotIn('Check In', self.rows(AnonymousUser())[0])
+
+    def test_class_choices_follow_class_changes(self):
+        DanceClass.objects.create(name='Basic - Jazz', style='Jazz', level='Basic')
+        self.assertEqual([label for pk, label in fragments.class_choices()], ['Basic - Jazz (Basic - Jazz)'])
+        fragments.class_choices()
+        self.assertEqual(self.counts('class_choices'), (1, 1))
+        DanceClass.objects.create(name='Basic - Kpop', style='Kpop', level='Basic')
+        self.assertEqual(len(fragments.class_choices()), 2)
+        self.assertEqual(self.counts('class_choices'), (1, 2))
+
+
+class AutocompleteIndexTests(TestCase):
+    """The in-memory type-ahead index, and changes that arrive while it is being built."""
+    def setUp(self):
+        autocomplete.invalidate_autocomplete_index()
+        self.addCleanup(autocomplete.invalidate_autocomplete_index)
+        Student.objects.create(name='Ava Kim', phone='555 0101', membership_number='M1')
+
+    def names(self, query):
+        return [name for pk, name, phone, membership_number in autocomplete.get_autocomplete_index().lookup(query)]
+
+    def test_finds_students_by_any_word_phone_or_number(self):
+        self.assertEqual(self.names('kim'), ['Ava Kim'])
+        self.assertEqual(self.names('5550'), ['Ava Kim'])
+        self.assertEqual(self.names('m1'), ['Ava Kim'])
+        self.assertEqual(self.names('zz'), [])
+
+    def test_change_signalled_during_a_build_is_not_lost(self):
+        real_index = autocomplete.PrefixIndex
+
+        def slow_build(students):
+            index = real_index(students)
+            # Saved after the build read the roster, but before the new index replaces the old one
+            Student.objects.create(name='Ben Lee', phone='555 0202', membership_number='M2')
+            return index
+
+        with mock.patch.object(autocomplete, 'PrefixIndex', side_effect=slow_build):
+            autocomplete.get_autocomplete_index()
+        self.assertEqual(self.names('lee'), ['Ben Lee'])
+
+
+class DatabaseProfileTests(TestCase):
+    """Connection pragmas, and the router that sends read_only_view reads to the replica."""
+    def test_new_connections_get_the_configured_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], settings.STUDIO_SQLITE_PRAGMAS['busy_timeout'])
+
+    def test_replica_serves_only_studio_reads_inside_read_only_views(self):
+        router = db.ReadReplicaRouter()
+
+        @db.read_only_view
+        def view(request):
+            return router.db_for_read(Student), router.db_for_read(User), router.db_for_write(Student)
+
+        @db.read_only_view
+        async def async_view(request):
+            return await sync_to_async(router.db_for_read)(Student)
+
+        with mock.patch.object(db, 'replica_enabled', return_value=True):
+            self.assertEqual(view(None), (db.REPLICA, None, 'default'))
+            self.assertEqual(async_to_sync(async_view)(None), db.REPLICA)
+            self.assertIsNone(router.db_for_read(Student))
+        # Without a separate replica everything stays on the primary
+        self.assertFalse(db.replica_enabled())
+        self.assertEqual(view(None), (None, None, 'default'))
+        self.assertFalse(router.allow_migrate(db.REPLICA, 'studio'))
+
+
+class PerformanceMiddlewareTests(TestCase):
+    """Per-view query counts, under WSGI and under ASGI where views run on worker threads."""
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+        Student.objects.create(name='Ann', phone='1', membership_number='M1')
+
+    def queries(self, view):
+        return registry._views[view].queries
+
+    def test_counts_queries_under_wsgi(self):
+        self.assertEqual(Client().get(reverse('index')).status_code, 200)
+        self.assertGreater(self.queries('index'), 0)
+
+    def test_repeated_statement_is_found_at_the_threshold(self):
+        recorder = QueryRecorder()
+        for sql in ['SELECT 1', 'SELECT 2', 'SELECT 2', 'SELECT 2']:
+            recorder(lambda *args: None, sql, None, False, {})
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual(recorder.repeated_statement(3), ('SELECT 2', 3))
+        self.assertIsNone(recorder.repeated_statement(4))
+
+    @override_settings(STUDIO_N_PLUS_ONE_THRESHOLD=1, STUDIO_SERVER_TIMING=True)
+    def test_flagged_requests_are_logged_and_counted(self):
+        # At a threshold of one, any statement counts as repeated
+        with self.assertLogs('studio.performance', 'WARNING'):
+            response = Client().get(reverse('index'))
+        self.assertIn(f'desc="{self.queries("index")} queries"', response['Server-Timing'])
+        self.assertEqual(registry._views['index'].n_plus_one, 1)
+
+    def test_metrics_endpoint_is_for_staff_and_internal_addresses(self):
+        Client().get(reverse('index'))
+        self.assertEqual(Client(REMOTE_ADDR='203.0.113.5').get(reverse('metrics')).status_code, 403)
+        response = Client().get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('studio_request_duration_seconds_count{view="index"} 1', response.content.decode())
+        self.assertIn(f'studio_db_queries_total{{view="index"}} {self.queries("index")}', response.content.decode())
+
+    async def test_counts_queries_under_asgi(self):
+        response = await AsyncClient().get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(self.queries('index'), 0)
+
+
+class StaticFilesMiddlewareTests(TestCase):
+    """Collected static files served from memory, compressed, with long-lived or revalidated caching."""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        cls.enterClassContext(override_settings(STATIC_ROOT=directory.name, STUDIO_STATIC_PIPELINE=True, STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'studio.staticfiles.CompressedManifestStaticFilesStorage'},
+        }))
+        call_command('collectstatic', interactive=False, verbosity=0)
+        cls.content = (Path(directory.name) / 'admin/css/base.css').read_bytes()
+        cls.hashed = storages['staticfiles'].stored_name('admin/css/base.css')
+        # The hashed copy links to the hashed names of the images it uses
+        cls.hashed_content = (Path(directory.name) / cls.hashed).read_bytes()
+
+    def get(self, path, method='get', **headers):
+        middleware = StaticFilesMiddleware(lambda request: HttpResponse("from the view"))
+        return middleware(getattr(RequestFactory(), method)(path, headers=headers))
+
+    def test_hashed_names_are_compressed_and_immutable(self):
+        response = self.get(f'/static/{self.hashed}', accept_encoding='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.hashed_content)
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_plain_names_are_revalidated(self):
+        response = self.get('/static/admin/css/base.css', accept_encoding='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, self.content)
+        self.assertEqual(response['Cache-Control'], 'public, no-cache')
+        self.assertEqual(self.get('/static/admin/css/base.css', if_none_match=response['ETag']).status_code, 304)
+        head = self.get('/static/admin/css/base.css', method='head')
+        self.assertEqual((head.content, int(head['Content-Length'])), (b'', len(self.content)))
+
+    def test_other_requests_reach_the_views(self):
+        for path in ['/', '/static/missing.css']:
+            with self.subTest(path=path):
+                self.assertEqual(self.get(path).content, b"from the view")
+        with override_settings(STUDIO_STATIC_PIPELINE=False), self.assertRaises(MiddlewareNotUsed):
+            StaticFilesMiddleware(lambda request: HttpResponse())
 
-# Create your tests here.
@@ -1,14 +1,28 @@
+from django.conf import settings
 from django.urls import path
 from . import views  # Import views from the current directory
+from . import async_views
+
+# Under an ASGI server the busiest pages use their async versions (see studio.async_views)
+live = async_views if getattr(settings, 'STUDIO_ASYNC_VIEWS', False) else views
 
 urlpatterns = [
     # Define URL patterns for the studio app, mapping URLs to their corresponding views.
-    path('', views.index, name='index'),
-    path('check_in/<int:student_id>/', views.check_in, name='check_in'),
+    path('', live.index, name='index'),
+    path('check_in/<int:student_id>/', live.check_in, name='check_in'),
+    path('api/check_in/batch/', views.check_in_batch_api, name='check_in_batch'),
+    path('api/students/autocomplete/', views.student_autocomplete, name='student_autocomplete'),
+    path('api/occupancy/events/', async_views.occupancy_events, name='occupancy_events'),
+    path('api/check_in/queue/', views.checkin_queue_status, name='checkin_queue_status'),
     path('add_student/', views.add_student, name='add_student'),
     path('add_dance_class/', views.add_dance_class, name='add_dance_class'), 
     path('export_attendance_csv/', views.export_attendance_csv, name='export_attendance_csv'),
-    path('student/<int:student_id>/attendance/', views.student_attendance_history, name='student_attendance_history'),  # NEW
+    path('exports/', views.start_export_job, name='start_export_job'),
+    path('exports/<int:job_id>/', views.export_job_status, name='export_job_status'),
+    path('exports/<int:job_id>/download/', views.download_export, name='download_export'),
+    path('student/<int:student_id>/attendance/', live.student_attendance_history, name='student_attendance_history'),  # NEW
+    path('reports/', views.reports, name='reports'),
+    path('metrics', views.metrics, name='metrics'),
 ]
 
 # It includes paths for the index page, checking in students, adding new students, and exporting attendance data as CSV.
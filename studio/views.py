@@ -1,89 +1,199 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import Student, DanceClass, Attendance
-from .forms import StudentForm, DanceClassForm
-from django.db.models import Q
+from .models import Student, DanceClass, Attendance, ArchivedAttendance, ClassOccupancy, StudentMonthlyAttendance, ExportJob, CreditEntry
+from .forms import StudentForm, DanceClassForm, AttendanceExportForm, ExportJobForm, ReportForm
+from .autocomplete import get_autocomplete_index
+from .checkin_queue import enqueue_check_in, queue_status
+from .archive import attendance_sources
+from .changes import STUDENTS, CLASSES, conditional_on_changes, student_scope
+from .credits import append_credit, with_balance
+from .db import read_only_view
+from .exports import start_export, filters_from_form
+from .fragments import student_rows
+from .metrics import registry
+from .pagination import keyset_paginate
+from .rollups import month_start
+from .search import filter_students, search_students
+from .checkin import (
+    check_in_student, check_in_batch, resolve_dance_class, CheckInBusy,
+    CHECKED_IN, UNKNOWN_MEMBER, INVALID, RESULT_MESSAGES,
+)
 from django.db import IntegrityError, transaction
-from datetime import datetime
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
 import csv
-from django.http import HttpResponse
+import datetime
+import hmac
+import itertools
+import json
+import os
+from urllib.parse import urlencode
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse,
+)
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required  # NEW
 
+def today_occupancy():
+    """Live head count for today's classes, read from the per-day counters."""
+    return ClassOccupancy.objects.filter(date=timezone.localdate()).select_related('dance_class').order_by('dance_class__name')
+
+def index_context(request, query, page, occupancy):
+    """Template context for the index page, shared with the async version in studio.async_views."""
+    return {
+        'students': page,
+        # Rendered rows come from the fragment cache, re-rendered only for students who changed
+        'student_rows': student_rows(page, request.user),
+        'page': page,
+        'page_size': request.GET.get('page_size', ''),
+        'query': query,
+        'export_form': ExportJobForm() if request.user.is_authenticated else None,
+        'occupancy': occupancy,
+        # Desk screens follow check-ins live over the event stream, which needs the async server
+        'live_occupancy': getattr(settings, 'STUDIO_ASYNC_VIEWS', False),
+    }
+
+@read_only_view
+@conditional_on_changes(lambda request: [STUDENTS, CLASSES])
 def index(request):
     """Display the index page with a list of students and a search query."""
     query = request.GET.get('query', '')
-    students = Student.objects.filter(
-        Q(name__icontains=query) | Q(phone__icontains=query) | Q(membership_number__icontains=query)
-    ) if query else Student.objects.all()
-    return render(request, 'index.html', {'students': students, 'query': query})
+    # The search goes through the full-text index when the database has one
+    students = filter_students(with_balance(Student.objects.all()), query)
+    # Only one page of students is fetched, seeking by (name, id) instead of using OFFSET
+    page = keyset_paginate(students, ['name', 'id'], request)
+    return render(request, 'index.html', index_context(request, query, page, today_occupancy()))
+
+@login_required
+@read_only_view
+def student_autocomplete(request):
+    """Suggest students whose name, phone or membership number starts with `q`, as JSON, for the search box."""
+    query = request.GET.get('q', '').strip()
+    limit = getattr(settings, 'STUDIO_AUTOCOMPLETE_LIMIT', 10)
+    if not query:
+        return JsonResponse({'results': []})
+    index = get_autocomplete_index()
+    if index is not None:
+        matches = index.lookup(query, limit)
+    else:
+        # The roster is too big to keep in memory, so ask the database's search index instead
+        matches = [(student.pk, student.name, student.phone, student.membership_number)
+                   for student in search_students(query, limit, using=Student.objects.all().db)]
+    return JsonResponse({'results': [
+        {'id': pk, 'name': name, 'phone': phone, 'membership_number': membership_number}
+        for pk, name, phone, membership_number in matches
+    ]})
+
+def check_in_response(request, student_id):
+    """The work of the check_in view, shared with its async version in studio.async_views."""
+    now = timezone.localtime()
+
+    if getattr(settings, 'STUDIO_CHECKIN_WRITE_BEHIND', False):
+        # Queue the check-in for the drainer and let the member go straight away
+        enqueue_check_in(student_id, now)
+        messages.success(request, "Check-in received.")
+        return redirect('index')
+
+    # The engine spends the class and logs attendance in one short transaction
+    try:
+        result = check_in_student(student_id, resolve_dance_class(now), now)
+    except CheckInBusy:
+        # Other desks kept the database busy. Nothing was spent, and with write-behind off no drainer
+        # would pick up a queued check-in, so say so and let the desk try again
+        messages.error(request, "The studio is busy right now; nothing was recorded. Please check in again.")
+        return redirect('index')
+    if result == UNKNOWN_MEMBER:
+        raise Http404("No Student matches the given query.")
+    if result == CHECKED_IN:
+        messages.success(request, RESULT_MESSAGES[result])
+    else:
+        messages.warning(request, RESULT_MESSAGES[result])
+
+    # Redirect to the index page after check-in process is complete
+    return redirect('index')
 
 @login_required
 def check_in(request, student_id):
     """Check in a student, decrement their classes left, and log attendance."""
-    # Ensure the student exists
-    student = get_object_or_404(Student, id=student_id)  # TABLE 1: Fetching student by ID
-
-    with transaction.atomic():  # context manager ensures data integrity before committing changes
-        student.refresh_from_db()
-        if student.classes_left > 0:
-            student.classes_left -= 1
-            student.save()
-
-            now = datetime.now() 
-            current_hour = now.hour
-            current_weekday = now.strftime('%A')  # Get the current weekday
-
-            # Try to find a scheduled class for this time/weekday
-            weekday_map = {
-                'Monday': 'Jazz',
-                'Wednesday': 'Jazz',
-                'Friday': 'Jazz',
-                'Tuesday': 'Kpop',
-                'Thursday': 'Kpop'}
-            style = weekday_map.get(current_weekday)  # Default style based on weekday using a dictionary
-            if not style: # If not found, determine style based on hour
-                if current_hour == 17:
-                    style = 'Hip-hop'
-                elif current_hour == 18:
-                    style = 'House'
-                else:
-                    style = 'Urban'
-
-            if current_hour == 17:
-                level = 'Basic'
-            elif current_hour == 18:
-                level = 'Intermediate'
-            elif current_hour == 19:
-                level = 'Advanced'
-            else:
-                level = 'Unknown'
-
-            # TABLE 2: finding or creating a dance class
-            # Try to find a scheduled class from DB using only style and level
-            dance_class = DanceClass.objects.filter(style=style, level=level).first()
-            if not dance_class: 
-                # Fallback: create (or get) by class name, along with style and level
-                class_name = f"{level} - {style}"
-
-                dance_class, created = DanceClass.objects.get_or_create(
-                    name=class_name,
-                    defaults={
-                        "style": style,
-                        "level": level,
-                        "description": f"{level} {style} class",
-                        "schedule": f"{current_weekday} {current_hour}:00",
-                        "max_students": 20,
-                    }
-                )
-
-            # TABLE 3: logging attendance
-            # Creates a new Attendance record to log the student's check-in for the class.
-            try:
-                Attendance.objects.create(student=student, dance_class=dance_class)
-            except IntegrityError:
-                pass  # Silently ignore duplicate check-in for same class/date
+    return check_in_response(request, student_id)
 
-    # Redirect to the index page after check-in process is complete
-    return redirect('index') 
+def _scanner_authorized(request):
+    """Door scanners authenticate with the shared STUDIO_SCANNER_TOKEN in an X-Scanner-Token header."""
+    token = getattr(settings, 'STUDIO_SCANNER_TOKEN', None)
+    supplied = request.headers.get('X-Scanner-Token', '')
+    return bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+
+def _parse_check_in_item(entry, now):
+    """Turn one JSON entry into an item for check_in_batch(), or None if it is malformed."""
+    if not isinstance(entry, dict):
+        return None
+    student_id, number = entry.get('student_id'), entry.get('membership_number')
+    if student_id is not None and (not isinstance(student_id, int) or isinstance(student_id, bool)):
+        return None
+    if number is not None and not isinstance(number, str):
+        return None
+    if student_id is None and not number:
+        return None  # Nothing to say who is checking in
+
+    when = now
+    if entry.get('timestamp'):
+        try:
+            when = parse_datetime(str(entry['timestamp']))
+        except ValueError:
+            when = None
+        if when is None:
+            return None
+        if timezone.is_naive(when):
+            when = timezone.make_aware(when)
+        when = timezone.localtime(when)
+        # Scanner clocks can drift, but a check-in from the distant past or future is a mistake
+        skew = datetime.timedelta(seconds=getattr(settings, 'STUDIO_BATCH_CLOCK_SKEW', 24 * 60 * 60))
+        if abs(when - now) > skew:
+            return None
+    return {'student_id': student_id, 'membership_number': number, 'when': when}
+
+@csrf_exempt
+@require_POST
+def check_in_batch_api(request):
+    """
+    Check in a batch of students from a door scanner.
+    Expects {"check_ins": [{"membership_number": "M1", "timestamp": "2025-06-01T18:02:00"}, {"student_id": 7}, ...]}
+    and answers {"results": [{"status": "ok", ...}, ...]} with one result per entry, in order.
+    """
+    if _scanner_authorized(request):
+        return _check_in_batch(request)
+    # Without the token this is a browser post, so it gets the same CSRF check as any other form
+    return _staff_check_in_batch(request)
+
+@csrf_protect
+def _staff_check_in_batch(request):
+    """The batch API for staff browsers, authenticated by their session."""
+    if not (request.user.is_authenticated and request.user.is_staff):
+        return JsonResponse({'error': 'Authentication required.'}, status=403)
+    return _check_in_batch(request)
+
+def _check_in_batch(request):
+    """The work of check_in_batch_api, once the caller is authorized."""
+    try:
+        entries = json.loads(request.body).get('check_ins')
+    except (ValueError, AttributeError):
+        entries = None
+    if not isinstance(entries, list):
+        return JsonResponse({'error': 'Expected a JSON object with a "check_ins" list.'}, status=400)
+    max_items = getattr(settings, 'STUDIO_BATCH_CHECKIN_MAX', 500)
+    if len(entries) > max_items:
+        return JsonResponse({'error': f'At most {max_items} check-ins per request.'}, status=400)
+
+    now = timezone.localtime()
+    items = [_parse_check_in_item(entry, now) for entry in entries]
+    valid = [item for item in items if item is not None]
+    valid_results = iter(check_in_batch(valid))
+    results = [next(valid_results) if item is not None else {'status': INVALID} for item in items]
+    return JsonResponse({'results': results})
 
 @login_required
 def add_student(request):
@@ -91,7 +201,12 @@ def add_student(request):
         form = StudentForm(request.POST)
         if form.is_valid():
             try:
-                form.save()
+                # The classes bought go on the student's credit ledger, rather than straight into classes_left
+                student = form.save(commit=False)
+                purchased, student.classes_left = student.classes_left, 0
+                with transaction.atomic():
+                    student.save()
+                    append_credit(student.pk, CreditEntry.PURCHASE, purchased, note="First purchase")
                 return redirect('index')
             except IntegrityError:
                 form.add_error(None, "Phone or Membership number already exists.")
@@ -110,35 +225,180 @@ def add_dance_class(request):  # NEW: UI for staff to add classes
         form = DanceClassForm()
     return render(request, 'add_dance_class.html', {'form': form})
 
+# Number of attendance rows fetched from the database per round trip while streaming the export
+EXPORT_CHUNK_SIZE = 2000
+
+class Echo:
+    """A file-like object that hands back whatever is written, so csv.writer can feed a streaming response."""
+    def write(self, value):
+        return value
+
 @login_required
+@read_only_view
+@conditional_on_changes(lambda request: [STUDENTS, CLASSES])
 def export_attendance_csv(request):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="attendance.csv"'
+    """Stream attendance records as CSV, optionally filtered by date range, class and style."""
+    form = AttendanceExportForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
 
-    writer = csv.writer(response)
-    writer.writerow(['Student Name', 'Membership Number', 'Class Name', 'Date', 'Time'])
+    # The sources are pinned to a database now, because the rows are only read after the view has returned
+    sources = attendance_sources(form)
 
-    for record in Attendance.objects.select_related('student', 'dance_class').all():
-        writer.writerow([
-            record.student.name,
-            record.student.membership_number,
-            record.dance_class.name,
-            record.date,
-            record.time
-        ])
+    # Only the five exported columns are selected, and rows are read in chunks instead of all at once
+    rows = itertools.chain.from_iterable(
+        source.order_by('pk').values_list(
+            'student__name', 'student__membership_number', 'dance_class__name', 'date', 'time'
+        ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        for source in sources
+    )
 
+    writer = csv.writer(Echo())
+    header = ['Student Name', 'Membership Number', 'Class Name', 'Date', 'Time']
+    lines = itertools.chain([writer.writerow(header)], (writer.writerow(row) for row in rows))
+
+    response = StreamingHttpResponse(lines, content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="attendance.csv"'
     return response
 
 @login_required
+@require_POST
+def start_export_job(request):
+    """Stream the export straight away, or queue it as a background job and show its progress."""
+    form = ExportJobForm(request.POST)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+    filters = filters_from_form(form)
+    if request.POST.get('mode') != 'background':
+        query = urlencode({name: value for name, value in filters.items() if value})
+        return redirect(f"{reverse('export_attendance_csv')}?{query}" if query else reverse('export_attendance_csv'))
+
+    job = start_export(filters, form.cleaned_data['format'] or 'csv', request.user)
+    # A repeat request for data that has not changed since is served from the finished file
+    if job.status == ExportJob.DONE:
+        return redirect('download_export', job_id=job.pk)
+    return redirect('export_job_status', job_id=job.pk)
+
+@login_required
+def export_job_status(request, job_id):
+    """Show how far a background export has got, as a page that refreshes itself or as JSON."""
+    job = get_object_or_404(ExportJob, pk=job_id)
+    if not request.accepts('text/html'):
+        return JsonResponse({
+            'id': job.pk,
+            'status': job.status,
+            'format': job.format,
+            'rows_written': job.rows_written,
+            'total_rows': job.total_rows,
+            'progress': job.progress,
+            'error': job.error,
+            'download_url': reverse('download_export', args=[job.pk]) if job.status == ExportJob.DONE else None,
+        })
+    return render(request, 'export_job.html', {'job': job})
+
+@login_required
+def download_export(request, job_id):
+    """Send the file a finished background export produced."""
+    job = get_object_or_404(ExportJob, pk=job_id, status=ExportJob.DONE)
+    if not os.path.exists(job.file):
+        raise Http404("This export is no longer available; please request it again.")
+    content_types = {'csv': 'text/csv', 'csv.gz': 'application/gzip', 'parquet': 'application/vnd.apache.parquet'}
+    return FileResponse(
+        open(job.file, 'rb'), as_attachment=True, filename=f"attendance.{job.format}",
+        content_type=content_types.get(job.format, 'application/octet-stream'),
+    )
+
+HISTORY_ORDERING = ['-date', '-time', 'id']
+
+def history_sources(student):
+    """The student's attendance, live and archived, each read through its (student, date, time) index."""
+    return [
+        Attendance.objects.filter(student=student).select_related('dance_class'),
+        ArchivedAttendance.objects.filter(student=student).select_related('dance_class'),
+    ]
+
+def history_summary_queries(student):
+    """One grouped query per table: a row per style the student has attended, with visits in total and this month."""
+    month_start = timezone.localdate().replace(day=1)
+    return [
+        model.objects.filter(student=student).values('dance_class__style').annotate(
+            visits=Count('id'), this_month=Count('id', filter=Q(date__gte=month_start)),
+        ).order_by()
+        for model in (Attendance, ArchivedAttendance)
+    ]
+
+def history_context(request, student, page, summary_rows):
+    """Template context for the attendance history page, shared with the async version in studio.async_views."""
+    totals = {}
+    for row in summary_rows:
+        style_totals = totals.setdefault(row['dance_class__style'], {'visits': 0, 'this_month': 0})
+        style_totals['visits'] += row['visits']
+        style_totals['this_month'] += row['this_month']
+    by_style = sorted(totals.items(), key=lambda item: (-item[1]['visits'], item[0]))
+    return {
+        'student': student,
+        'attendance_records': page,
+        'page': page,
+        'page_size': request.GET.get('page_size', ''),
+        'total_visits': sum(style_totals['visits'] for style, style_totals in by_style),
+        'visits_this_month': sum(style_totals['this_month'] for style, style_totals in by_style),
+        'favourite_style': by_style[0][0] if by_style else None,
+    }
+
+@login_required
+@read_only_view
+@conditional_on_changes(lambda request, student_id: [student_scope(student_id), CLASSES])
 def student_attendance_history(request, student_id):
     """Display the attendance history for a specific student."""
     student = get_object_or_404(Student, id=student_id)
 
-    # Fetch attendance records for the student, ordered by date and time in descending order (most recent first, hence the dash sign)
-    attendance_records = Attendance.objects.filter(student=student).select_related('dance_class').order_by('-date', '-time') 
-    
+    # Fetch one page of attendance records, most recent first, from both the live table and the
+    # archive, merging the two
+    page = keyset_paginate(history_sources(student), HISTORY_ORDERING, request)
+    summary_rows = [row for queryset in history_summary_queries(student) for row in queryset]
+
     # Render the attendance history template with the student and their attendance records
-    return render(request, 'student_attendance_history.html', {
-        'student': student,
-        'attendance_records': attendance_records
-    })
\ No newline at end of file
+    return render(request, 'student_attendance_history.html', history_context(request, student, page, summary_rows))
+
+@login_required
+@read_only_view
+def reports(request):
+    """Staff dashboard of check-in totals, read from the rollup tables rather than Attendance."""
+    form = ReportForm(request.GET)
+    today = timezone.localdate()
+    start, end = today - datetime.timedelta(days=90), today
+    if form.is_valid():
+        start = form.cleaned_data['start'] or start
+        end = form.cleaned_data['end'] or end
+
+    occupancy = ClassOccupancy.objects.filter(date__gte=start, date__lte=end)
+    by_style_level = (occupancy.values('dance_class__style', 'dance_class__level')
+                      .annotate(checkins=Sum('checked_in')).order_by('dance_class__style', 'dance_class__level'))
+    by_class = (occupancy.values('dance_class__name', 'dance_class__style', 'dance_class__level')
+                .annotate(checkins=Sum('checked_in'), days=Count('id')).order_by('-checkins'))
+    # Monthly counts cover whole months, so the student table rounds the range out to month boundaries
+    top_students = (StudentMonthlyAttendance.objects
+                    .filter(month__gte=month_start(start), month__lte=end)
+                    .values('student__name', 'student__membership_number')
+                    .annotate(visits=Sum('visits')).order_by('-visits')[:20])
+
+    return render(request, 'reports.html', {
+        'form': form,
+        'start': start,
+        'end': end,
+        'total': sum(row['checkins'] for row in by_style_level),
+        'by_style_level': by_style_level,
+        'by_class': by_class,
+        'top_students': top_students,
+    })
+
+def metrics(request):
+    """Expose per-view performance metrics in the Prometheus text format to staff and INTERNAL_IPS."""
+    if not (request.user.is_staff or request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS):
+        return HttpResponseForbidden("Metrics are only available to staff and internal addresses.")
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@login_required
+def checkin_queue_status(request):
+    """Report how many write-behind check-ins are waiting and how long the oldest has waited."""
+    return JsonResponse(queue_status())
\ No newline at end of file